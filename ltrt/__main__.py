@@ -3,11 +3,15 @@ import time
 from pathlib import Path
 
 from ltrt.backend.run_realtime import run_realtime, shutdown_realtime
+from ltrt.system.path_utilities import create_new_recording_folder
 
 if __name__ == "__main__":
     stop_event = Event()
     calibration_toml_path = Path().home() /"freemocap_data/recording_sessions/freemocap_sample_data/freemocap_sample_data_camera_calibration.toml"
-    processes = run_realtime(calibration_toml_path, stop_event)
+    recording_folder = create_new_recording_folder()
+    # (first_frame, num_frames) to profile every process over those frames
+    profile_window = None
+    processes = run_realtime(calibration_toml_path, stop_event, recording_folder=recording_folder, profile_window=profile_window)
     while not stop_event.is_set():
         time.sleep(0.1)
-    shutdown_realtime(processes=processes)
\ No newline at end of file
+    shutdown_realtime(processes=processes, recording_folder=recording_folder)
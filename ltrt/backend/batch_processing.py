@@ -0,0 +1,337 @@
+import argparse
+from multiprocessing import Event, Process, Queue
+from pathlib import Path
+from queue import Empty, Queue as ThreadQueue
+import threading
+from time import perf_counter, perf_counter_ns
+from typing import Dict, List, Optional
+
+import numpy as np
+from aniposelib.cameras import CameraGroup
+
+from skellycam.core.frames.payloads.multi_frame_payload import MultiFramePayload
+from skellytracker.trackers.mediapipe_tracker.mediapipe_model_info import MediapipeModelInfo
+
+from freemocap.utilities.geometry.rotate_by_90_degrees_around_x_axis import (
+    rotate_by_90_degrees_around_x_axis,
+)
+from freemocap.core_processes.post_process_skeleton_data.post_process_skeleton import (
+    post_process_data,
+)
+from freemocap.data_layer.recording_models.post_processing_parameter_models import (
+    ProcessingParameterModel,
+)
+from freemocap.core_processes.process_motion_capture_videos.processing_pipeline_functions.anatomical_data_pipeline_functions import (
+    calculate_anatomical_data,
+)
+
+from ltrt.backend.pipeline_metrics import PipelineMetrics
+from ltrt.backend.realtime_pipeline import export_metrics, start_tracker_pool
+from ltrt.backend.reorder_buffer import ReorderBuffer
+from ltrt.backend.run_realtime import default_num_tracker_workers
+from ltrt.backend.startup import format_startup_report, image_shapes_from_calibration, wait_until_ready
+from ltrt.backend.tracker_output import mask_low_confidence
+from ltrt.backend.tracking_process import (
+    DEFAULT_MODEL_COMPLEXITY,
+    collect_results,
+    run_tracker,
+    send_multiframe_payload_shared_memory,
+)
+from ltrt.backend.triangulation import RealtimeTriangulator
+from ltrt.mock_data.replay_multiframe_payload import ReplayMultiFramePayload
+from ltrt.system.path_utilities import create_new_recording_folder
+from ltrt.system.streaming_npy_writer import StreamingNpyWriter
+
+
+def read_ahead(
+    synchronized_video_folder_path: Optional[str | Path],
+    payload_queue: ThreadQueue,
+    stop_event,
+    cache_path: Optional[str | Path] = None,
+    reader_errors: Optional[List[BaseException]] = None,
+) -> None:
+    """
+    Thread target that replays the synchronized videos (decoded in parallel, or from the `cache_path` decode cache)
+    into multiframe payloads as fast as it can, followed by None.
+    `payload_queue` is bounded, so it stays at most that many multiframes ahead of the pipeline.
+    If the replay fails, the error is appended to `reader_errors` for the pipeline to raise, and None is still sent.
+    """
+    try:
+        with ReplayMultiFramePayload(synchronized_video_folder_path, cache_path=cache_path) as replay:
+            while replay.current_payload is not None and not stop_event.is_set():
+                payload_queue.put(replay.current_payload)
+                replay.next_frame_payload()
+    except BaseException as error:
+        if reader_errors is not None:
+            reader_errors.append(error)
+        raise
+    finally:
+        payload_queue.put(None)
+
+
+def batch_pipeline(
+    triangulator: RealtimeTriangulator,
+    payload_queue: ThreadQueue,
+    tracking_job_queue: Queue,
+    tracking_result_queue: Queue,
+    tracker_setup_queue: Queue,
+    num_tracker_workers: int,
+    recording_folder: str | Path,
+    max_frames_in_flight: int = 8,
+    triangulation_batch_frames: int = 300,
+    model_complexity: int = DEFAULT_MODEL_COMPLEXITY,
+    min_confidence: Optional[float] = None,
+    reader_errors: Optional[List[BaseException]] = None,
+) -> PipelineMetrics:
+    """
+    Track every multiframe in `payload_queue` (until None) on the tracker pool, keeping up to `max_frames_in_flight`
+    of them with the trackers at once, and stream the triangulated frames to `3d_data_frames_markers_xyz.npy`
+    in `recording_folder`, like the realtime pipelines.
+
+    Nothing waits on the triangulated data, so the masked 2d keypoints are accumulated and triangulated
+    `triangulation_batch_frames` frames at a time, in one vectorized call per batch.
+
+    Raises the read-ahead thread's error (from `reader_errors`) once its None arrives, instead of saving a partial recording.
+    """
+    output_writer = StreamingNpyWriter(Path(recording_folder) / "3d_data_frames_markers_xyz.npy")
+    metrics = PipelineMetrics(quiet=True, report_interval_s=None)
+    reorder_buffer = ReorderBuffer()
+    frame_ring = None
+    keypoint_matrix = None
+    batch_keypoints = None
+    batch_length = 0
+    input_finished = False
+    try:
+        while not input_finished or len(reorder_buffer) > 0:
+            while not input_finished and len(reorder_buffer) < max_frames_in_flight:
+                try:
+                    if len(reorder_buffer) == 0:
+                        multiframe_payload: Optional[MultiFramePayload] = payload_queue.get(timeout=0.1)
+                    else:
+                        multiframe_payload = payload_queue.get_nowait()
+                except Empty:
+                    break
+                if multiframe_payload is None:
+                    if reader_errors:
+                        raise RuntimeError("Reading the recording failed") from reader_errors[0]
+                    input_finished = True
+                    break
+                if frame_ring is None:
+                    frame_ring, keypoint_matrix = start_tracker_pool(
+                        multiframe_payload=multiframe_payload,
+                        triangulator=triangulator,
+                        tracker_setup_queue=tracker_setup_queue,
+                        num_tracker_workers=num_tracker_workers,
+                        use_shared_memory=True,
+                        max_frames_in_flight=max_frames_in_flight,
+                    )
+                    batch_keypoints = np.empty(
+                        (triangulator.num_cameras, triangulation_batch_frames, MediapipeModelInfo.num_tracked_points, 2)
+                    )
+                slot = send_multiframe_payload_shared_memory(
+                    multiframe_payload=multiframe_payload,
+                    frame_ring=frame_ring,
+                    job_queue=tracking_job_queue,
+                    model_complexity=model_complexity,
+                )
+                reorder_buffer.add_frame(
+                    sequence_number=multiframe_payload.multi_frame_number,
+                    slot=slot,
+                    camera_ids=set(multiframe_payload.frames.keys()),
+                    send_time_ns=perf_counter_ns(),
+                )
+
+            if len(reorder_buffer) == 0:
+                continue
+            collect_results(result_queue=tracking_result_queue, reorder_buffer=reorder_buffer)
+            for in_flight_frame in reorder_buffer.pop_ready():
+                metrics.record_ns("tracking", in_flight_frame.send_time_ns, max(in_flight_frame.result_times_ns.values()))
+                metrics.record_camera_results(
+                    send_time_ns=in_flight_frame.send_time_ns, result_times_ns=in_flight_frame.result_times_ns
+                )
+                # copied out of the keypoint matrix, its slot is reused by the next multiframe sent
+                batch_keypoints[:, batch_length] = mask_low_confidence(
+                    keypoints=keypoint_matrix.read(in_flight_frame.slot, sequence_number=in_flight_frame.sequence_number), min_confidence=min_confidence
+                )
+                batch_length += 1
+                if batch_length == triangulation_batch_frames:
+                    triangulate_batch(triangulator, batch_keypoints, output_writer, metrics)
+                    batch_length = 0
+                metrics.frame_finished(perf_counter_ns())
+
+        if batch_length > 0:
+            triangulate_batch(triangulator, batch_keypoints[:, :batch_length], output_writer, metrics)
+    finally:
+        if frame_ring is not None:
+            for shared_block in (frame_ring, keypoint_matrix):
+                shared_block.close()
+                shared_block.unlink()
+        output_writer.close()
+
+    print(f"Saved triangulated data with shape {output_writer.shape} to {output_writer.file_path}")
+    return metrics
+
+
+def triangulate_batch(
+    triangulator: RealtimeTriangulator,
+    keypoints: np.ndarray,
+    output_writer: StreamingNpyWriter,
+    metrics: PipelineMetrics,
+) -> None:
+    """Triangulate (cameras, frames, markers, 2) keypoints in one call and queue each (markers, 3) frame to be written"""
+    start_triangulate = perf_counter_ns()
+    triangulated_data = triangulator.triangulate(keypoints)
+    metrics.record_ns("triangulation", start_triangulate, perf_counter_ns())
+    for frame in triangulated_data:
+        output_writer.append(frame)
+
+
+def post_process_recording(triangulated_data: np.ndarray) -> Dict[str, np.ndarray]:
+    """Run freemocap's batch post processing (rotation, gap filling and filtering) and anatomical calculations once on a whole recording"""
+    recording_parameter_model = ProcessingParameterModel()
+    rotated_data = rotate_by_90_degrees_around_x_axis(triangulated_data)
+    post_processed_data = post_process_data(
+        recording_processing_parameter_model=recording_parameter_model,
+        raw_skel3d_frame_marker_xyz=rotated_data,
+        queue=None,
+    )
+    anatomical_data_dict = calculate_anatomical_data(
+        processing_parameters=recording_parameter_model,
+        skel3d_frame_marker_xyz=post_processed_data,
+        queue=None,
+    )
+    return {"post_processed_data": post_processed_data, **anatomical_data_dict}
+
+
+def run_batch(
+    calibration_toml_path: str | Path,
+    synchronized_video_folder_path: Optional[str | Path] = None,
+    recording_folder: Optional[str] = None,
+    num_tracker_workers: Optional[int] = None,
+    read_ahead_frames: int = 32,
+    cache_path: Optional[str | Path] = None,
+    max_frames_in_flight: int = 8,
+    triangulation_batch_frames: int = 300,
+    model_complexity: int = DEFAULT_MODEL_COMPLEXITY,
+    min_confidence: Optional[float] = None,
+    run_post_processing: bool = True,
+    startup_timeout_s: float = 120.0,
+) -> Dict[str, np.ndarray]:
+    """
+    Process a whole recording of synchronized videos as fast as possible, returns the post processed data.
+
+    Unlike `run_realtime`, the videos aren't paced to a frame rate: a read-ahead thread decodes up to
+    `read_ahead_frames` multiframes ahead (or reads them from the `cache_path` decode cache, which the first run writes), and the same tracker pool as the realtime pipelines is kept busy
+    with up to `max_frames_in_flight` multiframes at once. The 2d keypoints are triangulated in batches of
+    `triangulation_batch_frames` frames and streamed to `3d_data_frames_markers_xyz.npy` in `recording_folder`,
+    the same file the realtime pipelines write. Then freemocap's batch post processing runs once over the whole
+    recording (unless `run_post_processing` is False), and the post processed data is saved next to it.
+    """
+    camera_group = CameraGroup.load(str(calibration_toml_path))
+    triangulator = RealtimeTriangulator(camera_group=camera_group)
+    if recording_folder is None:
+        recording_folder = create_new_recording_folder()
+    Path(recording_folder).mkdir(parents=True, exist_ok=True)
+    print(f"saving output to {recording_folder}")
+    if num_tracker_workers is None:
+        num_tracker_workers = default_num_tracker_workers(
+            num_cameras=len(camera_group.cameras), max_frames_in_flight=max_frames_in_flight
+        )
+
+    stop_event = Event()
+    ready_queue = Queue()
+    tracking_job_queue = Queue()
+    tracking_result_queue = Queue()
+    tracker_setup_queue = Queue()
+    warmup_image_shapes = image_shapes_from_calibration(camera_group)
+    print(f"creating {num_tracker_workers} tracking processes")
+    tracker_processes = {
+        f"tracker_{worker_index}": Process(
+            target=run_tracker,
+            args=[tracking_job_queue, tracking_result_queue, tracker_setup_queue, stop_event],
+            kwargs={
+                "ready_queue": ready_queue,
+                "warmup_image_shapes": warmup_image_shapes,
+                "role": f"tracker_{worker_index}",
+                "model_complexities": (model_complexity,),
+            },
+        ) for worker_index in range(num_tracker_workers)
+    }
+    for process in tracker_processes.values():
+        process.start()
+
+    payload_queue = ThreadQueue(maxsize=read_ahead_frames)
+    reader_errors = []
+    reader_thread = threading.Thread(
+        target=read_ahead,
+        args=(synchronized_video_folder_path, payload_queue, stop_event, cache_path, reader_errors),
+        name="read_ahead",
+        daemon=True,
+    )
+    try:
+        print(format_startup_report(
+            wait_until_ready(ready_queue=ready_queue, processes=tracker_processes, timeout_s=startup_timeout_s)
+        ))
+        start = perf_counter()
+        reader_thread.start()
+        metrics = batch_pipeline(
+            triangulator=triangulator,
+            payload_queue=payload_queue,
+            tracking_job_queue=tracking_job_queue,
+            tracking_result_queue=tracking_result_queue,
+            tracker_setup_queue=tracker_setup_queue,
+            num_tracker_workers=num_tracker_workers,
+            recording_folder=recording_folder,
+            max_frames_in_flight=max_frames_in_flight,
+            triangulation_batch_frames=triangulation_batch_frames,
+            model_complexity=model_complexity,
+            min_confidence=min_confidence,
+            reader_errors=reader_errors,
+        )
+    finally:
+        # stops the read-ahead thread too
+        stop_event.set()
+        for process in tracker_processes.values():
+            process.join()
+    elapsed_s = perf_counter() - start
+    frames = metrics.current_snapshot()["frames"]
+    print(f"tracked and triangulated {frames} frames in {elapsed_s:.2f} s ({frames / elapsed_s:.1f} frames per second)")
+    export_metrics(metrics=metrics, recording_folder=recording_folder)
+
+    if not run_post_processing:
+        return {}
+    start_postprocessing = perf_counter()
+    triangulated_data = np.load(Path(recording_folder) / "3d_data_frames_markers_xyz.npy")
+    post_processed = post_process_recording(triangulated_data)
+    post_processed_path = Path(recording_folder) / "post_processed_3d_data_frames_markers_xyz.npy"
+    np.save(post_processed_path, post_processed["post_processed_data"])
+    print(f"post processing took {perf_counter() - start_postprocessing:.2f} s, saved to {post_processed_path}")
+    return post_processed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process a recording's synchronized videos offline, as fast as possible")
+    parser.add_argument("calibration_toml_path")
+    parser.add_argument("--videos", default=None, help="synchronized video folder, defaults to the freemocap sample data")
+    parser.add_argument("--recording-folder", default=None)
+    parser.add_argument("--tracker-workers", type=int, default=None, help="defaults to one per core, up to cameras x frames in flight")
+    parser.add_argument("--read-ahead-frames", type=int, default=32)
+    parser.add_argument("--cache", default=None, help="decoded frame cache .npy, written on the first run and read on later ones")
+    parser.add_argument("--max-frames-in-flight", type=int, default=8)
+    parser.add_argument("--triangulation-batch-frames", type=int, default=300)
+    parser.add_argument("--model-complexity", type=int, default=DEFAULT_MODEL_COMPLEXITY)
+    parser.add_argument("--skip-post-processing", action="store_true")
+    args = parser.parse_args()
+
+    run_batch(
+        calibration_toml_path=args.calibration_toml_path,
+        synchronized_video_folder_path=args.videos,
+        recording_folder=args.recording_folder,
+        num_tracker_workers=args.tracker_workers,
+        read_ahead_frames=args.read_ahead_frames,
+        cache_path=args.cache,
+        max_frames_in_flight=args.max_frames_in_flight,
+        triangulation_batch_frames=args.triangulation_batch_frames,
+        model_complexity=args.model_complexity,
+        run_post_processing=not args.skip_post_processing,
+    )
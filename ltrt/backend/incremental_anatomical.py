@@ -0,0 +1,173 @@
+from typing import Dict, List
+
+import numpy as np
+
+from skellytracker.trackers.base_tracker.model_info import ModelInfo
+
+
+class IncrementalAnatomicalCalculator:
+    """
+    Frame by frame replacement for freemocap's batch `calculate_anatomical_data`.
+
+    The batch version builds a skeleton model and recomputes virtual markers, segment lengths and center of mass
+    for the whole array on every call. Here the skeleton definition from the tracker's `ModelInfo` is turned
+    into lookup tables once:
+    - a weight matrix mapping tracked markers to every named (actual and virtual) marker
+    - proximal/distal indices of every segment
+    - center of mass lengths and mass fractions of the center of mass segments
+    - which named markers move with each segment when its bone length is made rigid
+    Each new frame is then a handful of vectorized operations.
+
+    Segment lengths are tracked with running (Welford) statistics across the stream. The batch version makes
+    bones rigid with the median length over the whole recording, which isn't available in realtime, so the
+    running mean is used instead, leaving out lengths more than `outlier_stdevs` standard deviations from the
+    mean once `warmup_frames` lengths have been seen.
+    """
+
+    def __init__(
+        self,
+        model_info: ModelInfo,
+        outlier_stdevs: float = 3.0,
+        warmup_frames: int = 30,
+    ):
+        self.outlier_stdevs = outlier_stdevs
+        self.warmup_frames = warmup_frames
+
+        # named markers map to tracked marker columns in order, later duplicate names win like in the batch skeleton model
+        actual_marker_columns = {marker_name: index for index, marker_name in enumerate(model_info.landmark_names)}
+        self.num_tracked_points = model_info.num_tracked_points
+        self.marker_names: List[str] = list(actual_marker_columns.keys())
+        marker_weights = []
+        for marker_name in self.marker_names:
+            weights = np.zeros(self.num_tracked_points)
+            weights[actual_marker_columns[marker_name]] = 1
+            marker_weights.append(weights)
+
+        virtual_markers = getattr(model_info, "virtual_markers_definitions", None) or {}
+        for virtual_marker_name, virtual_marker_info in virtual_markers.items():
+            weights = np.zeros(self.num_tracked_points)
+            for marker_name, weight in zip(virtual_marker_info["marker_names"], virtual_marker_info["marker_weights"]):
+                weights[actual_marker_columns[str(marker_name)]] += weight
+            if virtual_marker_name not in actual_marker_columns:
+                self.marker_names.append(virtual_marker_name)
+                marker_weights.append(weights)
+            else:
+                marker_weights[self.marker_names.index(virtual_marker_name)] = weights
+        # (named markers, tracked markers)
+        self.marker_weights = np.stack(marker_weights)
+        self._uses_marker = self.marker_weights != 0
+        marker_indices = {marker_name: index for index, marker_name in enumerate(self.marker_names)}
+
+        segment_connections = model_info.segment_connections
+        self.segment_names = list(segment_connections.keys())
+        self.proximal_indices = np.array(
+            [marker_indices[segment_connections[name]["proximal"]] for name in self.segment_names]
+        )
+        self.distal_indices = np.array(
+            [marker_indices[segment_connections[name]["distal"]] for name in self.segment_names]
+        )
+
+        center_of_mass_definitions = getattr(model_info, "center_of_mass_definitions", None) or {}
+        self.center_of_mass_segment_names = list(center_of_mass_definitions.keys())
+        self.center_of_mass_segment_indices = np.array(
+            [self.segment_names.index(name) for name in self.center_of_mass_segment_names], dtype=int
+        )
+        self.center_of_mass_lengths = np.array(
+            [center_of_mass_definitions[name]["segment_com_length"] for name in self.center_of_mass_segment_names]
+        )
+        self.mass_fractions = np.array(
+            [center_of_mass_definitions[name]["segment_com_percentage"] for name in self.center_of_mass_segment_names]
+        )
+
+        # (named markers, segments), 1 where the marker is the segment's distal marker or one of its children
+        joint_hierarchy = getattr(model_info, "joint_hierarchy", None) or {}
+        self.rigid_bone_influence = np.zeros((len(self.marker_names), len(self.segment_names)))
+        for segment_index, segment_name in enumerate(self.segment_names):
+            for marker_name in self._marker_and_children(
+                segment_connections[segment_name]["distal"], joint_hierarchy
+            ):
+                self.rigid_bone_influence[marker_indices[marker_name], segment_index] += 1
+
+        self.reset()
+
+    @staticmethod
+    def _marker_and_children(marker_name: str, joint_hierarchy: Dict[str, List[str]]) -> List[str]:
+        markers = [marker_name]
+        for child_marker_name in joint_hierarchy.get(marker_name, []):
+            markers.extend(IncrementalAnatomicalCalculator._marker_and_children(child_marker_name, joint_hierarchy))
+        return markers
+
+    def reset(self) -> None:
+        num_segments = len(self.segment_names)
+        self.segment_length_count = np.zeros(num_segments, dtype=np.int64)
+        self.segment_length_mean = np.zeros(num_segments)
+        self._segment_length_m2 = np.zeros(num_segments)
+
+    @property
+    def segment_length_stdev(self) -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.sqrt(self._segment_length_m2 / self.segment_length_count)
+
+    def process_frame(self, marker_xyz: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Calculate anatomical data for one (tracked markers, 3) frame.
+
+        Returns the same keys as `calculate_anatomical_data`, without the frame axis:
+        "segment_COM" (center of mass segments, 3), "total_body_COM" (3,) and "rigid_bones_data" (named markers, 3),
+        plus the raw "segment_lengths" (segments,) of this frame.
+        """
+        # NaN markers only spoil the named markers that use them, not every row of the matrix product
+        missing_markers = np.isnan(marker_xyz).any(axis=1)
+        named_marker_xyz = self.marker_weights @ np.where(missing_markers[:, np.newaxis], 0, marker_xyz)
+        named_marker_xyz[self._uses_marker @ missing_markers] = np.nan
+
+        proximal_xyz = named_marker_xyz[self.proximal_indices]
+        segment_vectors = named_marker_xyz[self.distal_indices] - proximal_xyz
+        segment_lengths = np.linalg.norm(segment_vectors, axis=1)
+        self._update_segment_length_statistics(segment_lengths)
+
+        center_of_mass_segments = self.center_of_mass_segment_indices
+        segment_center_of_mass = (
+            proximal_xyz[center_of_mass_segments]
+            + segment_vectors[center_of_mass_segments] * self.center_of_mass_lengths[:, np.newaxis]
+        )
+        total_body_center_of_mass = self.mass_fractions @ segment_center_of_mass
+
+        return {
+            "segment_COM": segment_center_of_mass,
+            "total_body_COM": total_body_center_of_mass,
+            "rigid_bones_data": self._enforce_rigid_bones(named_marker_xyz, segment_vectors, segment_lengths),
+            "segment_lengths": segment_lengths,
+        }
+
+    def _update_segment_length_statistics(self, segment_lengths: np.ndarray) -> None:
+        use_length = ~np.isnan(segment_lengths)
+        past_warmup = self.segment_length_count >= self.warmup_frames
+        with np.errstate(invalid="ignore"):
+            outlier = np.abs(segment_lengths - self.segment_length_mean) > self.outlier_stdevs * self.segment_length_stdev
+        use_length &= ~(past_warmup & outlier)
+
+        self.segment_length_count[use_length] += 1
+        delta = segment_lengths[use_length] - self.segment_length_mean[use_length]
+        self.segment_length_mean[use_length] += delta / self.segment_length_count[use_length]
+        self._segment_length_m2[use_length] += delta * (segment_lengths[use_length] - self.segment_length_mean[use_length])
+
+    def _enforce_rigid_bones(
+        self,
+        named_marker_xyz: np.ndarray,
+        segment_vectors: np.ndarray,
+        segment_lengths: np.ndarray,
+    ) -> np.ndarray:
+        """Move each segment's distal marker (and its children) along the segment to the running mean length"""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            segment_directions = segment_vectors / segment_lengths[:, np.newaxis]
+        target_lengths = np.where(self.segment_length_count > 0, self.segment_length_mean, np.nan)
+        adjustments = (target_lengths - segment_lengths)[:, np.newaxis] * segment_directions
+
+        # likewise, a NaN adjustment only spoils the markers that segment moves
+        invalid_segments = np.isnan(adjustments).any(axis=1)
+        rigid_marker_xyz = named_marker_xyz + self.rigid_bone_influence @ np.where(
+            invalid_segments[:, np.newaxis], 0, adjustments
+        )
+        rigid_marker_xyz[self.rigid_bone_influence[:, invalid_segments].any(axis=1)] = np.nan
+        return rigid_marker_xyz
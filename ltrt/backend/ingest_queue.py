@@ -0,0 +1,115 @@
+from enum import Enum
+from multiprocessing import Queue, Value
+from queue import Empty, Full
+from typing import Optional
+
+from skellycam.core.frames.payloads.multi_frame_payload import MultiFramePayload
+
+
+class IngestPolicy(str, Enum):
+    # keep every multiframe, the backlog (and latency) grows when the pipeline is slower than the cameras
+    UNBOUNDED = "unbounded"
+    # keep every multiframe, but block the camera source when `maxsize` multiframes are waiting
+    BOUNDED = "bounded"
+    # never block the camera source, drop the oldest waiting multiframe when `maxsize` are waiting
+    LATEST = "latest"
+    # keep every `keep_every`th multiframe and drop the rest
+    EVERY_NTH = "every_nth"
+
+
+class PayloadIngestQueue:
+    """
+    Input queue between the camera source and the realtime pipeline, which applies an `IngestPolicy` when
+    multiframes are put into it.
+
+    Stale multiframes are dropped on the producer side, so the pipeline always works on recent data
+    and the end to end latency stays constant however long the session runs.
+    The `None` end-of-stream sentinel is never dropped.
+    Counts of received and dropped multiframes are kept in shared memory, so they can be read from any process.
+    """
+
+    def __init__(
+        self,
+        policy: IngestPolicy = IngestPolicy.UNBOUNDED,
+        maxsize: int = 2,
+        keep_every: int = 2,
+    ):
+        self.policy = IngestPolicy(policy)
+        if self.policy in (IngestPolicy.BOUNDED, IngestPolicy.LATEST) and maxsize < 1:
+            raise ValueError(f"{self.policy.value} ingest policy needs maxsize >= 1, got {maxsize}")
+        if self.policy == IngestPolicy.EVERY_NTH and keep_every < 1:
+            raise ValueError(f"every_nth ingest policy needs keep_every >= 1, got {keep_every}")
+        self.maxsize = maxsize
+        self.keep_every = keep_every
+
+        if self.policy in (IngestPolicy.BOUNDED, IngestPolicy.LATEST):
+            self.queue = Queue(maxsize=maxsize)
+        else:
+            self.queue = Queue()
+
+        self._received_count = Value("q", 0)
+        self._dropped_count = Value("q", 0)
+
+    @property
+    def received_count(self) -> int:
+        return self._received_count.value
+
+    @property
+    def dropped_count(self) -> int:
+        return self._dropped_count.value
+
+    def put(self, multiframe_payload: Optional[MultiFramePayload]) -> None:
+        if multiframe_payload is None:
+            # wait for room instead of dropping, so the last multiframe before the sentinel still gets processed
+            self.queue.put(None)
+            return
+
+        with self._received_count.get_lock():
+            self._received_count.value += 1
+            received_count = self._received_count.value
+
+        if self.policy == IngestPolicy.EVERY_NTH:
+            if (received_count - 1) % self.keep_every != 0:
+                self._count_drop()
+                return
+            self.queue.put(multiframe_payload)
+        elif self.policy == IngestPolicy.LATEST:
+            self._put_latest(multiframe_payload)
+        else:
+            self.queue.put(multiframe_payload)
+
+    def _put_latest(self, multiframe_payload: MultiFramePayload) -> None:
+        while True:
+            try:
+                self.queue.put_nowait(multiframe_payload)
+                return
+            except Full:
+                pass
+            try:
+                # the short timeout covers payloads still on their way through the queue's feeder thread
+                stale_payload = self.queue.get(timeout=0.01)
+            except Empty:
+                # the pipeline took the oldest payload in the meantime
+                continue
+            if stale_payload is None:
+                raise RuntimeError("Put a multiframe payload into the ingest queue after the end-of-stream sentinel")
+            self._count_drop()
+
+    def _count_drop(self) -> None:
+        with self._dropped_count.get_lock():
+            self._dropped_count.value += 1
+
+    def get(self, timeout: Optional[float] = None) -> Optional[MultiFramePayload]:
+        return self.queue.get(timeout=timeout)
+
+    def get_nowait(self) -> Optional[MultiFramePayload]:
+        return self.queue.get_nowait()
+
+    def report(self) -> str:
+        received_count = self.received_count
+        dropped_count = self.dropped_count
+        dropped_percent = dropped_count / received_count * 100 if received_count else 0
+        return (
+            f"Ingest policy {self.policy.value}: received {received_count} multiframe payloads, "
+            f"dropped {dropped_count} ({dropped_percent:.1f}%)"
+        )
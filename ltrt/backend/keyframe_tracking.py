@@ -0,0 +1,140 @@
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+from ltrt.backend.tracker_output import track_image
+
+
+@dataclass
+class CameraFlowState:
+    gray_image: np.ndarray
+    output_array: np.ndarray
+    sequence_number: int
+    frames_since_keyframe: int = 0
+
+
+class KeyframeTracker:
+    """
+    Runs the full tracker only on keyframes, and propagates the 2d keypoints of the last frame with pyramidal
+    Lucas-Kanade optical flow on the frames in between.
+
+    A frame is a keyframe every `keyframe_interval` frames of a camera, on the first frame of a camera, when it is more than
+    `max_frame_gap` frame numbers after the previous frame this tracker got from the camera (None for no limit), and
+    whenever the flow is unreliable: if fewer than `min_tracked_fraction` of the
+    visible keypoints pass the forward-backward check (tracked back to within `max_flow_error_px` of where they
+    started), the frame is tracked with the full model instead.
+    Frames are returned as (1, markers, 3) x, y and confidence, see `track_image`. Optical flow follows keypoints in
+    image pixels, so the keyframes' x and y have to be pixel coordinates of the image they were tracked on. On propagated frames, keypoints
+    that are lost are NaN with confidence 0, and the others keep their confidence from the last keyframe.
+
+    The flow parameters default to OpenCV's Lucas-Kanade tracking sample, which follows up to about
+    `window_size / 2 * 2 ** pyramid_levels` pixels of motion per frame, at a few ms per frame for mediapipe's 543 keypoints.
+    The state is per camera, so every frame of a camera has to be tracked by the same `KeyframeTracker`, in order.
+    Flow is propagated from the previous frame the camera sent, so frames dropped by the ingest queue don't force keyframes,
+    but the motion between the two frames grows with the gap, which `max_frame_gap` bounds.
+    With `keyframe_interval=1` every frame is a keyframe and no state is kept.
+    """
+
+    def __init__(
+        self,
+        tracker,
+        keyframe_interval: int = 1,
+        min_tracked_fraction: float = 0.8,
+        max_flow_error_px: float = 1.0,
+        window_size: int = 15,
+        pyramid_levels: int = 2,
+        max_frame_gap: Optional[int] = 4,
+    ):
+        if keyframe_interval < 1:
+            raise ValueError(f"keyframe_interval must be at least 1, got {keyframe_interval}")
+        self.tracker = tracker
+        self.keyframe_interval = keyframe_interval
+        self.min_tracked_fraction = min_tracked_fraction
+        self.max_flow_error_px = max_flow_error_px
+        self.max_frame_gap = max_frame_gap
+        # flow is only computed around the keypoints, far enough out for the coarsest pyramid level's window
+        self.crop_margin_px = window_size * 2 ** pyramid_levels // 2
+        self.flow_parameters = dict(
+            winSize=(window_size, window_size),
+            maxLevel=pyramid_levels,
+            criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03),
+        )
+        self.camera_states: Dict[int, CameraFlowState] = {}
+        self.keyframes = 0
+        self.propagated_frames = 0
+
+    def track(self, camera_id: int, sequence_number: int, image: np.ndarray) -> np.ndarray:
+        """(1, markers, 3) keypoints and confidences for the image, from the model or propagated by optical flow"""
+        if self.keyframe_interval == 1:
+            self.keyframes += 1
+            return track_image(tracker=self.tracker, image=image)
+
+        gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        state = self.camera_states.get(camera_id)
+        output_array = None
+        if (
+            state is not None
+            and self._follows(previous_sequence_number=state.sequence_number, sequence_number=sequence_number)
+            and state.frames_since_keyframe + 1 < self.keyframe_interval
+        ):
+            output_array = self._propagate(state=state, gray_image=gray_image)
+
+        if output_array is None:
+            output_array = track_image(tracker=self.tracker, image=image)
+            self.camera_states[camera_id] = CameraFlowState(
+                gray_image=gray_image, output_array=output_array, sequence_number=sequence_number
+            )
+            self.keyframes += 1
+        else:
+            state.gray_image = gray_image
+            state.output_array = output_array
+            state.sequence_number = sequence_number
+            state.frames_since_keyframe += 1
+            self.propagated_frames += 1
+        return output_array
+
+    def _follows(self, previous_sequence_number: int, sequence_number: int) -> bool:
+        """Whether a frame is close enough after the camera's previous frame to propagate its keypoints"""
+        frame_gap = sequence_number - previous_sequence_number
+        return frame_gap > 0 and (self.max_frame_gap is None or frame_gap <= self.max_frame_gap)
+
+    def _propagate(self, state: CameraFlowState, gray_image: np.ndarray) -> Optional[np.ndarray]:
+        """The last output moved by optical flow, or None if too few keypoints could be followed"""
+        # x and y pixels of the previous image, from `track_image`
+        previous_points = state.output_array[0, :, :2]
+        visible = ~np.isnan(previous_points).any(axis=1)
+        if not visible.any():
+            # nothing to follow, the model has to find the person again
+            return None
+
+        # pyramids and gradients are computed for the whole image passed in, so crop to the keypoints first
+        height, width = gray_image.shape[:2]
+        x_min, y_min = np.maximum(np.floor(previous_points[visible].min(axis=0)).astype(int) - self.crop_margin_px, 0)
+        x_max, y_max = np.ceil(previous_points[visible].max(axis=0)).astype(int) + self.crop_margin_px
+        x_max, y_max = min(x_max, width), min(y_max, height)
+        if x_min >= x_max or y_min >= y_max:
+            return None
+        previous_crop = state.gray_image[y_min:y_max, x_min:x_max]
+        current_crop = gray_image[y_min:y_max, x_min:x_max]
+        crop_origin = np.array([x_min, y_min], dtype=np.float32)
+
+        start_points = (previous_points[visible] - crop_origin).astype(np.float32).reshape(-1, 1, 2)
+        moved_points, forward_status, _ = cv2.calcOpticalFlowPyrLK(
+            previous_crop, current_crop, start_points, None, **self.flow_parameters
+        )
+        returned_points, backward_status, _ = cv2.calcOpticalFlowPyrLK(
+            current_crop, previous_crop, moved_points, None, **self.flow_parameters
+        )
+        flow_error = np.linalg.norm((returned_points - start_points).reshape(-1, 2), axis=1)
+        tracked = (forward_status.ravel() == 1) & (backward_status.ravel() == 1) & (flow_error < self.max_flow_error_px)
+        if np.count_nonzero(tracked) < self.min_tracked_fraction * len(tracked):
+            return None
+
+        output_array = state.output_array.copy()
+        visible_indices = np.flatnonzero(visible)
+        output_array[0, visible_indices[tracked], :2] = moved_points.reshape(-1, 2)[tracked] + crop_origin
+        output_array[0, visible_indices[~tracked], :2] = np.nan
+        output_array[0, visible_indices[~tracked], 2] = 0.0
+        return output_array
@@ -0,0 +1,240 @@
+import csv
+import json
+import math
+from pathlib import Path
+from time import perf_counter_ns
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from skellycam.core.frames.payloads.metadata.frame_metadata_enum import FRAME_METADATA_MODEL
+from skellycam.core.frames.payloads.multi_frame_payload import MultiFramePayload
+
+PERCENTILES = (50, 95, 99)
+SUMMARY_FIELDS = ["count", "mean_ms", "min_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"]
+
+
+class LatencyHistogram:
+    """
+    Fixed memory histogram of durations in milliseconds.
+
+    Bins are log spaced with `bins_per_decade` bins per factor of 10 between `min_ms` and `max_ms`,
+    so percentiles are accurate to a few percent whatever the scale, and recording a value is O(1).
+    Values outside the range are counted in an underflow or overflow bin.
+    """
+
+    def __init__(self, min_ms: float = 0.001, max_ms: float = 1_000_000.0, bins_per_decade: int = 40):
+        self.min_ms = min_ms
+        self.bins_per_decade = bins_per_decade
+        self.num_bins = math.ceil(math.log10(max_ms / min_ms) * bins_per_decade)
+        self.reset()
+
+    def reset(self) -> None:
+        # bin 0 is underflow, bin num_bins + 1 is overflow
+        # (a list, since incrementing a python int is several times faster than a numpy scalar)
+        self.counts = [0] * (self.num_bins + 2)
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_value_ms = math.inf
+        self.max_value_ms = -math.inf
+
+    def record(self, value_ms: float) -> None:
+        if value_ms <= self.min_ms:
+            index = 0
+        else:
+            index = min(1 + int(math.log10(value_ms / self.min_ms) * self.bins_per_decade), self.num_bins + 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ms += value_ms
+        self.min_value_ms = min(self.min_value_ms, value_ms)
+        self.max_value_ms = max(self.max_value_ms, value_ms)
+
+    @property
+    def mean_ms(self) -> float:
+        return self.total_ms / self.count if self.count else math.nan
+
+    def percentile(self, percent: float) -> float:
+        """Geometric center of the bin holding the percentile, clamped to the recorded min and max"""
+        if self.count == 0:
+            return math.nan
+        index = int(np.searchsorted(np.cumsum(self.counts), percent / 100 * self.count))
+        if index == 0:
+            return self.min_value_ms
+        if index > self.num_bins:
+            return self.max_value_ms
+        bin_center_ms = self.min_ms * 10 ** ((index - 0.5) / self.bins_per_decade)
+        return min(max(bin_center_ms, self.min_value_ms), self.max_value_ms)
+
+    def summary(self) -> Dict[str, float]:
+        summary = {
+            "count": self.count,
+            "mean_ms": self.mean_ms,
+            "min_ms": self.min_value_ms if self.count else math.nan,
+        }
+        for percent in PERCENTILES:
+            summary[f"p{percent}_ms"] = self.percentile(percent)
+        summary["max_ms"] = self.max_value_ms if self.count else math.nan
+        return summary
+
+
+def capture_time_ns(multiframe_payload: MultiFramePayload) -> Optional[int]:
+    """
+    Earliest pre grab timestamp of the frames in the multiframe, or None if a frame has no timestamp.
+
+    Timestamps are expected from `time.perf_counter_ns()`, which uses the same clock in every process.
+    """
+    timestamps = [
+        int(frame_payload.metadata[FRAME_METADATA_MODEL.PRE_GRAB_TIMESTAMP_NS.value])
+        for frame_payload in multiframe_payload.frames.values()
+        if frame_payload is not None
+    ]
+    if not timestamps or min(timestamps) <= 0:
+        return None
+    return min(timestamps)
+
+
+class PipelineMetrics:
+    """
+    Per stage latency histograms for a realtime pipeline.
+
+    Stages are created on first use, so any stage name can be recorded.
+    The pipelines use "queue_pull", "frame_send", "tracking", "tracking_camera_<id>", "collection",
+    "triangulation", "post_processing", "total" (time between finished frames) and "capture_to_3d"
+    (from the camera's pre grab timestamp to the finished 3d frame).
+    Cameras that missed a frame's deadline are counted per camera, and the missed frames are kept for export.
+    With an adaptive quality controller, frames are counted per quality level and its level switches are kept for export.
+
+    With `quiet=True`, `log` doesn't print, so nothing is printed per frame.
+    Every `report_interval_s` seconds (checked in `frame_finished`) a snapshot of every stage's
+    percentiles is printed and kept for export.
+    """
+
+    def __init__(self, quiet: bool = False, report_interval_s: Optional[float] = 5.0):
+        self.quiet = quiet
+        self.report_interval_s = report_interval_s
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.snapshots: List[Dict] = []
+        self.frame_count = 0
+        self.missed_camera_counts: Dict[int, int] = {}
+        self.missed_frames: List[Dict] = []
+        self.quality_level_counts: Dict[int, int] = {}
+        self.quality_switches: List[Dict] = []
+        self.start_time_ns = perf_counter_ns()
+        self._next_report_ns = self._report_time_after(self.start_time_ns)
+
+    def _report_time_after(self, time_ns: int) -> Optional[int]:
+        if self.report_interval_s is None:
+            return None
+        return time_ns + int(self.report_interval_s * 1e9)
+
+    def log(self, message: str) -> None:
+        if not self.quiet:
+            print(message)
+
+    def record(self, stage: str, duration_ms: float) -> None:
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = LatencyHistogram()
+        histogram.record(duration_ms)
+
+    def record_ns(self, stage: str, start_ns: int, end_ns: int) -> None:
+        self.record(stage, (end_ns - start_ns) / 1e6)
+
+    def record_camera_results(self, send_time_ns: int, result_times_ns: Dict[int, int]) -> None:
+        """Per camera tracking time from when the multiframe was sent, and the spread between the first and last result"""
+        for camera_id, result_time_ns in result_times_ns.items():
+            self.record_ns(f"tracking_camera_{camera_id}", send_time_ns, result_time_ns)
+        if result_times_ns:
+            self.record_ns("collection", min(result_times_ns.values()), max(result_times_ns.values()))
+
+    def record_missed_cameras(self, sequence_number: int, missed_camera_ids: Iterable[int]) -> None:
+        missed_camera_ids = sorted(missed_camera_ids)
+        for camera_id in missed_camera_ids:
+            self.missed_camera_counts[camera_id] = self.missed_camera_counts.get(camera_id, 0) + 1
+        self.missed_frames.append({"frame": sequence_number, "missed_cameras": missed_camera_ids})
+
+    def record_quality_level(self, level: int, switch: Optional[Dict] = None) -> None:
+        """Count a frame tracked at `level`, and keep the switch the quality controller made after it, if any"""
+        self.quality_level_counts[level] = self.quality_level_counts.get(level, 0) + 1
+        if switch is not None:
+            self.quality_switches.append(switch)
+            print(
+                f"switched tracker quality level from {switch['from_level']} to {switch['to_level']} "
+                f"after frame {switch['frame']} (median tracking {switch['median_tracking_ms']:.2f} ms)"
+            )
+
+    def record_capture_latency(self, capture_time_ns: Optional[int], end_ns: int) -> None:
+        if capture_time_ns is not None:
+            self.record_ns("capture_to_3d", capture_time_ns, end_ns)
+
+    def frame_finished(self, now_ns: Optional[int] = None) -> None:
+        self.frame_count += 1
+        if self._next_report_ns is None:
+            return
+        now_ns = perf_counter_ns() if now_ns is None else now_ns
+        if now_ns >= self._next_report_ns:
+            self._next_report_ns = self._report_time_after(now_ns)
+            snapshot = self.take_snapshot(now_ns)
+            print(self.format_snapshot(snapshot))
+
+    def current_snapshot(self, now_ns: Optional[int] = None) -> Dict:
+        now_ns = perf_counter_ns() if now_ns is None else now_ns
+        return {
+            "elapsed_s": (now_ns - self.start_time_ns) / 1e9,
+            "frames": self.frame_count,
+            "frames_with_missed_cameras": len(self.missed_frames),
+            "missed_camera_counts": dict(sorted(self.missed_camera_counts.items())),
+            "frames_per_quality_level": dict(sorted(self.quality_level_counts.items())),
+            "stages": {stage: histogram.summary() for stage, histogram in self.histograms.items()},
+        }
+
+    def take_snapshot(self, now_ns: Optional[int] = None) -> Dict:
+        """Current snapshot, kept with the periodic snapshots for export"""
+        snapshot = self.current_snapshot(now_ns)
+        self.snapshots.append(snapshot)
+        return snapshot
+
+    @staticmethod
+    def format_snapshot(snapshot: Dict) -> str:
+        lines = [f"Pipeline metrics after {snapshot['elapsed_s']:.1f} s, {snapshot['frames']} frames:"]
+        if snapshot["frames_with_missed_cameras"]:
+            lines.append(
+                f"\t{snapshot['frames_with_missed_cameras']} frames with missed cameras, misses per camera: {snapshot['missed_camera_counts']}"
+            )
+        if len(snapshot["frames_per_quality_level"]) > 1:
+            lines.append(f"\tframes per quality level: {snapshot['frames_per_quality_level']}")
+        for stage, summary in snapshot["stages"].items():
+            lines.append(
+                f"\t{stage}: n={summary['count']} mean={summary['mean_ms']:.2f} "
+                f"p50={summary['p50_ms']:.2f} p95={summary['p95_ms']:.2f} p99={summary['p99_ms']:.2f} "
+                f"max={summary['max_ms']:.2f} ms"
+            )
+        return "\n".join(lines)
+
+    def export_json(self, file_path: str | Path) -> None:
+        """
+        Write the current summary of every stage, the periodic snapshots, the frames with missed cameras
+        and the quality level switches
+        """
+        with open(file_path, "w") as file:
+            json.dump(
+                {
+                    **self.current_snapshot(),
+                    "snapshots": self.snapshots,
+                    "missed_frames": self.missed_frames,
+                    "quality_switches": self.quality_switches,
+                },
+                file,
+                indent=4,
+            )
+
+    def export_csv(self, file_path: str | Path) -> None:
+        """Write one row per stage for every periodic snapshot and the current summary"""
+        with open(file_path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["elapsed_s", "frames", "stage", *SUMMARY_FIELDS])
+            for snapshot in [*self.snapshots, self.current_snapshot()]:
+                for stage, summary in snapshot["stages"].items():
+                    writer.writerow(
+                        [snapshot["elapsed_s"], snapshot["frames"], stage, *(summary[field] for field in SUMMARY_FIELDS)]
+                    )
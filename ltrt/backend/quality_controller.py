@@ -0,0 +1,87 @@
+from collections import deque
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class AdaptiveQualityController:
+    """
+    Picks the mediapipe model complexity the trackers run at, to get the most accurate model that keeps
+    tracking within `target_tracking_ms` per multiframe.
+
+    `levels` are model complexities ordered from cheapest to most accurate, and tracking starts at the cheapest.
+    The pipeline sends each multiframe at `level`, then calls `record` with the level the multiframe was
+    tracked at and how long tracking took (in the lightweight pipeline, the slowest camera's inference time as measured
+    by its tracker, so time spent queued behind earlier multiframes doesn't count).
+    Decisions use the median of the last `window_size` tracking times at the current level, so a single slow frame
+    doesn't switch levels, and times from other levels (multiframes still in flight during a switch) are ignored.
+
+    Switching has hysteresis, so the level doesn't flap around the target:
+    it steps down as soon as the median is over the target, but only steps up if the median is under
+    `upgrade_fraction` of the target and the next level wasn't over the target the last time it ran
+    (within the last `retry_after_frames` frames, after that it is tried again, in case the load went down).
+    After a switch, it stays at the new level for at least `window_size` frames.
+    """
+
+    def __init__(
+        self,
+        target_tracking_ms: float,
+        levels: Sequence[int] = (0, 1, 2),
+        window_size: int = 30,
+        upgrade_fraction: float = 0.7,
+        retry_after_frames: int = 900,
+    ):
+        if not levels:
+            raise ValueError("At least one quality level is needed")
+        self.target_tracking_ms = target_tracking_ms
+        self.levels = list(levels)
+        self.window_size = window_size
+        self.upgrade_fraction = upgrade_fraction
+        self.retry_after_frames = retry_after_frames
+
+        self.level_index = 0
+        self.frame_count = 0
+        self.tracking_times_ms: deque = deque(maxlen=window_size)
+        # median tracking time and frame count the last time each level was left
+        self.last_level_times: Dict[int, Tuple[float, int]] = {}
+        self.switches: List[Dict] = []
+
+    @property
+    def level(self) -> int:
+        return self.levels[self.level_index]
+
+    def record(self, level: int, tracking_ms: float, sequence_number: Optional[int] = None) -> Optional[Dict]:
+        """Record a multiframe's tracking time, returns the switch if this changed the level"""
+        self.frame_count += 1
+        if level != self.level:
+            return None
+        self.tracking_times_ms.append(tracking_ms)
+        if len(self.tracking_times_ms) < self.window_size:
+            return None
+
+        median_ms = float(np.median(self.tracking_times_ms))
+        if median_ms > self.target_tracking_ms and self.level_index > 0:
+            return self._switch(step=-1, median_ms=median_ms, sequence_number=sequence_number)
+        if median_ms < self.upgrade_fraction * self.target_tracking_ms and self.level_index < len(self.levels) - 1:
+            last_median_ms, last_frame_count = self.last_level_times.get(self.levels[self.level_index + 1], (None, None))
+            if (
+                last_median_ms is None
+                or last_median_ms <= self.target_tracking_ms
+                or self.frame_count - last_frame_count > self.retry_after_frames
+            ):
+                return self._switch(step=1, median_ms=median_ms, sequence_number=sequence_number)
+        return None
+
+    def _switch(self, step: int, median_ms: float, sequence_number: Optional[int]) -> Dict:
+        previous_level = self.level
+        self.last_level_times[previous_level] = (median_ms, self.frame_count)
+        self.level_index += step
+        self.tracking_times_ms.clear()
+        switch = {
+            "frame": sequence_number,
+            "from_level": previous_level,
+            "to_level": self.level,
+            "median_tracking_ms": median_ms,
+        }
+        self.switches.append(switch)
+        return switch
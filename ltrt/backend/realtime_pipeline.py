@@ -1,8 +1,8 @@
 from multiprocessing import Queue
-from typing import Dict, Optional
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
 import numpy as np
 from queue import Empty
-from aniposelib.cameras import CameraGroup
 from time import perf_counter_ns
 import logging
 
@@ -10,24 +10,43 @@ import logging
 from skellycam.core.frames.payloads.multi_frame_payload import MultiFramePayload
 
 from skellytracker import MediapipeHolisticTracker
+from skellytracker.trackers.mediapipe_tracker.mediapipe_model_info import MediapipeModelInfo
 
 from freemocap.utilities.geometry.rotate_by_90_degrees_around_x_axis import (
     rotate_by_90_degrees_around_x_axis,
 )
-from freemocap.core_processes.post_process_skeleton_data.post_process_skeleton import (
-    post_process_data,
-)
 from freemocap.data_layer.recording_models.post_processing_parameter_models import (
     ProcessingParameterModel,
-    PostProcessingParametersModel,
-)
-from freemocap.core_processes.process_motion_capture_videos.processing_pipeline_functions.anatomical_data_pipeline_functions import (
-    calculate_anatomical_data,
 )
 
+from ltrt.backend.incremental_anatomical import IncrementalAnatomicalCalculator
+from ltrt.backend.ingest_queue import PayloadIngestQueue
+from ltrt.backend.pipeline_metrics import PipelineMetrics, capture_time_ns
+from ltrt.backend.quality_controller import AdaptiveQualityController
+from ltrt.backend.reorder_buffer import ReorderBuffer
+from ltrt.backend.shared_memory_transport import SharedFrameRing, SharedKeypointMatrix, SharedLatestFrame
+from ltrt.backend.streaming_post_processing import StreamingPostProcessor
+from ltrt.backend.roi_cropping import RoiCropper
+from ltrt.backend.sampling_profiler import ProfilingConfig, profile_frame, save_profiler, start_profiler
+from ltrt.backend.startup import signal_ready, warm_up_tracker
+from ltrt.backend.tracker_output import mask_low_confidence, track_image
+from ltrt.backend.triangulation import RealtimeTriangulator
 from ltrt.backend.tracking_process import (
+    DEFAULT_MODEL_COMPLEXITY,
+    HEAVYWEIGHT_MODEL_COMPLEXITY,
+    CameraAffineJobQueue,
+    collect_results,
+    deadline_after,
+    discover_camera_ids,
+    map_to_full_image,
     process_one_multiframe_payload,
+    process_one_multiframe_payload_shared_memory,
+    read_in_flight_keypoints,
+    send_multiframe_payload,
+    start_tracker_transport,
 )
+from ltrt.system.path_utilities import create_new_recording_folder
+from ltrt.system.streaming_npy_writer import StreamingNpyWriter
 
 numba_logger = logging.getLogger("numba")
 numba_logger.setLevel(logging.WARNING)
@@ -38,213 +57,524 @@ skellytracker_logger.setLevel(logging.WARNING)
 # takes roughly 250 ms per frame payload with yolo nano
 # takes roughly 140 ms per frame payload with mediapipe model_complexity=0
 def lightweight_realtime_pipeline(
-    camera_group: CameraGroup,
-    input_queue: Queue,
-    tracking_payload_queues: Dict[int, Queue],
-    tracking_output_queues: Dict[int, Queue],
-    output_queue: Queue,
+    triangulator: RealtimeTriangulator,
+    input_queue: PayloadIngestQueue,
+    tracking_job_queue: "Queue | CameraAffineJobQueue",
+    tracking_result_queue: Queue,
+    tracker_setup_queue: Queue,
+    num_tracker_workers: int,
+    output_channel: Optional[SharedLatestFrame],
     stop_event,
+    use_shared_memory: bool = True,
+    max_frames_in_flight: int = 1,
+    frame_deadline_ms: Optional[float] = None,
+    recording_folder: Optional[str] = None,
+    quiet: bool = False,
+    metrics_report_interval_s: Optional[float] = 5.0,
+    ready_queue: Optional[Queue] = None,
+    roi_cropper: Optional[RoiCropper] = None,
+    quality_controller: Optional[AdaptiveQualityController] = None,
+    min_confidence: Optional[float] = None,
+    profiling: Optional[ProfilingConfig] = None,
 ):
-    multiframe_payload_times = []
-    queue_pull_times = []
-    tracking_times = []
-    triangulation_times = []
-    triangulated_data_store = []
-    start = perf_counter_ns()
-    while not stop_event.is_set():
-        # pull multiframe payload from queue
-        print("-------------------------\nNew frame payload\n-------------------------")
-        start_queue = perf_counter_ns()
-        try:
-            multiframe_payload: Optional[MultiFramePayload] = input_queue.get(
-                timeout=0.1
-            )
-        except Empty:
-            continue
-        end_queue = perf_counter_ns()
-        print(f"queue pull took {(end_queue - start_queue) / 1e6} ms")
-
-        if multiframe_payload is None:
-            stop_event.set()
-            break
-        else:
-            print(
-                f"received multiframe payload number {multiframe_payload.multi_frame_number} with frame count {len(multiframe_payload.frames)}"
+    """
+    Frames are tracked by a pool of `num_tracker_workers` `run_tracker` processes, which take per camera jobs
+    from `tracking_job_queue` and put results tagged with camera and frame into `tracking_result_queue`.
+    The camera ids are discovered from the first multiframe, then the tracker pool is set up through `tracker_setup_queue`.
+    `tracking_job_queue` is a `CameraAffineJobQueue` when the workers keep per-camera state (keyframe tracking).
+
+    With `use_shared_memory`, frames and keypoints are exchanged with the trackers through a shared memory
+    frame ring and keypoint matrix sized from the first multiframe, instead of being pickled through the queues.
+    This process unlinks the shared memory blocks when it finishes.
+
+    Results are collected per multiframe in a reorder buffer and triangulated in the order the multiframes arrived.
+    With `max_frames_in_flight` > 1, new multiframes are sent to the trackers while earlier ones are still being
+    tracked, so the trackers don't sit idle during triangulation.
+
+    Results are collected as soon as they arrive. With `frame_deadline_ms`, a multiframe is triangulated that
+    long after it is sent to the trackers even if some cameras haven't answered: their keypoints are NaN, so markers are
+    triangulated from the cameras that did answer (at least `triangulator.min_views`), and the missed cameras
+    are recorded in the metrics. Without a deadline, every camera is waited for.
+
+    With `roi_cropper`, the trackers get images cropped around each camera's most recent keypoints and/or
+    downscaled, and the keypoints are mapped back to full image coordinates before triangulation.
+
+    With `min_confidence`, keypoints the trackers are less sure of than that are set to NaN,
+    so markers are only triangulated from confident views, and markers without two are skipped.
+
+    With `quality_controller`, each multiframe is tracked at the controller's current model complexity, and its
+    tracking time is fed back to the controller, which switches complexity to stay within its target.
+    The complexity each frame was tracked at is streamed to `quality_levels.npy`, next to the 3d data.
+
+    Each triangulated frame is published to `output_channel` (if not None) for live consumers, overwriting the
+    previous one, so a slow consumer never holds up the pipeline.
+
+    Triangulated frames are streamed to `3d_data_frames_markers_xyz.npy` in `recording_folder`
+    (a new recording folder if not given) by a background writer, so memory use doesn't grow with the session
+    and the file stays readable if the process dies.
+
+    Stage timings go into fixed memory histograms (`PipelineMetrics`), which print a percentile snapshot every
+    `metrics_report_interval_s` seconds and are exported to the recording folder at the end.
+    With `quiet=True` nothing is printed per frame.
+
+    With `profiling`, this process samples itself during the configured frames and saves its profile to the
+    profiling output folder, see `SamplingProfiler`.
+
+    Signals ready on `ready_queue` once it is set up, see `startup.py`.
+    """
+    frame_ring = None
+    keypoint_matrix = None
+    tracker_pool_started = False
+    if recording_folder is None:
+        recording_folder = create_new_recording_folder()
+    output_writer = StreamingNpyWriter(Path(recording_folder) / "3d_data_frames_markers_xyz.npy")
+    quality_level_writer = None
+    if quality_controller is not None:
+        quality_level_writer = StreamingNpyWriter(Path(recording_folder) / "quality_levels.npy", dtype=np.int64)
+    metrics = PipelineMetrics(quiet=quiet, report_interval_s=metrics_report_interval_s)
+    profiler = start_profiler(config=profiling, role="pipeline")
+    signal_ready(ready_queue=ready_queue, role="pipeline")
+    try:
+        start = perf_counter_ns()
+        reorder_buffer = ReorderBuffer()
+        input_finished = False
+        while not stop_event.is_set():
+            # keep up to max_frames_in_flight multiframes with the trackers
+            while not input_finished and len(reorder_buffer) < max_frames_in_flight:
+                start_queue = perf_counter_ns()
+                try:
+                    if len(reorder_buffer) == 0:
+                        multiframe_payload: Optional[MultiFramePayload] = input_queue.get(timeout=0.1)
+                    else:
+                        multiframe_payload = input_queue.get_nowait()
+                except Empty:
+                    break
+                end_queue = perf_counter_ns()
+                if multiframe_payload is None:
+                    input_finished = True
+                    break
+                metrics.record_ns("queue_pull", start_queue, end_queue)
+                profile_frame(profiler, sequence_number=multiframe_payload.multi_frame_number)
+                # JSM - Always access by-camera data using the camera_id as the key to the dict, all cameras within a camera_group provide data on every frame
+                if not tracker_pool_started:
+                    frame_ring, keypoint_matrix = start_tracker_pool(
+                        multiframe_payload=multiframe_payload,
+                        triangulator=triangulator,
+                        tracker_setup_queue=tracker_setup_queue,
+                        num_tracker_workers=num_tracker_workers,
+                        use_shared_memory=use_shared_memory,
+                        max_frames_in_flight=max_frames_in_flight,
+                    )
+                    tracker_pool_started = True
+                deadline_ns = deadline_after(perf_counter_ns(), frame_deadline_ms)
+                model_complexity = current_model_complexity(quality_controller)
+                images, crop_transforms = None, None
+                if roi_cropper is not None:
+                    # cropped around the most recent triangulated frame's keypoints
+                    images, crop_transforms = roi_cropper.crop_multiframe(multiframe_payload)
+                slot = send_multiframe_payload(
+                    multiframe_payload=multiframe_payload,
+                    frame_ring=frame_ring,
+                    job_queue=tracking_job_queue,
+                    deadline_ns=deadline_ns,
+                    images=images,
+                    model_complexity=model_complexity,
+                )
+                end_send = perf_counter_ns()
+                metrics.record_ns("frame_send", end_queue, end_send)
+                reorder_buffer.add_frame(
+                    sequence_number=multiframe_payload.multi_frame_number,
+                    slot=slot,
+                    camera_ids=set(multiframe_payload.frames.keys()),
+                    send_time_ns=end_send,
+                    capture_time_ns=capture_time_ns(multiframe_payload),
+                    deadline_ns=deadline_ns,
+                    crop_transforms=crop_transforms,
+                    model_complexity=model_complexity,
+                )
+
+            if len(reorder_buffer) == 0:
+                if input_finished:
+                    # every multiframe in flight has been triangulated, so the trackers can stop now
+                    stop_event.set()
+                    break
+                continue
+
+            collect_results(
+                result_queue=tracking_result_queue,
+                reorder_buffer=reorder_buffer,
+                use_shared_memory=use_shared_memory,
             )
-        # TODO: Frame payloads come in an arbitrary order - should we sort by Camera ID?
-        # or, just access by order of camID (are we guaranteed to have 0-N? or can there be missing values?)
-        #JSM 1 - Always access by-camera data using the camera_id as the key to the dict. Avoid logic that assumes a specific order, so sorting is unnecessary.
-        #JSM 2 - There cannot be missing values, all cameras within a camera_group are guaranteed to provide data on every frame - each sub-frame has the same value in their `frame_number property`
-
-        print("-----------Processing multiframe payload-----------")
-        start_track = perf_counter_ns()
-        combined_array = process_one_multiframe_payload(
-            multiframe_payload=multiframe_payload,
-            payload_queues=tracking_payload_queues,
-            output_queues=tracking_output_queues,
-        )
 
-        end_track = perf_counter_ns()
-        print(f"Tracking took {(end_track - start_track) / 1e6} ms")
-
-        # triangulate frame data with anipose
-        start_triangulate = perf_counter_ns()
-        triangulated_data = camera_group.triangulate(combined_array)
-        triangulated_data_store.append(triangulated_data)
-        print(f"triangulated data shape: {triangulated_data.shape}")
-        end_triangulate = perf_counter_ns()
-        print(f"Triangulation took {(end_triangulate - start_triangulate) / 1e6} ms")
-        # push 3d data to output queue
-        # output_queue.put(triangulated_data)
-
-        end = perf_counter_ns()
-        print(
-            f"Total time to process frame payload {multiframe_payload.multi_frame_number}: {(end - start) / 1e6} ms"
+            # triangulate completed multiframes in the order they were sent
+            for in_flight_frame in reorder_buffer.pop_ready():
+                missed_camera_ids = in_flight_frame.missed_camera_ids
+                if missed_camera_ids:
+                    metrics.record_missed_cameras(
+                        sequence_number=in_flight_frame.sequence_number, missed_camera_ids=missed_camera_ids
+                    )
+                    metrics.log(
+                        f"cameras {sorted(missed_camera_ids)} missed the deadline for frame {in_flight_frame.sequence_number}"
+                    )
+                start_triangulate = perf_counter_ns()
+                keypoints, camera_ids = read_in_flight_keypoints(in_flight_frame=in_flight_frame, keypoint_matrix=keypoint_matrix)
+                keypoints = map_to_full_image(
+                    keypoints=mask_low_confidence(keypoints=keypoints, min_confidence=min_confidence),
+                    camera_ids=camera_ids,
+                    roi_cropper=roi_cropper,
+                    crop_transforms=in_flight_frame.crop_transforms,
+                    missed_camera_ids=missed_camera_ids,
+                )
+                triangulated_data = triangulator.triangulate(keypoints)
+                output_writer.append(triangulated_data)
+                end_triangulate = perf_counter_ns()
+                end_tracking = max(in_flight_frame.result_times_ns.values(), default=start_triangulate)
+                # the slowest camera's inference time, which unlike the time since sending doesn't include
+                # waiting behind the multiframes sent before it (if every camera missed, the time until the deadline)
+                tracking_ns = max(in_flight_frame.tracking_ns.values(), default=end_tracking - in_flight_frame.send_time_ns)
+                record_quality_level(
+                    quality_controller=quality_controller,
+                    quality_level_writer=quality_level_writer,
+                    metrics=metrics,
+                    model_complexity=in_flight_frame.model_complexity,
+                    tracking_ms=tracking_ns / 1e6,
+                    sequence_number=in_flight_frame.sequence_number,
+                )
+                publish_frame(
+                    output_channel=output_channel,
+                    triangulated_data=triangulated_data,
+                    frame_number=in_flight_frame.sequence_number,
+                )
+
+                end = perf_counter_ns()
+                metrics.log(
+                    f"Finished frame payload {in_flight_frame.sequence_number} with {len(reorder_buffer)} in flight, {(end - start) / 1e6} ms since the previous frame"
+                )
+                metrics.record_ns("total", start, end)
+                metrics.record_ns("tracking", in_flight_frame.send_time_ns, end_tracking)
+                metrics.record_camera_results(
+                    send_time_ns=in_flight_frame.send_time_ns, result_times_ns=in_flight_frame.result_times_ns
+                )
+                metrics.record_ns("triangulation", start_triangulate, end_triangulate)
+                metrics.record_capture_latency(in_flight_frame.capture_time_ns, end)
+                metrics.frame_finished(end)
+                start = end
+    finally:
+        # stops the camera input and the trackers however the pipeline ends, on an error too
+        stop_event.set()
+        # jobs of multiframes released at their deadline may never be taken by the stopped trackers,
+        # so don't block on flushing them to the job queue when this process exits
+        tracking_job_queue.cancel_join_thread()
+        # should we flush the queue here?
+        # i.e. if stop event is called but frames are still in the queue, should we cycle through until queue is empty?
+
+        print("Finished receiving multiframe payloads")
+        print(input_queue.report())
+        save_profiler(profiler)
+
+        if frame_ring is not None:
+            for shared_block in (frame_ring, keypoint_matrix):
+                shared_block.close()
+                shared_block.unlink()
+
+        export_metrics(metrics=metrics, recording_folder=recording_folder)
+        if output_channel is not None:
+            output_channel.close()
+
+        output_writer.close()
+        print(f"Saved triangulated data with shape {output_writer.shape} to {output_writer.file_path}")
+        if quality_level_writer is not None:
+            quality_level_writer.close()
+            print(f"Saved the quality level of each frame to {quality_level_writer.file_path}")
+
+
+def start_tracker_pool(
+    multiframe_payload: MultiFramePayload,
+    triangulator: RealtimeTriangulator,
+    tracker_setup_queue: Queue,
+    num_tracker_workers: int,
+    use_shared_memory: bool,
+    max_frames_in_flight: int,
+) -> Tuple[Optional[SharedFrameRing], Optional[SharedKeypointMatrix]]:
+    """Discover the cameras from the first multiframe and set up the tracker pool's transport for them"""
+    camera_ids = discover_camera_ids(multiframe_payload)
+    if len(camera_ids) != triangulator.num_cameras:
+        raise ValueError(
+            f"Multiframe has {len(camera_ids)} cameras {camera_ids}, but the calibration has {triangulator.num_cameras}"
         )
-        multiframe_payload_times.append((end - start) / 1e6)
-        queue_pull_times.append((end_queue - start_queue) / 1e6)
-        tracking_times.append((end_track - start_track) / 1e6)
-        triangulation_times.append((end_triangulate - start_triangulate) / 1e6)
+    print(f"discovered cameras {camera_ids}, sending them to {num_tracker_workers} tracker workers")
+    return start_tracker_transport(
+        multiframe_payload=multiframe_payload,
+        setup_queue=tracker_setup_queue,
+        num_tracker_workers=num_tracker_workers,
+        use_shared_memory=use_shared_memory,
+        num_markers=MediapipeModelInfo.num_tracked_points,
+        num_slots=max(4, max_frames_in_flight),
+    )
+
+
+def publish_frame(output_channel: Optional[SharedLatestFrame], triangulated_data: np.ndarray, frame_number: int) -> None:
+    if output_channel is not None:
+        output_channel.publish(frame=triangulated_data, frame_number=frame_number)
+
+
+def current_model_complexity(
+    quality_controller: Optional[AdaptiveQualityController],
+    default: int = DEFAULT_MODEL_COMPLEXITY,
+) -> int:
+    """Model complexity to track the next multiframe at"""
+    return default if quality_controller is None else quality_controller.level
+
+
+def record_quality_level(
+    quality_controller: Optional[AdaptiveQualityController],
+    quality_level_writer: Optional[StreamingNpyWriter],
+    metrics: PipelineMetrics,
+    model_complexity: int,
+    tracking_ms: float,
+    sequence_number: int,
+) -> None:
+    """Feed a finished frame's tracking time to the quality controller, and record the level it was tracked at"""
+    if quality_controller is None:
+        return
+    switch = quality_controller.record(level=model_complexity, tracking_ms=tracking_ms, sequence_number=sequence_number)
+    metrics.record_quality_level(level=model_complexity, switch=switch)
+    if quality_level_writer is not None:
+        quality_level_writer.append(np.array(model_complexity))
 
-        start = perf_counter_ns()
 
-    # should we flush the queue here?
-    # i.e. if stop event is called but frames are still in the queue, should we cycle through until queue is empty?
-
-    print("Finished receiving multiframe payloads")
-
-    # Timestamp statistics
-    num_samples = 5
-    print("Total multiframe payload:")
-    print(f"\tAverage time: {np.mean(multiframe_payload_times[1:])} ms")  # throw out warmup frame
-    print(f"\tMedian time: {np.median(multiframe_payload_times)} ms")
-    print(f"\tFastest {num_samples} times: {np.sort(multiframe_payload_times)[:num_samples].tolist()} ms")
-    print(f"\tSlowest {num_samples} times: {np.sort(multiframe_payload_times)[-num_samples:].tolist()} ms")
-    print("Queue pull:")
-    print(f"\tAverage time: {np.mean(queue_pull_times[1:])} ms")  # throw out warmup frame
-    print(f"\tMedian time: {np.median(queue_pull_times)} ms")
-    print(f"\tPercent of median time: {np.median(queue_pull_times)/np.median(multiframe_payload_times) * 100}")
-    print(f"\tFastest {num_samples} times: {np.sort(queue_pull_times)[:num_samples].tolist()} ms")
-    print(f"\tSlowest {num_samples} times: {np.sort(queue_pull_times)[-num_samples:].tolist()} ms")
-    print("Tracking:")
-    print(f"\tAverage time: {np.mean(tracking_times[1:])} ms")  # throw out warmup frame
-    print(f"\tMedian time: {np.median(tracking_times)} ms")
-    print(f"\tPercent of median time: {np.median(tracking_times)/np.median(multiframe_payload_times) * 100}")
-    print(f"\tFastest {num_samples} times: {np.sort(tracking_times)[:num_samples].tolist()} ms")
-    print(f"\tSlowest {num_samples} times: {np.sort(tracking_times)[-num_samples:].tolist()} ms")
-    print("Triangulation:")
-    print(f"\tAverage time: {np.mean(triangulation_times[1:])} ms")  # throw out warmup frame
-    print(f"\tMedian time: {np.median(triangulation_times)} ms")
-    print(f"\tPercent of median time: {np.median(triangulation_times)/np.median(multiframe_payload_times) * 100}")
-    print(f"\tFastest {num_samples} times: {np.sort(triangulation_times)[:num_samples].tolist()} ms")
-    print(f"\tSlowest {num_samples} times: {np.sort(triangulation_times)[-num_samples:].tolist()} ms")
-
-    final_triangulated_data = np.stack(triangulated_data_store, axis=0)
-    print(f"Saving triangulated data with shape {final_triangulated_data.shape} to file")
-    np.save("3d_data_frames_markers_xyz.npy", final_triangulated_data)
+def export_metrics(metrics: PipelineMetrics, recording_folder: str | Path) -> None:
+    print(metrics.format_snapshot(metrics.current_snapshot()))
+    metrics.export_json(Path(recording_folder) / "pipeline_metrics.json")
+    metrics.export_csv(Path(recording_folder) / "pipeline_metrics.csv")
+    print(f"Saved pipeline metrics to {recording_folder}")
 
 
 # Takes about 300 ms per frame group with mediapipe model_complexity=2
 def heavyweight_realtime_pipeline(
-    camera_group: CameraGroup,
-    input_queue: Queue,
-    output_queue: Queue,
+    triangulator: RealtimeTriangulator,
+    input_queue: PayloadIngestQueue,
+    output_channel: Optional[SharedLatestFrame],
     stop_event,
+    recording_folder: Optional[str] = None,
+    quiet: bool = False,
+    metrics_report_interval_s: Optional[float] = 5.0,
+    ready_queue: Optional[Queue] = None,
+    warmup_image_shapes: Sequence[Tuple[int, int, int]] = (),
+    quality_controller: Optional[AdaptiveQualityController] = None,
+    tracking_job_queue: "Queue | CameraAffineJobQueue | None" = None,
+    tracking_result_queue: Optional[Queue] = None,
+    tracker_setup_queue: Optional[Queue] = None,
+    num_tracker_workers: int = 0,
+    use_shared_memory: bool = True,
+    min_confidence: Optional[float] = None,
+    profiling: Optional[ProfilingConfig] = None,
 ):
-    # initialize tracker
-    tracker = MediapipeHolisticTracker(model_complexity=2, static_image_mode=True)
+    """
+    Stage timings are kept and exported like in `lightweight_realtime_pipeline`,
+    triangulated frames are published to `output_channel` and the process is profiled with `profiling` the same way.
+
+    Tracks with mediapipe `model_complexity=2`, or with `quality_controller`, at the controller's current
+    model complexity, which it switches based on the tracking times. The complexity of each frame is streamed to
+    `quality_levels.npy` in the recording folder, like in `lightweight_realtime_pipeline`.
+    With `min_confidence`, keypoints with a lower confidence aren't triangulated, like in `lightweight_realtime_pipeline`.
+
+    With `tracking_job_queue`, the cameras of a multiframe are tracked concurrently by a pool of
+    `num_tracker_workers` `run_tracker` processes (which must have loaded the complexities tracked at),
+    set up and fed the same way as in `lightweight_realtime_pipeline`, so tracking time doesn't grow with
+    the number of cameras as long as there is a worker per camera. The keypoints are combined in camera order,
+    which gives the same triangulated and post processed output as tracking the cameras one after another.
+    Otherwise the cameras are tracked one after another in this process, by trackers loaded for each level
+    and warmed up with a dummy inference at each of `warmup_image_shapes` before the pipeline signals ready on `ready_queue`.
+    """
+    if recording_folder is None:
+        recording_folder = create_new_recording_folder()
+    quality_level_writer = None
+    if quality_controller is not None:
+        quality_level_writer = StreamingNpyWriter(Path(recording_folder) / "quality_levels.npy", dtype=np.int64)
+    metrics = PipelineMetrics(quiet=quiet, report_interval_s=metrics_report_interval_s)
+    use_tracker_pool = tracking_job_queue is not None
+    frame_ring = None
+    keypoint_matrix = None
+    tracker_pool_started = False
+    trackers = {}
+    load_s = 0.0
+    warmup_s = 0.0
+    if not use_tracker_pool:
+        # initialize tracker
+        start_load = perf_counter_ns()
+        model_complexities = [HEAVYWEIGHT_MODEL_COMPLEXITY] if quality_controller is None else quality_controller.levels
+        trackers = {
+            model_complexity: MediapipeHolisticTracker(model_complexity=model_complexity, static_image_mode=True)
+            for model_complexity in model_complexities
+        }
+        load_s = (perf_counter_ns() - start_load) / 1e9
+        warmup_s = sum(
+            warm_up_tracker(tracker=tracker, image_shapes=warmup_image_shapes) for tracker in trackers.values()
+        )
 
-    recording_parameter_model = ProcessingParameterModel(
-        post_processing_parameters_model=PostProcessingParametersModel(
-            run_butterworth_filter=False
-        ),
+    recording_parameter_model = ProcessingParameterModel()
+    # keeps gap filling and butterworth filter state across frames, instead of batch post processing every frame
+    post_processor = StreamingPostProcessor.from_processing_parameters(
+        processing_parameters=recording_parameter_model
     )
-    start = perf_counter_ns()
-
-    while not stop_event.is_set():
-        # pull multiframe payload from queue
-        start_queue = perf_counter_ns()
-        try:
-            multiframe_payload: Optional[MultiFramePayload] = input_queue.get(
-                timeout=0.1
-            )
-        except Empty:
-            continue
-        end_queue = perf_counter_ns()
-        print(f"queue pull took {(end_queue - start_queue) / 1e6} ms")
-
-        if multiframe_payload is None:
-            stop_event.set()
-            break
-        else:
-            print(
-                f"received multiframe payload number {multiframe_payload.multi_frame_number} with frame count {len(multiframe_payload.frames)}"
+    print(f"streaming butterworth filter lags by {post_processor.lag_frames:.2f} frames")
+    # precomputes the skeleton tables once and keeps running segment length statistics across frames
+    anatomical_calculator = IncrementalAnatomicalCalculator(
+        model_info=recording_parameter_model.tracking_model_info
+    )
+    profiler = start_profiler(config=profiling, role="pipeline")
+    signal_ready(ready_queue=ready_queue, role="pipeline", load_s=load_s, warmup_s=warmup_s)
+    try:
+        start = perf_counter_ns()
+
+        while not stop_event.is_set():
+            # pull multiframe payload from queue
+            start_queue = perf_counter_ns()
+            try:
+                multiframe_payload: Optional[MultiFramePayload] = input_queue.get(
+                    timeout=0.1
+                )
+            except Empty:
+                continue
+            end_queue = perf_counter_ns()
+            metrics.log(f"queue pull took {(end_queue - start_queue) / 1e6} ms")
+            metrics.record_ns("queue_pull", start_queue, end_queue)
+
+            if multiframe_payload is None:
+                stop_event.set()
+                break
+            else:
+                metrics.log(
+                    f"received multiframe payload number {multiframe_payload.multi_frame_number} with frame count {len(multiframe_payload.frames)}"
+                )
+
+            profile_frame(profiler, sequence_number=multiframe_payload.multi_frame_number)
+            model_complexity = current_model_complexity(quality_controller, default=HEAVYWEIGHT_MODEL_COMPLEXITY)
+            start_track = perf_counter_ns()
+            if use_tracker_pool:
+                if not tracker_pool_started:
+                    frame_ring, keypoint_matrix = start_tracker_pool(
+                        multiframe_payload=multiframe_payload,
+                        triangulator=triangulator,
+                        tracker_setup_queue=tracker_setup_queue,
+                        num_tracker_workers=num_tracker_workers,
+                        use_shared_memory=use_shared_memory,
+                        max_frames_in_flight=1,
+                    )
+                    tracker_pool_started = True
+                if use_shared_memory:
+                    combined_array = process_one_multiframe_payload_shared_memory(
+                        multiframe_payload=multiframe_payload,
+                        frame_ring=frame_ring,
+                        keypoint_matrix=keypoint_matrix,
+                        job_queue=tracking_job_queue,
+                        result_queue=tracking_result_queue,
+                        metrics=metrics,
+                        model_complexity=model_complexity,
+                        min_confidence=min_confidence,
+                    )
+                else:
+                    combined_array = process_one_multiframe_payload(
+                        multiframe_payload=multiframe_payload,
+                        job_queue=tracking_job_queue,
+                        result_queue=tracking_result_queue,
+                        metrics=metrics,
+                        model_complexity=model_complexity,
+                        min_confidence=min_confidence,
+                    )
+            else:
+                combined_array = mask_low_confidence(
+                    keypoints=track_multiframe_serially(tracker=trackers[model_complexity], multiframe_payload=multiframe_payload),
+                    min_confidence=min_confidence,
+                )
+            metrics.log(f"combined array shape: {combined_array.shape}")
+
+            end_track = perf_counter_ns()
+            metrics.log(f"tracking took {(end_track - start_track) / 1e6} ms")
+            metrics.record_ns("tracking", start_track, end_track)
+            record_quality_level(
+                quality_controller=quality_controller,
+                quality_level_writer=quality_level_writer,
+                metrics=metrics,
+                model_complexity=model_complexity,
+                tracking_ms=(end_track - start_track) / 1e6,
+                sequence_number=multiframe_payload.multi_frame_number,
             )
 
-        # TODO: Frame payloads come in an arbitrary order - should we sort by Camera ID?
-        # or, just access by order of camID (are we guaranteed to have 0-N? or can there be missing values?)
-
-        start_track = perf_counter_ns()
-        for frame_payload in multiframe_payload.frames.values():
-            if frame_payload is None:
-                print(f"multiframe payload frames: {multiframe_payload.frames}")
-                raise ValueError(
-                    "received None frame payload"
-                )  # TODO: decide what to do for incomplete payloads
-            tracker.process_image(frame_payload.image)
-            tracker.recorder.record(tracked_objects=tracker.tracked_objects)
-        combined_array = tracker.recorder.process_tracked_objects(
-            image_size=frame_payload.image.shape[:2]
-        )[
-            :, :, :2
-        ]  # TODO: this doesn't account for images with different sizes
-        tracker.recorder.clear_recorded_objects()
-        print(f"combined array shape: {combined_array.shape}")
-
-        end_track = perf_counter_ns()
-        print(f"tracking took {(end_track - start_track) / 1e6} ms")
-
-        # triangulate frame data with anipose
-        start_triangulate = perf_counter_ns()
-        triangulated_data = camera_group.triangulate(combined_array)
-        print(f"triangulated data shape: {triangulated_data.shape}")
-        end_triangulate = perf_counter_ns()
-        print(f"triangulation took {(end_triangulate - start_triangulate) / 1e6} ms")
-        # push 3d data to output queue
-        # output_queue.put(triangulated_data)
-
-        # add single frame index to triangulated data
-        triangulated_data = np.expand_dims(triangulated_data, axis=0)
-
-        # Need to disable logging setup in freemocap __init__ to be able to import as a library
-        start_postprocessing = perf_counter_ns()
-        print(f"triangulated_data_shape: {triangulated_data.shape}")
-        rotated_data = rotate_by_90_degrees_around_x_axis(triangulated_data)
-        # postprocessing data fails on butterworth filter, which requires at least 15 frames
-        post_processed_data = post_process_data(
-            recording_processing_parameter_model=recording_parameter_model,
-            raw_skel3d_frame_marker_xyz=rotated_data,
-            queue=None,
-        )
-        anatomical_data_dict = calculate_anatomical_data(
-            processing_parameters=recording_parameter_model,
-            skel3d_frame_marker_xyz=post_processed_data,
-            queue=None,
-        )
+            # triangulate frame data
+            start_triangulate = perf_counter_ns()
+            triangulated_data = triangulator.triangulate(combined_array)
+            metrics.log(f"triangulated data shape: {triangulated_data.shape}")
+            end_triangulate = perf_counter_ns()
+            metrics.log(f"triangulation took {(end_triangulate - start_triangulate) / 1e6} ms")
+            metrics.record_ns("triangulation", start_triangulate, end_triangulate)
+            publish_frame(
+                output_channel=output_channel,
+                triangulated_data=triangulated_data,
+                frame_number=multiframe_payload.multi_frame_number,
+            )
 
-        # skipping data saving for now
-        end_postprocessing = perf_counter_ns()
-        print(
-            f"postprocessing took {(end_postprocessing - start_postprocessing) / 1e6} ms"
-        )
+            # add single frame index to triangulated data
+            triangulated_data = np.expand_dims(triangulated_data, axis=0)
 
-        end = perf_counter_ns()
-        print(
-            f"processed frame payload {multiframe_payload.multi_frame_number} in {(end - start) / 1e6} ms"
-        )
-        start = perf_counter_ns()
+            # Need to disable logging setup in freemocap __init__ to be able to import as a library
+            start_postprocessing = perf_counter_ns()
+            metrics.log(f"triangulated_data_shape: {triangulated_data.shape}")
+            rotated_data = rotate_by_90_degrees_around_x_axis(triangulated_data)
+            post_processed_data = post_processor.process_frame(rotated_data[0])[np.newaxis]
+            anatomical_data_dict = anatomical_calculator.process_frame(post_processed_data[0])
 
-    # should we flush the queue here?
-    # i.e. if stop event is called but frames are still in the queue, should we cycle through until queue is empty?
+            # skipping data saving for now
+            end_postprocessing = perf_counter_ns()
+            metrics.log(
+                f"postprocessing took {(end_postprocessing - start_postprocessing) / 1e6} ms"
+            )
+            metrics.record_ns("post_processing", start_postprocessing, end_postprocessing)
 
-    print("finished receiving multiframe payloads")
+            end = perf_counter_ns()
+            metrics.log(
+                f"processed frame payload {multiframe_payload.multi_frame_number} in {(end - start) / 1e6} ms"
+            )
+            metrics.record_ns("total", start, end)
+            metrics.record_capture_latency(capture_time_ns(multiframe_payload), end)
+            metrics.frame_finished(end)
+            start = perf_counter_ns()
+    finally:
+        # stops the camera input and the trackers however the pipeline ends, on an error too
+        stop_event.set()
+        # should we flush the queue here?
+        # i.e. if stop event is called but frames are still in the queue, should we cycle through until queue is empty?
+
+        print("finished receiving multiframe payloads")
+        print(input_queue.report())
+        save_profiler(profiler)
+
+        if frame_ring is not None:
+            for shared_block in (frame_ring, keypoint_matrix):
+                shared_block.close()
+                shared_block.unlink()
+
+        export_metrics(metrics=metrics, recording_folder=recording_folder)
+        if output_channel is not None:
+            output_channel.close()
+        if quality_level_writer is not None:
+            quality_level_writer.close()
+            print(f"Saved the quality level of each frame to {quality_level_writer.file_path}")
+
+
+def track_multiframe_serially(tracker: MediapipeHolisticTracker, multiframe_payload: MultiFramePayload) -> np.ndarray:
+    """
+    Track every camera's frame one after another in this process, and return the (cameras, markers, 3) keypoints
+    and confidences in sorted camera order, like the tracker pool does.
+    """
+    keypoints = []
+    for camera_id in discover_camera_ids(multiframe_payload):
+        frame_payload = multiframe_payload.frames[camera_id]
+        if frame_payload is None:
+            print(f"multiframe payload frames: {multiframe_payload.frames}")
+            raise ValueError(
+                "received None frame payload"
+            )  # TODO: decide what to do for incomplete payloads
+        keypoints.append(track_image(tracker=tracker, image=frame_payload.image)[0])
+    return np.stack(keypoints)
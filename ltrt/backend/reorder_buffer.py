@@ -0,0 +1,122 @@
+from dataclasses import dataclass, field
+from time import perf_counter_ns
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+from ltrt.backend.roi_cropping import CropTransform
+
+
+@dataclass
+class InFlightFrame:
+    sequence_number: int
+    # None when the images are pickled into the jobs instead of written to the shared frame ring
+    slot: Optional[int]
+    camera_ids: Set[int]
+    send_time_ns: int
+    capture_time_ns: Optional[int] = None
+    deadline_ns: Optional[int] = None
+    crop_transforms: Optional[Dict[int, CropTransform]] = None
+    model_complexity: Optional[int] = None
+    finished_camera_ids: Set[int] = field(default_factory=set)
+    result_times_ns: Dict[int, int] = field(default_factory=dict)
+    # how long each camera's tracker took to track it, as reported by the tracker
+    tracking_ns: Dict[int, int] = field(default_factory=dict)
+    # (markers, 3) keypoints of results that carry them, without shared memory
+    keypoints: Dict[int, np.ndarray] = field(default_factory=dict)
+
+    @property
+    def is_complete(self) -> bool:
+        return self.finished_camera_ids == self.camera_ids
+
+    @property
+    def missed_camera_ids(self) -> Set[int]:
+        return self.camera_ids - self.finished_camera_ids
+
+
+class ReorderBuffer:
+    """
+    Keeps track of the multiframes that have been sent to the trackers but not triangulated yet.
+
+    Tracker results are added per camera as they arrive, in any order,
+    and completed multiframes are released in the order they were sent.
+    A multiframe with a deadline is also released once its deadline has passed, with the cameras that
+    haven't answered yet as `missed_camera_ids`. Their results are ignored if they arrive later.
+    """
+
+    def __init__(self):
+        # dicts keep insertion order, so the first entry is always the oldest multiframe in flight
+        self._in_flight: Dict[int, InFlightFrame] = {}
+        self._last_released_sequence_number: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    def add_frame(
+        self,
+        sequence_number: int,
+        slot: Optional[int],
+        camera_ids: Set[int],
+        send_time_ns: int,
+        capture_time_ns: Optional[int] = None,
+        deadline_ns: Optional[int] = None,
+        crop_transforms: Optional[Dict[int, CropTransform]] = None,
+        model_complexity: Optional[int] = None,
+    ) -> None:
+        if sequence_number in self._in_flight:
+            raise RuntimeError(f"Multiframe {sequence_number} is already in flight")
+        self._in_flight[sequence_number] = InFlightFrame(
+            sequence_number=sequence_number,
+            slot=slot,
+            camera_ids=set(camera_ids),
+            send_time_ns=send_time_ns,
+            capture_time_ns=capture_time_ns,
+            deadline_ns=deadline_ns,
+            crop_transforms=crop_transforms,
+            model_complexity=model_complexity,
+        )
+
+    @property
+    def next_deadline_ns(self) -> Optional[int]:
+        """Deadline of the oldest multiframe in flight, which is the next one that can be released"""
+        for in_flight_frame in self._in_flight.values():
+            return in_flight_frame.deadline_ns
+        return None
+
+    def add_result(
+        self,
+        camera_id: int,
+        slot: Optional[int],
+        sequence_number: int,
+        keypoints: Optional[np.ndarray] = None,
+        tracking_ns: Optional[int] = None,
+    ) -> None:
+        in_flight_frame = self._in_flight.get(sequence_number)
+        if in_flight_frame is None:
+            if self._last_released_sequence_number is not None and sequence_number <= self._last_released_sequence_number:
+                # late result for a multiframe that was released at its deadline
+                return
+            raise RuntimeError(f"Received result from camera {camera_id} for multiframe {sequence_number}, which is not in flight")
+        if in_flight_frame.slot != slot:
+            raise RuntimeError(
+                f"Received result from camera {camera_id} for multiframe {sequence_number} in slot {slot}, expected slot {in_flight_frame.slot}"
+            )
+        in_flight_frame.finished_camera_ids.add(camera_id)
+        if keypoints is not None:
+            in_flight_frame.keypoints[camera_id] = keypoints
+        if tracking_ns is not None:
+            in_flight_frame.tracking_ns[camera_id] = tracking_ns
+        in_flight_frame.result_times_ns[camera_id] = perf_counter_ns()
+
+    def pop_ready(self, now_ns: Optional[int] = None) -> List[InFlightFrame]:
+        """Remove and return the complete or overdue multiframes at the head of the buffer, oldest first"""
+        now_ns = perf_counter_ns() if now_ns is None else now_ns
+        ready_frames = []
+        while self._in_flight:
+            oldest_frame = next(iter(self._in_flight.values()))
+            overdue = oldest_frame.deadline_ns is not None and now_ns >= oldest_frame.deadline_ns
+            if not (oldest_frame.is_complete or overdue):
+                break
+            ready_frames.append(self._in_flight.pop(oldest_frame.sequence_number))
+            self._last_released_sequence_number = oldest_frame.sequence_number
+        return ready_frames
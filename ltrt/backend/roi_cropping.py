@@ -0,0 +1,150 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from skellycam.core.frames.payloads.multi_frame_payload import MultiFramePayload
+
+
+@dataclass
+class CropTransform:
+    """Where a tracker input image came from: `full_image_xy = input_xy / (x_scale, y_scale) + (x_offset, y_offset)`"""
+
+    x_offset: int = 0
+    y_offset: int = 0
+    x_scale: float = 1.0
+    y_scale: float = 1.0
+
+    def to_full_image(self, keypoints: np.ndarray) -> np.ndarray:
+        """(..., 2) pixel coordinates in the tracker input image, mapped to the full camera image"""
+        return keypoints[..., :2] / np.array([self.x_scale, self.y_scale]) + np.array([self.x_offset, self.y_offset])
+
+
+class RoiCropper:
+    """
+    Shrinks the images sent to the trackers, and maps the keypoints that come back to full image pixel coordinates.
+
+    With `crop_to_roi`, each camera's image is cropped to the box around its most recent keypoints, padded by
+    `padding_fraction` of the box's longer side on each side (and at least `min_crop_size` pixels wide and high).
+    A camera with no keypoints (the first frame, or tracking was lost) gets the full image.
+    With `max_inference_size`, images (cropped or not) whose longer side is bigger are downscaled to it.
+
+    Used by the pipeline: `crop_multiframe` before sending a multiframe, then `to_full_image` on the
+    (cameras, markers, 2) result and `update` with it, so the next multiframe is cropped around it.
+    """
+
+    def __init__(
+        self,
+        crop_to_roi: bool = True,
+        padding_fraction: float = 0.25,
+        min_crop_size: int = 128,
+        max_inference_size: Optional[int] = None,
+    ):
+        self.crop_to_roi = crop_to_roi
+        self.padding_fraction = padding_fraction
+        self.min_crop_size = min_crop_size
+        self.max_inference_size = max_inference_size
+        # (x_min, y_min, x_max, y_max) box of each camera's most recent keypoints
+        self.keypoint_boxes: Dict[int, Tuple[float, float, float, float]] = {}
+
+    def crop_multiframe(
+        self,
+        multiframe_payload: MultiFramePayload,
+    ) -> Tuple[Dict[int, np.ndarray], Dict[int, CropTransform]]:
+        """The tracker input image of every camera, and how to map its keypoints back"""
+        images = {}
+        transforms = {}
+        for camera_id, frame_payload in multiframe_payload.frames.items():
+            if frame_payload is None:
+                raise RuntimeError("Frame Payload is None")
+            images[camera_id], transforms[camera_id] = self.crop(camera_id=camera_id, image=frame_payload.image)
+        return images, transforms
+
+    def crop(self, camera_id: int, image: np.ndarray) -> Tuple[np.ndarray, CropTransform]:
+        height, width = image.shape[:2]
+        x_offset, y_offset, x_end, y_end = 0, 0, width, height
+        keypoint_box = self.keypoint_boxes.get(camera_id) if self.crop_to_roi else None
+        if keypoint_box is not None:
+            x_offset, y_offset, x_end, y_end = self._padded_box(keypoint_box=keypoint_box, width=width, height=height)
+            image = image[y_offset:y_end, x_offset:x_end]
+
+        crop_width, crop_height = x_end - x_offset, y_end - y_offset
+        scaled_width, scaled_height = self._scaled_size(width=crop_width, height=crop_height)
+        if (scaled_width, scaled_height) != (crop_width, crop_height):
+            image = cv2.resize(image, dsize=(scaled_width, scaled_height), interpolation=cv2.INTER_AREA)
+        return image, CropTransform(
+            x_offset=x_offset,
+            y_offset=y_offset,
+            # from the rounded size, since that is what the tracker's normalized coordinates are scaled by
+            x_scale=scaled_width / crop_width,
+            y_scale=scaled_height / crop_height,
+        )
+
+    def inference_shape(self, image_shape: Tuple[int, int, int]) -> Tuple[int, int, int]:
+        """Shape of the tracker input for a full image of `image_shape`, which is what a camera without keypoints gets"""
+        height, width, channels = image_shape
+        scaled_width, scaled_height = self._scaled_size(width=width, height=height)
+        return scaled_height, scaled_width, channels
+
+    def _scaled_size(self, width: int, height: int) -> Tuple[int, int]:
+        longer_side = max(width, height)
+        if self.max_inference_size is None or longer_side <= self.max_inference_size:
+            return width, height
+        scale = self.max_inference_size / longer_side
+        return max(round(width * scale), 1), max(round(height * scale), 1)
+
+    def _padded_box(
+        self,
+        keypoint_box: Tuple[float, float, float, float],
+        width: int,
+        height: int,
+    ) -> Tuple[int, int, int, int]:
+        x_min, y_min, x_max, y_max = keypoint_box
+        padding = self.padding_fraction * max(x_max - x_min, y_max - y_min)
+        half_width = max((x_max - x_min) / 2 + padding, self.min_crop_size / 2)
+        half_height = max((y_max - y_min) / 2 + padding, self.min_crop_size / 2)
+        x_center = (x_min + x_max) / 2
+        y_center = (y_min + y_max) / 2
+        x_start = int(np.clip(np.floor(x_center - half_width), 0, width - 1))
+        y_start = int(np.clip(np.floor(y_center - half_height), 0, height - 1))
+        x_end = int(np.clip(np.ceil(x_center + half_width), x_start + 1, width))
+        y_end = int(np.clip(np.ceil(y_center + half_height), y_start + 1, height))
+        return x_start, y_start, x_end, y_end
+
+    @staticmethod
+    def to_full_image(
+        keypoints: np.ndarray,
+        camera_ids: List[int],
+        transforms: Dict[int, CropTransform],
+    ) -> np.ndarray:
+        """Map (cameras, markers, 2) tracker keypoints, ordered like `camera_ids`, to full image pixel coordinates"""
+        full_image_keypoints = np.empty(keypoints.shape[:2] + (2,))
+        for camera_index, camera_id in enumerate(camera_ids):
+            full_image_keypoints[camera_index] = transforms[camera_id].to_full_image(keypoints[camera_index])
+        return full_image_keypoints
+
+    def update(
+        self,
+        keypoints: np.ndarray,
+        camera_ids: List[int],
+        missed_camera_ids: Iterable[int] = (),
+    ) -> None:
+        """
+        Set each camera's box from its (cameras, markers, 2) full image keypoints, ordered like `camera_ids`.
+        Cameras that missed the frame keep their box, and cameras without any keypoints lose it.
+        """
+        if not self.crop_to_roi:
+            return
+        missed_camera_ids = set(missed_camera_ids)
+        for camera_index, camera_id in enumerate(camera_ids):
+            if camera_id in missed_camera_ids:
+                continue
+            camera_keypoints = keypoints[camera_index]
+            camera_keypoints = camera_keypoints[~np.isnan(camera_keypoints).any(axis=1)]
+            if len(camera_keypoints) == 0:
+                self.keypoint_boxes.pop(camera_id, None)
+                continue
+            x_min, y_min = camera_keypoints.min(axis=0)
+            x_max, y_max = camera_keypoints.max(axis=0)
+            self.keypoint_boxes[camera_id] = (x_min, y_min, x_max, y_max)
@@ -1,89 +1,278 @@
 from multiprocessing import Event, Queue, Process
+import os
 from pathlib import Path
 import time
+from typing import Callable, Optional, Sequence, Tuple
 
 from aniposelib.cameras import CameraGroup
+from skellytracker.trackers.mediapipe_tracker.mediapipe_model_info import MediapipeModelInfo
 
-from ltrt.backend.tracking_process import run_tracker
-from ltrt.mock_data.mock_multiframe_payload import mock_camera_input
-from ltrt.backend.realtime_pipeline import lightweight_realtime_pipeline
+from ltrt.backend.ingest_queue import IngestPolicy, PayloadIngestQueue
+from ltrt.backend.quality_controller import AdaptiveQualityController
+from ltrt.backend.roi_cropping import RoiCropper
+from ltrt.backend.sampling_profiler import ProfilingConfig, merge_profiles
+from ltrt.backend.shared_memory_transport import SharedLatestFrame
+from ltrt.backend.startup import (
+    format_startup_report,
+    image_shapes_from_calibration,
+    run_camera_input,
+    save_startup_report,
+    wait_until_ready,
+)
+from ltrt.backend.tracking_process import (
+    DEFAULT_MODEL_COMPLEXITY,
+    HEAVYWEIGHT_MODEL_COMPLEXITY,
+    CameraAffineJobQueue,
+    run_tracker,
+)
+from ltrt.backend.triangulation import RealtimeTriangulator
+from ltrt.mock_data.replay_multiframe_payload import replay_camera_input
+from ltrt.backend.realtime_pipeline import heavyweight_realtime_pipeline, lightweight_realtime_pipeline
+from ltrt.system.path_utilities import create_new_recording_folder
 
-def run_realtime(calibration_toml_path: str | Path, stop_event) -> list[Process]:
-    camera_group = CameraGroup.load(str(calibration_toml_path))
+def default_num_tracker_workers(num_cameras: Optional[int] = None, max_frames_in_flight: int = 1) -> int:
+    """
+    One tracker worker per core, leaving a core each for the camera input and the pipeline,
+    but no more than the `num_cameras * max_frames_in_flight` tracking jobs that can be in flight at once
+    """
+    num_workers = (os.cpu_count() or 1) - 2
+    if num_cameras is not None:
+        num_workers = min(num_workers, num_cameras * max_frames_in_flight)
+    return max(1, num_workers)
+
+def create_output_channel() -> SharedLatestFrame:
+    """
+    Latest-value channel for the (markers, 3) triangulated frames, to pass to `run_realtime` and to consumer processes.
+    The caller owns it, and has to close and unlink it after the pipeline is done.
+    """
+    return SharedLatestFrame(frame_shape=(MediapipeModelInfo.num_tracked_points, 3))
+
+def run_realtime(
+    calibration_toml_path: str | Path,
+    stop_event,
+    use_shared_memory: bool = True,
+    max_frames_in_flight: int = 1,
+    frame_deadline_ms: Optional[float] = None,
+    ingest_policy: IngestPolicy = IngestPolicy.UNBOUNDED,
+    ingest_queue_size: int = 2,
+    ingest_keep_every: int = 2,
+    quiet: bool = False,
+    num_tracker_workers: Optional[int] = None,
+    keyframe_interval: int = 1,
+    crop_to_roi: bool = False,
+    roi_padding_fraction: float = 0.25,
+    max_inference_size: Optional[int] = None,
+    target_tracking_ms: Optional[float] = None,
+    model_complexities: Sequence[int] = (0, 1, 2),
+    min_confidence: Optional[float] = None,
+    camera_input: Callable = replay_camera_input,
+    camera_input_args: tuple = (),
+    use_heavyweight_pipeline: bool = False,
+    recording_folder: Optional[str] = None,
+    startup_timeout_s: float = 120.0,
+    output_channel: Optional[SharedLatestFrame] = None,
+    profile_window: Optional[Tuple[int, int]] = None,
+) -> list[Process]:
+    """
+    Start the camera input, tracker pool and pipeline processes.
 
-    frame_payload_queue = Queue()
+    `camera_input(frame_payload_queue, *camera_input_args)` is run in its own process and must put
+    multiframe payloads into the queue, followed by `None` when it's done. By default it replays the sample
+    videos at their native frame rate (see `replay_camera_input` for the other rates, looping and caching). The pipeline discovers the
+    camera ids from the first multiframe, so any number of cameras matching the calibration works.
+    `num_tracker_workers` tracker processes (`default_num_tracker_workers` if None, one per core up to the number of
+    tracking jobs that can be in flight) share the tracking jobs of every camera, independent of the number of cameras.
+    With `keyframe_interval` > 1, trackers only run the model every `keyframe_interval` frames of a camera
+    and propagate the keypoints with optical flow in between. Each camera is then tracked by one worker,
+    so more workers than cameras doesn't help.
+    With `crop_to_roi` (lightweight pipeline only), trackers get each camera's image cropped to its last keypoints, padded by `roi_padding_fraction`
+    (the full image if tracking was lost), and with `max_inference_size` images are downscaled to at most that many
+    pixels on their longer side. Keypoints are mapped back to full image coordinates before triangulation.
+    ROI cropping moves the image between frames, so it can't be combined with keyframe tracking.
+    With `target_tracking_ms`, an `AdaptiveQualityController` switches the mediapipe model complexity between
+    `model_complexities` (cheapest first) at run time, to track at the most accurate one that keeps the median
+    tracking time per multiframe within the target. Every tracker loads all of them at startup.
+    Without it, the lightweight pipeline tracks at complexity 0 and the heavyweight pipeline at 2.
+    With `min_confidence` (e.g. 0.5), keypoints the trackers are less sure of than that aren't triangulated.
+    With `frame_deadline_ms`, a multiframe is triangulated from the cameras that answered within that time
+    of it being sent to the trackers, instead of waiting for every camera.
+    With `use_heavyweight_pipeline`, the tracker pool runs the heavyweight model (mediapipe complexity 2) on every camera of
+    a multiframe concurrently, and the pipeline post processes the triangulated data. `max_frames_in_flight`,
+    `frame_deadline_ms` and ROI cropping only apply to the lightweight pipeline.
 
-    processes = []
+    With `output_channel` (see `create_output_channel`), the pipeline publishes every triangulated frame to it,
+    for any number of live consumers to read the newest frame with a `LatestFrameReader`, without ever blocking on them.
 
-    print("creating mock camera input process")
-    mock_camera_process = Process(
-        target=mock_camera_input,
-        args=[frame_payload_queue]
+    With `profile_window=(first_frame, num_frames)`, the camera input, every tracker and the pipeline run a sampling
+    profiler over those frames and save their profiles (per camera for the trackers) to the recording folder.
+    `shutdown_realtime(processes, recording_folder)` merges them into a summary of the hottest functions.
+
+    Every tracker loads its model and runs a dummy inference at the calibration's image sizes (downscaled to
+    `max_inference_size`, if set), then signals ready.
+    The camera input is only started once the trackers and the pipeline are ready, and this returns as soon as
+    every process is ready (or raises if one isn't within `startup_timeout_s`), printing how long each took to
+    start and saving it to `startup_times.json` in the recording folder.
+    """
+    if crop_to_roi and keyframe_interval > 1:
+        raise ValueError("ROI cropping can't be combined with keyframe tracking, optical flow needs the same crop on consecutive frames")
+    camera_group = CameraGroup.load(str(calibration_toml_path))
+    triangulator = RealtimeTriangulator(camera_group=camera_group)
+    warmup_image_shapes = image_shapes_from_calibration(camera_group)
+
+    roi_cropper = None
+    if not use_heavyweight_pipeline and (crop_to_roi or max_inference_size is not None):
+        roi_cropper = RoiCropper(
+            crop_to_roi=crop_to_roi,
+            padding_fraction=roi_padding_fraction,
+            max_inference_size=max_inference_size,
+        )
+        # the first frames are tracked uncropped, at their downscaled size (crops vary in size, so they aren't warmed up)
+        warmup_image_shapes = list(
+            dict.fromkeys(roi_cropper.inference_shape(image_shape) for image_shape in warmup_image_shapes)
+        )
+
+    frame_payload_queue = PayloadIngestQueue(
+        policy=ingest_policy,
+        maxsize=ingest_queue_size,
+        keep_every=ingest_keep_every,
     )
-    processes.append(mock_camera_process)
+    ready_queue = Queue()
+
+    if recording_folder is None:
+        recording_folder = create_new_recording_folder()
+    print(f"saving output to {recording_folder}")
+
+    profiling = None
+    if profile_window is not None:
+        first_frame, num_frames = profile_window
+        profiling = ProfilingConfig(output_folder=str(recording_folder), first_frame=first_frame, num_frames=num_frames)
 
-    camera_ids = [
-        1,
-        2,
-        3,
-    ]  # TODO: pull first multiframe payload to get camera ids for now, in the future see if there's a better way to do this.
-    tracking_payload_queues = {camera_id: Queue() for camera_id in camera_ids}
-    tracking_output_queues = {camera_id: Queue() for camera_id in camera_ids}
+    quality_controller = None
+    if target_tracking_ms is not None:
+        quality_controller = AdaptiveQualityController(target_tracking_ms=target_tracking_ms, levels=model_complexities)
 
-    print("creating tracking processes")
+    if num_tracker_workers is None:
+        # the heavyweight pipeline tracks one multiframe at a time, and with keyframe tracking each camera has one worker
+        pipelined = not use_heavyweight_pipeline and keyframe_interval == 1
+        num_tracker_workers = default_num_tracker_workers(
+            num_cameras=len(camera_group.cameras), max_frames_in_flight=max_frames_in_flight if pipelined else 1
+        )
+    if keyframe_interval > 1:
+        tracking_job_queue = CameraAffineJobQueue(num_workers=num_tracker_workers)
+        worker_job_queues = tracking_job_queue.queues
+    else:
+        tracking_job_queue = Queue()
+        worker_job_queues = [tracking_job_queue] * num_tracker_workers
+    tracking_result_queue = Queue()
+    tracker_setup_queue = Queue()
+    if quality_controller is not None:
+        tracker_model_complexities = quality_controller.levels
+    elif use_heavyweight_pipeline:
+        tracker_model_complexities = (HEAVYWEIGHT_MODEL_COMPLEXITY,)
+    else:
+        tracker_model_complexities = (DEFAULT_MODEL_COMPLEXITY,)
+
+    print("creating camera input process")
+    camera_input_process = Process(
+        target=run_camera_input,
+        args=[ready_queue, camera_input, frame_payload_queue, *camera_input_args],
+        kwargs={"profiling": profiling},
+    )
+
+    print(f"creating {num_tracker_workers} tracking processes")
     tracker_processes = {
-        camera_id: Process(
+        f"tracker_{worker_index}": Process(
             target = run_tracker,
-            args=[tracking_payload_queues[camera_id], tracking_output_queues[camera_id], stop_event]
-        ) for camera_id in camera_ids
+            args=[worker_job_queues[worker_index], tracking_result_queue, tracker_setup_queue, stop_event],
+            kwargs={
+                "ready_queue": ready_queue,
+                "warmup_image_shapes": warmup_image_shapes,
+                "role": f"tracker_{worker_index}",
+                "keyframe_interval": keyframe_interval,
+                "model_complexities": tracker_model_complexities,
+                "profiling": profiling,
+            },
+        ) for worker_index in range(num_tracker_workers)
     }
 
-    output_data_queue = Queue(maxsize=1)
-
-    print("creating lightweight realtime pipeline process")
-    realtime_pipeline_process = Process(
-        target=lightweight_realtime_pipeline,
-        args=[camera_group, frame_payload_queue, tracking_payload_queues, tracking_output_queues, output_data_queue, stop_event]
-    )
-    # print("starting heavyweight realtime pipeline process")
-    # realtime_pipeline_process = Process(
-    #     target=heavyweight_realtime_pipeline,
-    #     args=[camera_group, frame_payload_queue, output_data_queue, stop_event]
-    # )
+    if use_heavyweight_pipeline:
+        print("creating heavyweight realtime pipeline process")
+        realtime_pipeline_process = Process(
+            target=heavyweight_realtime_pipeline,
+            args=[triangulator, frame_payload_queue, output_channel, stop_event],
+            kwargs={
+                "recording_folder": recording_folder,
+                "quiet": quiet,
+                "ready_queue": ready_queue,
+                "quality_controller": quality_controller,
+                "tracking_job_queue": tracking_job_queue,
+                "tracking_result_queue": tracking_result_queue,
+                "tracker_setup_queue": tracker_setup_queue,
+                "num_tracker_workers": num_tracker_workers,
+                "use_shared_memory": use_shared_memory,
+                "min_confidence": min_confidence,
+                "profiling": profiling,
+            },
+        )
+    else:
+        print("creating lightweight realtime pipeline process")
+        realtime_pipeline_process = Process(
+            target=lightweight_realtime_pipeline,
+            args=[triangulator, frame_payload_queue, tracking_job_queue, tracking_result_queue, tracker_setup_queue, num_tracker_workers, output_channel, stop_event],
+            kwargs={
+                "use_shared_memory": use_shared_memory,
+                "max_frames_in_flight": max_frames_in_flight,
+                "frame_deadline_ms": frame_deadline_ms,
+                "recording_folder": recording_folder,
+                "quiet": quiet,
+                "ready_queue": ready_queue,
+                "roi_cropper": roi_cropper,
+                "quality_controller": quality_controller,
+                "min_confidence": min_confidence,
+                "profiling": profiling,
+            },
+        )
     print("starting processes")
-    for process in tracker_processes.values():
+    start_startup = time.perf_counter()
+    starting_processes = {**tracker_processes, "pipeline": realtime_pipeline_process}
+    for process in starting_processes.values():
         process.start()
-        processes.append(process)
-    mock_camera_process.start()
-    realtime_pipeline_process.start()
-    processes.append(realtime_pipeline_process)
 
-    # processes sharing a multiprocessing primitive (the queues and stop event here) must start fully before function ends
-    # this sleep should work, but if you get FileNotFound errors here, it may require joining the processes within this function
-    time.sleep(8)
+    # the cameras start once the trackers are warm, so the first frames don't wait on model loading
+    try:
+        startup_reports = wait_until_ready(
+            ready_queue=ready_queue, processes=starting_processes, timeout_s=startup_timeout_s, start=start_startup
+        )
+        camera_input_process.start()
+        startup_reports += wait_until_ready(
+            ready_queue=ready_queue,
+            processes={"camera_input": camera_input_process},
+            timeout_s=startup_timeout_s,
+            start=start_startup,
+        )
+    except RuntimeError:
+        stop_event.set()
+        raise
+    print(format_startup_report(startup_reports))
+    save_startup_report(startup_reports, Path(recording_folder) / "startup_times.json")
 
     print("finished starting realtime")
-    return processes
+    return [*tracker_processes.values(), camera_input_process, realtime_pipeline_process]
 
-def shutdown_realtime(processes: list[Process]) -> None:
+def shutdown_realtime(processes: list[Process], recording_folder: Optional[str | Path] = None) -> None:
+    """Wait for every process to finish, then merge the profiles they saved to `recording_folder` (if profiled)"""
     for process in processes:
         process.join()
+    if recording_folder is not None:
+        merge_profiles(recording_folder=recording_folder)
 
 if __name__ == "__main__":
-    # import cProfile
-    # import pstats
     stop_event = Event()
     calibration_toml_path = ".assets/freemocap_sample_data/freemocap_sample_data_camera_calibration.toml"
-    processes = run_realtime(calibration_toml_path, stop_event)
+    recording_folder = create_new_recording_folder()
+    # (first_frame, num_frames) to profile every process over those frames
+    profile_window = None
+    processes = run_realtime(calibration_toml_path, stop_event, recording_folder=recording_folder, profile_window=profile_window)
     while not stop_event.is_set():
         time.sleep(0.1)
-    shutdown_realtime(processes=processes)
-
-
-    # with cProfile.Profile() as profile:
-    #     cam_buffers, processes = run_realtime(calibration_toml_path, stop_event)
-    #     shutdown_realtime(processes=processes, cam_buffers=cam_buffers, stop_event=stop_event)
-
-    # results = pstats.Stats(profile)
-    # results.sort_stats(pstats.SortKey.TIME)
-    # results.print_stats()
\ No newline at end of file
+    shutdown_realtime(processes=processes, recording_folder=recording_folder)
\ No newline at end of file
@@ -0,0 +1,236 @@
+import argparse
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+import json
+import os
+from pathlib import Path
+import sys
+import threading
+from time import perf_counter
+from typing import Dict, List, Optional
+
+from skellycam.core.frames.payloads.multi_frame_payload import MultiFramePayload
+
+PROFILE_FILE_PREFIX = "profile_"
+PROFILE_SUMMARY_FILE_NAME = "profile_summary.json"
+
+
+@dataclass
+class ProfilingConfig:
+    """Which frames every process of a session samples its main thread for, and where the profiles go"""
+
+    output_folder: str
+    first_frame: int = 0
+    num_frames: int = 300
+    interval_ms: float = 5.0
+    max_stack_depth: int = 64
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for the main thread of one process, for a window of frames.
+
+    A background thread wakes up every `interval_ms` and records the main thread's stack (from `sys._current_frames`),
+    so the profiled code isn't instrumented and runs at full speed, unlike under cProfile. Each sample counts as
+    self time for the function on top of the stack and as total time for every function in it.
+    Call `frame` with the sequence number of every frame the process handles: sampling starts at `first_frame`
+    and stops after `num_frames` frames, then the profile is saved.
+    Samples are tagged with the camera id passed to `frame` (trackers take jobs from every camera), and each
+    camera's samples are saved to their own `profile_<role>_camera_<camera id>.json`, or `profile_<role>.json` without one.
+    """
+
+    def __init__(self, config: ProfilingConfig, role: str):
+        self.config = config
+        self.role = role
+        self.camera_id: Optional[int] = None
+        self.samples: Dict[Optional[int], Counter] = defaultdict(Counter)
+        self.first_sampled_frame: Optional[int] = None
+        self.last_sampled_frame: Optional[int] = None
+        self.saved = False
+        self._thread_id = threading.get_ident()
+        self._stop_sampling = threading.Event()
+        self._sampling_thread: Optional[threading.Thread] = None
+        self._start_time = 0.0
+        self._sampling_s = 0.0
+
+    @property
+    def last_frame(self) -> int:
+        return self.config.first_frame + self.config.num_frames - 1
+
+    def frame(self, sequence_number: int, camera_id: Optional[int] = None) -> None:
+        """Start or stop sampling at the window's edges, and tag the following samples with `camera_id`"""
+        if self.saved:
+            return
+        self.camera_id = camera_id
+        if sequence_number > self.last_frame:
+            self.save()
+            return
+        if sequence_number < self.config.first_frame:
+            return
+        if self._sampling_thread is None:
+            self.first_sampled_frame = sequence_number
+            self._start_time = perf_counter()
+            self._sampling_thread = threading.Thread(target=self._sample, name=f"profiler_{self.role}", daemon=True)
+            self._sampling_thread.start()
+        self.last_sampled_frame = sequence_number
+
+    def _sample(self) -> None:
+        interval_s = self.config.interval_ms / 1000
+        while not self._stop_sampling.wait(interval_s):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None and len(stack) < self.config.max_stack_depth:
+                code = frame.f_code
+                stack.append(f"{code.co_filename}:{code.co_firstlineno}({code.co_name})")
+                frame = frame.f_back
+            # root first, like the collapsed stacks flame graph tools read
+            self.samples[self.camera_id][";".join(reversed(stack))] += 1
+
+    def save(self) -> List[Path]:
+        """Stop sampling and write a profile per camera, returns their paths (only the first call writes)"""
+        if self.saved:
+            return []
+        self.saved = True
+        if self._sampling_thread is None:
+            return []
+        self._stop_sampling.set()
+        self._sampling_thread.join()
+        self._sampling_s = perf_counter() - self._start_time
+
+        file_paths = []
+        Path(self.config.output_folder).mkdir(parents=True, exist_ok=True)
+        for camera_id, stack_counts in self.samples.items():
+            file_name = f"{PROFILE_FILE_PREFIX}{self.role}" + ("" if camera_id is None else f"_camera_{camera_id}")
+            file_path = Path(self.config.output_folder) / f"{file_name}.json"
+            with open(file_path, "w") as file:
+                json.dump(self._profile(camera_id=camera_id, stack_counts=stack_counts), file, indent=4)
+            file_paths.append(file_path)
+        print(f"{self.role} saved profiles of frames {self.first_sampled_frame} to {self.last_sampled_frame} to {[str(path) for path in file_paths]}")
+        return file_paths
+
+    def _profile(self, camera_id: Optional[int], stack_counts: Counter) -> Dict:
+        self_samples = Counter()
+        total_samples = Counter()
+        for stack, count in stack_counts.items():
+            functions = stack.split(";")
+            self_samples[functions[-1]] += count
+            # a recursive function counts once per sample
+            for function in set(functions):
+                total_samples[function] += count
+        return {
+            "role": self.role,
+            "camera_id": camera_id,
+            "pid": os.getpid(),
+            "first_frame": self.first_sampled_frame,
+            "last_frame": self.last_sampled_frame,
+            "sampling_s": self._sampling_s,
+            "interval_ms": self.config.interval_ms,
+            "samples": sum(stack_counts.values()),
+            "functions": [
+                {"function": function, "self_samples": self_samples[function], "total_samples": count}
+                for function, count in total_samples.most_common()
+            ],
+            "stacks": dict(stack_counts.most_common()),
+        }
+
+
+class ProfiledPayloadQueue:
+    """Wraps a camera input's payload queue, so the profiler sees the frame number of every multiframe put into it"""
+
+    def __init__(self, queue, profiler: SamplingProfiler):
+        self.queue = queue
+        self.profiler = profiler
+
+    def put(self, multiframe_payload: Optional[MultiFramePayload], *args, **kwargs) -> None:
+        if multiframe_payload is not None:
+            self.profiler.frame(multiframe_payload.multi_frame_number)
+        self.queue.put(multiframe_payload, *args, **kwargs)
+
+    def __getattr__(self, name: str):
+        return getattr(self.queue, name)
+
+
+def start_profiler(config: Optional[ProfilingConfig], role: str) -> Optional[SamplingProfiler]:
+    """Profiler for this process's main thread, None if profiling is off"""
+    return None if config is None else SamplingProfiler(config=config, role=role)
+
+
+def profile_frame(profiler: Optional[SamplingProfiler], sequence_number: int, camera_id: Optional[int] = None) -> None:
+    if profiler is not None:
+        profiler.frame(sequence_number=sequence_number, camera_id=camera_id)
+
+
+def save_profiler(profiler: Optional[SamplingProfiler]) -> None:
+    """Save the profile of a process that finished inside its profiling window"""
+    if profiler is not None:
+        profiler.save()
+
+
+def merge_profiles(recording_folder: str | Path, top_n: int = 30) -> Optional[Dict]:
+    """
+    Merge every process's profile in `recording_folder` into the `top_n` hottest functions by self samples across
+    processes, with how many samples each process spent in them. Saved to `profile_summary.json` and printed.
+    Returns None if no process saved a profile.
+    """
+    profile_paths = sorted(
+        path for path in Path(recording_folder).glob(f"{PROFILE_FILE_PREFIX}*.json") if path.name != PROFILE_SUMMARY_FILE_NAME
+    )
+    if not profile_paths:
+        return None
+    self_samples = Counter()
+    total_samples = Counter()
+    samples_per_process = defaultdict(dict)
+    process_samples = {}
+    for profile_path in profile_paths:
+        with open(profile_path) as file:
+            profile = json.load(file)
+        process = profile_path.stem[len(PROFILE_FILE_PREFIX):]
+        process_samples[process] = profile["samples"]
+        for function in profile["functions"]:
+            self_samples[function["function"]] += function["self_samples"]
+            total_samples[function["function"]] += function["total_samples"]
+            if function["self_samples"]:
+                samples_per_process[function["function"]][process] = function["self_samples"]
+
+    all_samples = sum(process_samples.values())
+    summary = {
+        "samples": all_samples,
+        "process_samples": process_samples,
+        "functions": [
+            {
+                "function": function,
+                "self_samples": count,
+                "self_percent": 100 * count / all_samples if all_samples else 0.0,
+                "total_samples": total_samples[function],
+                "self_samples_per_process": samples_per_process[function],
+            }
+            for function, count in self_samples.most_common(top_n)
+            if count > 0
+        ],
+    }
+    summary_path = Path(recording_folder) / PROFILE_SUMMARY_FILE_NAME
+    with open(summary_path, "w") as file:
+        json.dump(summary, file, indent=4)
+    print(format_profile_summary(summary))
+    print(f"Saved merged profile of {len(profile_paths)} processes to {summary_path}")
+    return summary
+
+
+def format_profile_summary(summary: Dict) -> str:
+    lines = [f"Hottest functions over {summary['samples']} samples from {len(summary['process_samples'])} processes:"]
+    for function in summary["functions"]:
+        busiest_process = max(function["self_samples_per_process"].items(), key=lambda item: item[1], default=("", 0))[0]
+        lines.append(
+            f"\t{function['self_percent']:5.1f}% self, {function['total_samples']} total samples, most in {busiest_process}: {function['function']}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the per-process profiles of a profiled session")
+    parser.add_argument("recording_folder")
+    parser.add_argument("--top-n", type=int, default=30)
+    args = parser.parse_args()
+    merge_profiles(recording_folder=args.recording_folder, top_n=args.top_n)
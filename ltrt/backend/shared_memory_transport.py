@@ -0,0 +1,333 @@
+import os
+import sys
+from dataclasses import dataclass
+from multiprocessing import resource_tracker, shared_memory
+from time import perf_counter_ns, sleep
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from skellycam.core.frames.payloads.multi_frame_payload import MultiFramePayload
+
+
+def _resource_tracker_id() -> Tuple[int, int]:
+    """Identifies this process's resource tracker by its pipe, which processes that share the tracker share"""
+    tracker_pipe = os.fstat(resource_tracker.getfd())
+    return tracker_pipe.st_dev, tracker_pipe.st_ino
+
+
+def _attach_untracked(shared_memory_name: str, owner_tracker_id: Optional[Tuple[int, int]]) -> shared_memory.SharedMemory:
+    """
+    Attach to an existing block without leaving it registered with this process's resource tracker.
+
+    Attaching registers the block like creating it does, so the tracker would unlink it when this process exits
+    (and warn when the owner already has), but only the creating process owns it, so the registration is undone.
+    Child processes can share the owner's resource tracker, and there the registration was a no op: undoing it
+    would drop the owner's, so it is only undone with a different tracker than the owner's `owner_tracker_id`.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=shared_memory_name, track=False)
+    attached_memory = shared_memory.SharedMemory(name=shared_memory_name)
+    if _resource_tracker_id() != owner_tracker_id:
+        resource_tracker.unregister(attached_memory._name, "shared_memory")
+    return attached_memory
+
+
+class SharedNumpyArray:
+    """
+    A numpy array backed by a named shared memory block.
+
+    Pickling (e.g. passing it as a `Process` arg) only sends the block name, shape and dtype,
+    and the receiving process reattaches to the same memory.
+    Every process should `close()` its handle when done, and exactly one process should `unlink()` the block.
+    """
+
+    def __init__(
+        self,
+        shape: Tuple[int, ...],
+        dtype: np.dtype | str,
+        shared_memory_name: str | None = None,
+        owner_tracker_id: Optional[Tuple[int, int]] = None,
+    ):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        if shared_memory_name is None:
+            nbytes = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+            self.shared_memory = shared_memory.SharedMemory(create=True, size=nbytes)
+            # the resource tracker that creating the block registered it with
+            self.owner_tracker_id = _resource_tracker_id()
+        else:
+            self.shared_memory = _attach_untracked(shared_memory_name, owner_tracker_id=owner_tracker_id)
+            self.owner_tracker_id = owner_tracker_id
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shared_memory.buf)
+
+    def __reduce__(self):
+        return (self.__class__, (self.shape, self.dtype.str, self.shared_memory.name, self.owner_tracker_id))
+
+    def close(self) -> None:
+        self.array = None
+        try:
+            self.shared_memory.close()
+        except BufferError:
+            # a view of the array is still alive somewhere in this process, the mapping is released when it is
+            pass
+
+    def unlink(self) -> None:
+        try:
+            self.shared_memory.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SharedFrameRing:
+    """
+    Preallocated ring of per-camera image slots in shared memory.
+
+    The pipeline writes each multiframe into the next slot (round robin) and only the slot index and
+    sequence number are sent to the trackers, which read their camera's image from the slot in place.
+    Each slot records the sequence number written into it, so a reader can tell if its slot was overwritten.
+    Images smaller than `image_shape` (like ROI crops) are written into the top left of their camera's slot,
+    and their shape is recorded so `read` returns just that part.
+    A slot is safe to read until `num_slots` more multiframes have been written, so the writer must not have
+    more than `num_slots` multiframes in flight.
+    """
+
+    def __init__(
+        self,
+        camera_ids: List[int],
+        image_shape: Tuple[int, ...],
+        num_slots: int = 4,
+    ):
+        self.camera_ids = list(camera_ids)
+        self.camera_indices = {camera_id: index for index, camera_id in enumerate(self.camera_ids)}
+        self.image_shape = tuple(image_shape)
+        self.num_slots = num_slots
+
+        self.images = SharedNumpyArray(
+            shape=(num_slots, len(self.camera_ids), *self.image_shape), dtype=np.uint8
+        )
+        self.image_sizes = SharedNumpyArray(shape=(num_slots, len(self.camera_ids), 2), dtype=np.int64)
+        self.sequence_numbers = SharedNumpyArray(shape=(num_slots,), dtype=np.int64)
+        self.sequence_numbers.array[:] = -1
+        self._next_slot = 0
+
+    def write(
+        self,
+        sequence_number: int,
+        multiframe_payload: MultiFramePayload,
+        images: Optional[Dict[int, np.ndarray]] = None,
+    ) -> int:
+        """Write the multiframe's images (or `images` by camera id, if given) into the next slot, returns the slot"""
+        if images is None:
+            images = {}
+            for camera_id, frame_payload in multiframe_payload.frames.items():
+                if frame_payload is None:
+                    raise RuntimeError("Frame Payload is None")
+                images[camera_id] = frame_payload.image
+        slot = self._next_slot
+        self._next_slot = (self._next_slot + 1) % self.num_slots
+        for camera_id, image in images.items():
+            camera_index = self.camera_indices[camera_id]
+            if image.shape == self.image_shape:
+                self.images.array[slot, camera_index] = image
+            else:
+                height, width = image.shape[:2]
+                if image.shape[2:] != self.image_shape[2:] or height > self.image_shape[0] or width > self.image_shape[1]:
+                    raise ValueError(
+                        f"Image from camera {camera_id} has shape {image.shape}, shared frame ring expects at most {self.image_shape}"
+                    )
+                self.images.array[slot, camera_index, :height, :width] = image
+            self.image_sizes.array[slot, camera_index] = image.shape[:2]
+        self.sequence_numbers.array[slot] = sequence_number
+        return slot
+
+    def read(self, slot: int, camera_id: int) -> np.ndarray:
+        """Returns a view of the image written into the slot, only valid until the slot is reused"""
+        camera_index = self.camera_indices[camera_id]
+        height, width = self.image_sizes.array[slot, camera_index]
+        return self.images.array[slot, camera_index, :height, :width]
+
+    def holds(self, slot: int, sequence_number: int) -> bool:
+        return int(self.sequence_numbers.array[slot]) == sequence_number
+
+    def close(self) -> None:
+        self.images.close()
+        self.image_sizes.close()
+        self.sequence_numbers.close()
+
+    def unlink(self) -> None:
+        self.images.unlink()
+        self.image_sizes.unlink()
+        self.sequence_numbers.unlink()
+
+
+class SharedKeypointMatrix:
+    """
+    Preallocated (slots, cameras, markers, 3) result matrix in shared memory, of 2d keypoints and their confidences.
+
+    Each tracker writes its keypoints into its own camera row of a slot, so the pipeline can triangulate
+    a slot directly without concatenating per-camera arrays.
+    Slots line up with the `SharedFrameRing` slots of the same multiframe.
+
+    Each row is stamped with the sequence number of the frame its keypoints are from. A worker still tracking a
+    multiframe the pipeline gave up on (after a deadline) can write into a row that was reassigned to a later
+    multiframe of the same camera, so the stamp is invalidated before the keypoints are written and set after,
+    like a seqlock, and `read` with a sequence number only keeps rows stamped with it.
+    """
+
+    def __init__(
+        self,
+        camera_ids: List[int],
+        num_markers: int,
+        num_slots: int = 4,
+    ):
+        self.camera_ids = list(camera_ids)
+        self.camera_indices = {camera_id: index for index, camera_id in enumerate(self.camera_ids)}
+        self.num_markers = num_markers
+        self.num_slots = num_slots
+
+        self.keypoints = SharedNumpyArray(
+            shape=(num_slots, len(self.camera_ids), num_markers, 3), dtype=np.float64
+        )
+        self.keypoints.array[:] = np.nan
+        self.sequence_numbers = SharedNumpyArray(shape=(num_slots, len(self.camera_ids)), dtype=np.int64)
+        self.sequence_numbers.array[:] = -1
+
+    def write(self, slot: int, camera_id: int, sequence_number: int, keypoints: np.ndarray) -> None:
+        """Write (markers, 3) keypoints and confidences of frame `sequence_number` into the camera's row of the slot"""
+        camera_index = self.camera_indices[camera_id]
+        self.sequence_numbers.array[slot, camera_index] = -1
+        self.keypoints.array[slot, camera_index] = keypoints
+        self.sequence_numbers.array[slot, camera_index] = sequence_number
+
+    def read(self, slot: int, missed_camera_ids: Iterable[int] = (), sequence_number: Optional[int] = None) -> np.ndarray:
+        """
+        Returns a (cameras, markers, 3) view into the slot, only valid until the slot is reused.
+
+        The rows of `missed_camera_ids` hold whatever was last written there, so if any are given
+        a copy of the slot with those rows set to NaN is returned instead.
+        With `sequence_number`, a copy is returned in which the rows that weren't completely written for that frame
+        (overwritten by a late worker, or still being written when the copy was made) are NaN too.
+        """
+        keypoints = self.keypoints.array[slot]
+        missed_indices = [self.camera_indices[camera_id] for camera_id in missed_camera_ids]
+        if missed_indices or sequence_number is not None:
+            keypoints = keypoints.copy()
+            keypoints[missed_indices] = np.nan
+        if sequence_number is not None:
+            # checked after copying, a write that overlapped the copy has invalidated its row's stamp by now
+            keypoints[self.sequence_numbers.array[slot] != sequence_number] = np.nan
+        return keypoints
+
+    def close(self) -> None:
+        self.keypoints.close()
+        self.sequence_numbers.close()
+
+    def unlink(self) -> None:
+        self.keypoints.unlink()
+        self.sequence_numbers.unlink()
+
+
+@dataclass
+class PublishedFrame:
+    frame: np.ndarray
+    frame_number: int
+    # how many frames had been published, including this one
+    publish_count: int
+    publish_time_ns: int
+    # frames published since the previous frame this reader got, that it never saw
+    skipped_frames: int = 0
+
+
+class SharedLatestFrame:
+    """
+    Single slot latest-value channel in shared memory, for handing the newest 3d frame to live consumers.
+
+    The pipeline `publish`es every frame into the same slot, overwriting the previous one, so publishing never
+    blocks or waits on a slow consumer. Any number of processes (given the channel as a `Process` arg) can `read`
+    the newest frame, and a `LatestFrameReader` tells each consumer how many frames it skipped.
+
+    The slot is guarded by a seqlock: the writer makes the sequence counter odd while it writes and even when
+    it's done, so a reader that sees the same even counter before and after copying the frame knows the copy
+    wasn't torn by a concurrent write, and retries otherwise. The counter is twice the number of frames published.
+    Every process should `close()` its handle when done, and exactly one process (the creator) should `unlink()` it.
+    """
+
+    def __init__(self, frame_shape: Tuple[int, ...], dtype: np.dtype | str = np.float64):
+        self.frame = SharedNumpyArray(shape=frame_shape, dtype=dtype)
+        # sequence counter, frame number, publish time
+        self.header = SharedNumpyArray(shape=(3,), dtype=np.int64)
+        self.header.array[:] = 0
+
+    def publish(self, frame: np.ndarray, frame_number: int) -> None:
+        """Overwrite the slot with the frame, only one process may publish"""
+        header = self.header.array
+        sequence = int(header[0])
+        header[0] = sequence + 1
+        self.frame.array[...] = frame
+        header[1] = frame_number
+        header[2] = perf_counter_ns()
+        header[0] = sequence + 2
+
+    @property
+    def publish_count(self) -> int:
+        return int(self.header.array[0]) // 2
+
+    def read(self, max_attempts: int = 1000) -> Optional[PublishedFrame]:
+        """
+        Copy of the newest frame, or None if nothing has been published yet
+        (or every attempt overlapped a write, which would mean the publisher died mid-write).
+        """
+        header = self.header.array
+        for _ in range(max_attempts):
+            sequence = int(header[0])
+            if sequence == 0:
+                return None
+            if sequence % 2 == 1:
+                # a write is in progress
+                sleep(0)
+                continue
+            frame = self.frame.array.copy()
+            frame_number = int(header[1])
+            publish_time_ns = int(header[2])
+            if int(header[0]) == sequence:
+                return PublishedFrame(
+                    frame=frame,
+                    frame_number=frame_number,
+                    publish_count=sequence // 2,
+                    publish_time_ns=publish_time_ns,
+                )
+        return None
+
+    def close(self) -> None:
+        self.frame.close()
+        self.header.close()
+
+    def unlink(self) -> None:
+        self.frame.unlink()
+        self.header.unlink()
+
+
+class LatestFrameReader:
+    """
+    One consumer's view of a `SharedLatestFrame`: `read_new` only returns frames this reader hasn't seen,
+    with how many frames were published in between (and overwritten before it read them).
+    Frames published before the reader was created don't count as skipped.
+    """
+
+    def __init__(self, channel: SharedLatestFrame):
+        self.channel = channel
+        self.last_publish_count = channel.publish_count
+        self.frames_read = 0
+        self.frames_skipped = 0
+
+    def read_new(self) -> Optional[PublishedFrame]:
+        """The newest frame if it was published since the last call, otherwise None"""
+        published_frame = self.channel.read()
+        if published_frame is None or published_frame.publish_count == self.last_publish_count:
+            return None
+        published_frame.skipped_frames = published_frame.publish_count - self.last_publish_count - 1
+        self.last_publish_count = published_frame.publish_count
+        self.frames_read += 1
+        self.frames_skipped += published_frame.skipped_frames
+        return published_frame
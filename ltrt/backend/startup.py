@@ -0,0 +1,114 @@
+import json
+import multiprocessing
+import os
+from pathlib import Path
+from queue import Empty
+from time import perf_counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from aniposelib.cameras import CameraGroup
+
+from ltrt.backend.sampling_profiler import ProfiledPayloadQueue, ProfilingConfig, save_profiler, start_profiler
+from ltrt.backend.tracker_output import track_image
+
+
+def image_shapes_from_calibration(camera_group: CameraGroup) -> List[Tuple[int, int, int]]:
+    """The distinct (height, width, 3) image shapes of the calibrated cameras, to warm the trackers up at"""
+    image_shapes = []
+    for camera in camera_group.cameras:
+        width, height = camera.get_size()
+        image_shape = (int(height), int(width), 3)
+        if image_shape not in image_shapes:
+            image_shapes.append(image_shape)
+    return image_shapes
+
+
+def warm_up_tracker(tracker, image_shapes: Sequence[Tuple[int, int, int]]) -> float:
+    """
+    Run a dummy inference through the whole tracker path at every image shape, so the first real frame isn't cold.
+    Returns the time it took in seconds.
+
+    A blank image only runs the detection models, the landmark models still initialize on the first detection.
+    """
+    start = perf_counter()
+    for image_shape in image_shapes:
+        track_image(tracker=tracker, image=np.zeros(image_shape, dtype=np.uint8))
+    return perf_counter() - start
+
+
+def signal_ready(
+    ready_queue: Optional[multiprocessing.Queue],
+    role: str,
+    load_s: float = 0.0,
+    warmup_s: float = 0.0,
+) -> None:
+    """Tell `wait_until_ready` this process is ready, with how long its model load and warmup took"""
+    if ready_queue is not None:
+        ready_queue.put({"role": role, "pid": os.getpid(), "load_s": load_s, "warmup_s": warmup_s})
+
+
+def run_camera_input(
+    ready_queue: multiprocessing.Queue,
+    camera_input,
+    camera_payload_queue,
+    *camera_input_args,
+    profiling: Optional[ProfilingConfig] = None,
+) -> None:
+    """
+    Process target that signals ready before running `camera_input(camera_payload_queue, *camera_input_args)`.
+    With `profiling`, the camera input is profiled during the configured frames, counted as they are put into the queue.
+    """
+    profiler = start_profiler(config=profiling, role="camera_input")
+    if profiler is not None:
+        camera_payload_queue = ProfiledPayloadQueue(queue=camera_payload_queue, profiler=profiler)
+    signal_ready(ready_queue=ready_queue, role="camera_input")
+    camera_input(camera_payload_queue, *camera_input_args)
+    save_profiler(profiler)
+
+
+def wait_until_ready(
+    ready_queue: multiprocessing.Queue,
+    processes: Dict[str, multiprocessing.Process],
+    timeout_s: float = 120.0,
+    start: Optional[float] = None,
+) -> List[Dict]:
+    """
+    Block until every process in `processes` (by role) has called `signal_ready`, and return their reports,
+    with `ready_s`, the time from `start` (a `perf_counter()` time, the call if None) to each ready signal.
+
+    Raises a RuntimeError if a process exits or the timeout passes before every process is ready,
+    instead of waiting on a process that will never be ready.
+    """
+    start = perf_counter() if start is None else start
+    reports = []
+    waiting_roles = set(processes.keys())
+    while waiting_roles:
+        try:
+            report = ready_queue.get(timeout=0.1)
+        except Empty:
+            for role in waiting_roles:
+                if not processes[role].is_alive():
+                    raise RuntimeError(f"{role} process exited with code {processes[role].exitcode} before it was ready")
+            if perf_counter() - start > timeout_s:
+                raise RuntimeError(f"{sorted(waiting_roles)} not ready after {timeout_s} s")
+            continue
+        report["ready_s"] = perf_counter() - start
+        waiting_roles.discard(report["role"])
+        reports.append(report)
+    return reports
+
+
+def format_startup_report(reports: List[Dict]) -> str:
+    lines = [f"Startup took {max((report['ready_s'] for report in reports), default=0.0):.2f} s:"]
+    for report in sorted(reports, key=lambda report: report["ready_s"]):
+        lines.append(
+            f"\t{report['role']}: ready after {report['ready_s']:.2f} s "
+            f"(model load {report['load_s']:.2f} s, warmup {report['warmup_s']:.2f} s)"
+        )
+    return "\n".join(lines)
+
+
+def save_startup_report(reports: List[Dict], file_path: str | Path) -> None:
+    with open(file_path, "w") as file:
+        json.dump(reports, file, indent=4)
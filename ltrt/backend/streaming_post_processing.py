@@ -0,0 +1,100 @@
+from typing import Optional
+
+import numpy as np
+from scipy import signal
+
+from freemocap.data_layer.recording_models.post_processing_parameter_models import (
+    ProcessingParameterModel,
+)
+
+
+class StreamingPostProcessor:
+    """
+    Frame by frame replacement for freemocap's batch `post_process_data` (gap filling + butterworth filter).
+
+    The batch version interpolates gaps and runs a zero phase `filtfilt` over the whole recording, which needs
+    the future frames and at least 15 frames to work. This keeps the filter state (second order sections,
+    direct form II transposed) and the last valid position of every marker across frames instead, so each new
+    frame costs O(markers). The filter is causal, so its output lags the input by `lag_frames` at low
+    frequencies, in exchange for never waiting on future frames.
+
+    Gaps are filled by holding the last valid position for up to `max_gap_frames` frames. After a longer gap
+    the marker is output as NaN and its filter restarts from its next valid position.
+    """
+
+    def __init__(
+        self,
+        sampling_rate: float = 30.0,
+        cutoff_frequency: float = 7.0,
+        order: int = 4,
+        run_butterworth_filter: bool = True,
+        max_gap_frames: int = 30,
+    ):
+        self.run_butterworth_filter = run_butterworth_filter
+        self.max_gap_frames = max_gap_frames
+
+        nyquist_frequency = 0.5 * sampling_rate
+        self.sos = signal.butter(order, cutoff_frequency / nyquist_frequency, btype="low", output="sos")
+        # filter state that matches a constant input of 1, scaled by a marker's first position to avoid a startup transient
+        self._unit_step_state = signal.sosfilt_zi(self.sos)
+        numerator, denominator = signal.sos2tf(self.sos)
+        _, group_delay = signal.group_delay((numerator, denominator), w=[0.0])
+        self.lag_frames = float(group_delay[0])
+
+        self._filter_state: Optional[np.ndarray] = None
+        self._last_valid_positions: Optional[np.ndarray] = None
+        self._frames_since_valid: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_processing_parameters(
+        cls,
+        processing_parameters: ProcessingParameterModel,
+    ) -> "StreamingPostProcessor":
+        """Filter and fill gaps with the settings freemocap's batch post processing uses"""
+        post_processing_parameters = processing_parameters.post_processing_parameters_model
+        return cls(
+            sampling_rate=post_processing_parameters.framerate,
+            cutoff_frequency=post_processing_parameters.butterworth_filter_parameters.cutoff_frequency,
+            order=post_processing_parameters.butterworth_filter_parameters.order,
+            run_butterworth_filter=post_processing_parameters.run_butterworth_filter,
+            max_gap_frames=post_processing_parameters.max_gap_to_fill,
+        )
+
+    def reset(self) -> None:
+        self._filter_state = None
+        self._last_valid_positions = None
+        self._frames_since_valid = None
+
+    def process_frame(self, marker_xyz: np.ndarray) -> np.ndarray:
+        """Gap fill and filter one (markers, 3) frame, returns the processed (markers, 3) frame"""
+        if self._last_valid_positions is None:
+            self._last_valid_positions = np.full(marker_xyz.shape, np.nan)
+            self._frames_since_valid = np.full(marker_xyz.shape[0], self.max_gap_frames + 1)
+            self._filter_state = np.full((self.sos.shape[0], 2, marker_xyz.size), np.nan)
+
+        # gap filling
+        valid_markers = ~np.isnan(marker_xyz).any(axis=1)
+        self._last_valid_positions[valid_markers] = marker_xyz[valid_markers]
+        self._frames_since_valid[valid_markers] = 0
+        self._frames_since_valid[~valid_markers] += 1
+        filled_xyz = self._last_valid_positions.copy()
+        filled_xyz[self._frames_since_valid > self.max_gap_frames] = np.nan
+
+        if not self.run_butterworth_filter:
+            return filled_xyz
+
+        return self._filter(filled_xyz.reshape(-1)).reshape(marker_xyz.shape)
+
+    def _filter(self, samples: np.ndarray) -> np.ndarray:
+        # NaN samples leave NaN in the state, so markers that were lost restart from their next valid sample
+        restart = np.isnan(self._filter_state[0, 0]) & ~np.isnan(samples)
+        self._filter_state[:, :, restart] = self._unit_step_state[:, :, None] * samples[restart]
+
+        output = samples
+        for section_index, (b0, b1, b2, _, a1, a2) in enumerate(self.sos):
+            section_state = self._filter_state[section_index]
+            section_output = b0 * output + section_state[0]
+            section_state[0] = b1 * output - a1 * section_output + section_state[1]
+            section_state[1] = b2 * output - a2 * section_output
+            output = section_output
+        return output
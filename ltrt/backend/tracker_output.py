@@ -0,0 +1,56 @@
+from typing import Optional
+
+import numpy as np
+
+
+def track_image(tracker, image: np.ndarray) -> np.ndarray:
+    """
+    Run the tracker on one image and return its (1, markers, 3) keypoints: x and y in pixels, and a confidence.
+
+    The tracker's own third column (mediapipe's relative depth) isn't used downstream, so it's replaced by
+    `keypoint_confidences`.
+    """
+    tracker.process_image(image)
+    tracker.recorder.record(tracked_objects=tracker.tracked_objects)
+    # the recorder scales normalized x by image_size[0] and y by image_size[1], so it takes (width, height)
+    output_array = tracker.recorder.process_tracked_objects(image_size=(image.shape[1], image.shape[0]))
+    tracker.recorder.clear_recorded_objects()
+    confidences = keypoint_confidences(tracker=tracker, keypoints=output_array[0])
+    return np.concatenate([output_array[:, :, :2], confidences[np.newaxis, :, np.newaxis]], axis=2)
+
+
+def keypoint_confidences(tracker, keypoints: np.ndarray) -> np.ndarray:
+    """
+    (markers,) confidence between 0 and 1 of the tracker's latest (markers, >=2) keypoints.
+
+    Keypoints the tracker didn't find (NaN) have confidence 0. Mediapipe scores the visibility of each pose landmark
+    (the first markers), but not of individual face and hand landmarks, so those are 1 whenever they were found.
+    """
+    confidences = (~np.isnan(keypoints[:, :2]).any(axis=1)).astype(np.float64)
+    pose_visibilities = _pose_visibilities(tracker)
+    if pose_visibilities is not None:
+        confidences[: len(pose_visibilities)] *= pose_visibilities
+    return confidences
+
+
+def _pose_visibilities(tracker) -> Optional[np.ndarray]:
+    tracked_objects = getattr(tracker, "tracked_objects", None)
+    if not isinstance(tracked_objects, dict) or "pose_landmarks" not in tracked_objects:
+        return None
+    landmarks = tracked_objects["pose_landmarks"].extra.get("landmarks")
+    if landmarks is None:
+        return None
+    return np.array([landmark.visibility for landmark in landmarks.landmark], dtype=np.float64)
+
+
+def mask_low_confidence(keypoints: np.ndarray, min_confidence: Optional[float]) -> np.ndarray:
+    """
+    (..., 2) x and y of (..., 3) keypoints with confidences, NaN where the confidence is under `min_confidence`
+    (or NaN, like the rows of cameras that missed a frame). Without `min_confidence`, this is a view of x and y.
+    """
+    points = keypoints[..., :2]
+    if min_confidence is None:
+        return points
+    points = points.copy()
+    points[~(keypoints[..., 2] >= min_confidence)] = np.nan
+    return points
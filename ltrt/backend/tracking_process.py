@@ -1,68 +1,523 @@
 import multiprocessing
 import numpy as np
 from queue import Empty
-from typing import Dict
-from time import perf_counter_ns
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+from time import perf_counter, perf_counter_ns
 
 from skellycam.core.frames.payloads.multi_frame_payload import MultiFramePayload
 from skellytracker import MediapipeHolisticTracker
+from skellytracker.trackers.mediapipe_tracker.mediapipe_model_info import MediapipeModelInfo
+
+from ltrt.backend.keyframe_tracking import KeyframeTracker
+from ltrt.backend.pipeline_metrics import PipelineMetrics
+from ltrt.backend.reorder_buffer import InFlightFrame, ReorderBuffer
+from ltrt.backend.roi_cropping import CropTransform, RoiCropper
+from ltrt.backend.sampling_profiler import ProfilingConfig, profile_frame, save_profiler, start_profiler
+from ltrt.backend.shared_memory_transport import SharedFrameRing, SharedKeypointMatrix
+from ltrt.backend.startup import signal_ready, warm_up_tracker
+from ltrt.backend.tracker_output import mask_low_confidence
+
+# mediapipe model complexity of the lightweight and heavyweight pipelines' trackers, without an adaptive quality controller
+DEFAULT_MODEL_COMPLEXITY = 0
+HEAVYWEIGHT_MODEL_COMPLEXITY = 2
 
 
 def run_tracker(
-    frame_queue: multiprocessing.Queue,
-    output_data_queue: multiprocessing.Queue,
+    job_queue: multiprocessing.Queue,
+    result_queue: multiprocessing.Queue,
+    setup_queue: multiprocessing.Queue,
     stop_event,
+    ready_queue: Optional[multiprocessing.Queue] = None,
+    warmup_image_shapes: Sequence[Tuple[int, int, int]] = (),
+    role: str = "tracker",
+    keyframe_interval: int = 1,
+    model_complexities: Sequence[int] = (DEFAULT_MODEL_COMPLEXITY,),
+    profiling: Optional[ProfilingConfig] = None,
 ):
-    tracker = MediapipeHolisticTracker(
-        model_complexity=0, static_image_mode=True
-    )  # TODO: pass parameters into this
+    """
+    Tracker pool worker: track frames of any camera from the shared `job_queue` and put the results,
+    tagged with their camera id and frame number, into the shared `result_queue`.
+
+    With `keyframe_interval` > 1, the full model only runs every `keyframe_interval` frames of a camera (or sooner
+    if optical flow loses the keypoints), see `KeyframeTracker`. That keeps state per camera, so each camera's jobs
+    must all come to this worker, in order: give each worker its own queue of a `CameraAffineJobQueue`.
+
+    A tracker is loaded for each of `model_complexities`, and each job names the complexity to track it at,
+    so an `AdaptiveQualityController` in the pipeline can switch levels without waiting for a model to load.
+
+    The trackers are loaded and warmed up with a dummy inference at each of `warmup_image_shapes` first,
+    then the worker signals ready on `ready_queue` as `role`, and waits for one `(frame_ring, keypoint_matrix)` message on
+    `setup_queue`, which the pipeline sends to every worker once it has seen the first multiframe.
+    If both are None, images and result arrays are pickled through the queues:
+    jobs are `(camera_id, sequence_number, image, deadline_ns, model_complexity)` and results are
+    `(camera_id, sequence_number, output_array, tracking_ns)`.
+    Otherwise (shared memory mode) jobs are `(camera_id, slot, sequence_number, deadline_ns, model_complexity)` and results are
+    `(camera_id, slot, sequence_number, tracking_ns)`: the image is read in place from the ring and the 2d keypoints and their
+    confidences are written into the camera's row of the keypoint matrix.
+    Either way, the keypoints are the `(1, markers, 3)` x, y and confidence of `track_image`, and `tracking_ns`
+    is how long this worker took to track the frame, without the time the job waited in the queue.
+    Jobs past their deadline (if not None), or whose ring slot has been reused by a later multiframe, have already
+    been given up on by the pipeline, so they are dropped without tracking them.
+
+    With `profiling`, the worker samples itself during the configured frames and saves a profile per camera
+    (with the time spent waiting for jobs in its own untagged profile), see `SamplingProfiler`.
+    """
+    start_load = perf_counter()
+    trackers = {
+        model_complexity: MediapipeHolisticTracker(model_complexity=model_complexity, static_image_mode=True)
+        for model_complexity in model_complexities
+    }
+    load_s = perf_counter() - start_load
+    warmup_s = sum(
+        warm_up_tracker(tracker=tracker, image_shapes=warmup_image_shapes) for tracker in trackers.values()
+    )
+    keyframe_tracker = KeyframeTracker(tracker=trackers[model_complexities[0]], keyframe_interval=keyframe_interval)
+    signal_ready(ready_queue=ready_queue, role=role, load_s=load_s, warmup_s=warmup_s)
+
+    setup = None
+    while setup is None and not stop_event.is_set():
+        try:
+            setup = setup_queue.get(timeout=0.1)
+        except Empty:
+            continue
+    if setup is None:
+        return
+    frame_ring, keypoint_matrix = setup
+    use_shared_memory = frame_ring is not None and keypoint_matrix is not None
+    profiler = start_profiler(config=profiling, role=role)
+
     while not stop_event.is_set():
         try:
-            frame = frame_queue.get(timeout=0.1)
+            job = job_queue.get(timeout=0.1)
         except Empty:
             continue
-        if frame is None:
+        if job is None:
             stop_event.set()
-            output_data_queue.put(None)
+            result_queue.put(None)
             break
+
+        if use_shared_memory:
+            camera_id, slot, sequence_number, deadline_ns, model_complexity = job
+            profile_frame(profiler, sequence_number=sequence_number, camera_id=camera_id)
+            if deadline_passed(deadline_ns) or not frame_ring.holds(slot=slot, sequence_number=sequence_number):
+                continue
+            # ROI crops are a strided view into the slot
+            frame = np.ascontiguousarray(frame_ring.read(slot=slot, camera_id=camera_id))
         else:
-            tracker.process_image(frame)
-            tracker.recorder.record(
-                tracked_objects=tracker.tracked_objects
-            )
-            output_array = tracker.recorder.process_tracked_objects(
-                image_size=frame.shape[:2]
+            camera_id, sequence_number, frame, deadline_ns, model_complexity = job
+            profile_frame(profiler, sequence_number=sequence_number, camera_id=camera_id)
+            if deadline_passed(deadline_ns):
+                continue
+
+        # optical flow state is in pixel coordinates, so it carries over when the model complexity changes
+        keyframe_tracker.tracker = trackers[model_complexity]
+        start_tracking = perf_counter_ns()
+        output_array = keyframe_tracker.track(camera_id=camera_id, sequence_number=sequence_number, image=frame)
+        tracking_ns = perf_counter_ns() - start_tracking
+
+        if use_shared_memory:
+            if not frame_ring.holds(slot=slot, sequence_number=sequence_number):
+                # the slot was reused while tracking, so the pipeline has already moved past this multiframe
+                continue
+            # a late write into a reassigned row is caught by the row's sequence number stamp, see `SharedKeypointMatrix`
+            keypoint_matrix.write(
+                slot=slot, camera_id=camera_id, sequence_number=sequence_number, keypoints=output_array[0]
             )
-            tracker.recorder.clear_recorded_objects()
-            output_data_queue.put(output_array)
+            result_queue.put((camera_id, slot, sequence_number, tracking_ns))
+        else:
+            result_queue.put((camera_id, sequence_number, output_array, tracking_ns))
+        profile_frame(profiler, sequence_number=sequence_number)
+
+    # results that missed their deadline are never read once the pipeline has stopped,
+    # so don't block on flushing them to the result queue when this process exits
+    result_queue.cancel_join_thread()
+    save_profiler(profiler)
+    if keyframe_interval > 1:
+        print(
+            f"{role} ran the model on {keyframe_tracker.keyframes} keyframes and propagated {keyframe_tracker.propagated_frames} frames with optical flow"
+        )
+
+    if use_shared_memory:
+        frame_ring.close()
+        keypoint_matrix.close()
+
+
+class CameraAffineJobQueue:
+    """
+    Tracking job queue for workers that keep per-camera state: every job of a camera goes to the same worker.
+
+    Has one queue per worker (give worker `i` `queues[i]`), and `put` routes a job by its camera id (the first
+    element of the job tuple). Cameras are spread over the workers round robin in the order they are first seen,
+    so with more workers than cameras the extra workers stay idle.
+    """
 
+    def __init__(self, num_workers: int):
+        self.queues = [multiprocessing.Queue() for _ in range(num_workers)]
+        self._camera_workers: Dict[int, int] = {}
+
+    def put(self, job: tuple) -> None:
+        camera_id = job[0]
+        worker_index = self._camera_workers.get(camera_id)
+        if worker_index is None:
+            worker_index = self._camera_workers[camera_id] = len(self._camera_workers) % len(self.queues)
+        self.queues[worker_index].put(job)
+
+    def cancel_join_thread(self) -> None:
+        for queue in self.queues:
+            queue.cancel_join_thread()
+
+
+def discover_camera_ids(multiframe_payload: MultiFramePayload) -> List[int]:
+    """Camera ids of a multiframe, sorted, which is the order the calibration's cameras are expected in"""
+    return sorted(multiframe_payload.frames.keys())
+
+
+def start_tracker_transport(
+    multiframe_payload: MultiFramePayload,
+    setup_queue: multiprocessing.Queue,
+    num_tracker_workers: int,
+    use_shared_memory: bool,
+    num_markers: int,
+    num_slots: int = 4,
+) -> Tuple[Optional[SharedFrameRing], Optional[SharedKeypointMatrix]]:
+    """
+    Set up the tracker pool from the first multiframe: allocate the shared memory blocks sized to its cameras
+    and its largest image (if `use_shared_memory`), and send them to every worker.
+    The caller owns the blocks and has to close and unlink them.
+    """
+    frame_ring = None
+    keypoint_matrix = None
+    if use_shared_memory:
+        camera_ids = discover_camera_ids(multiframe_payload)
+        image_shapes = [multiframe_payload.frames[camera_id].image.shape for camera_id in camera_ids]
+        if len({image_shape[2:] for image_shape in image_shapes}) > 1:
+            raise ValueError(f"Cameras have images with different channels, {dict(zip(camera_ids, image_shapes))}")
+        # sized for the largest camera, smaller images go into the top left of their slot
+        image_shape = (
+            max(image_shape[0] for image_shape in image_shapes),
+            max(image_shape[1] for image_shape in image_shapes),
+            *image_shapes[0][2:],
+        )
+        frame_ring = SharedFrameRing(camera_ids=camera_ids, image_shape=image_shape, num_slots=num_slots)
+        keypoint_matrix = SharedKeypointMatrix(camera_ids=camera_ids, num_markers=num_markers, num_slots=num_slots)
+    for _ in range(num_tracker_workers):
+        setup_queue.put((frame_ring, keypoint_matrix))
+    return frame_ring, keypoint_matrix
 
 
 def process_one_multiframe_payload(
     multiframe_payload: MultiFramePayload,
-    payload_queues: Dict[int, multiprocessing.Queue],
-    output_queues: Dict[int, multiprocessing.Queue],
+    job_queue: multiprocessing.Queue,
+    result_queue: multiprocessing.Queue,
+    metrics: Optional[PipelineMetrics] = None,
+    deadline_ms: Optional[float] = None,
+    roi_cropper: Optional[RoiCropper] = None,
+    model_complexity: int = DEFAULT_MODEL_COMPLEXITY,
+    min_confidence: Optional[float] = None,
 ) -> np.ndarray:
+    """
+    Send every frame of the multiframe to the tracker pool and return the (cameras, markers, 2) keypoints,
+    in sorted camera order, as soon as the last result arrives.
+
+    With `deadline_ms`, collection stops that long after the frames started being sent: cameras that haven't
+    answered get NaN keypoints and are recorded as missed, and their late results are discarded.
+    With `roi_cropper`, the trackers get cropped and/or downscaled images, and the keypoints are mapped back
+    to full image pixel coordinates.
+    The trackers track every frame at `model_complexity`, which has to be one they loaded.
+    Keypoints with a confidence under `min_confidence` are NaN, so they aren't triangulated.
+    """
     start_send_frames = perf_counter_ns()
+    deadline_ns = deadline_after(start_send_frames, deadline_ms)
+    sequence_number = multiframe_payload.multi_frame_number
+    images, crop_transforms = crop_for_trackers(multiframe_payload=multiframe_payload, roi_cropper=roi_cropper)
+    for camera_id, image in images.items():
+        job_queue.put((camera_id, sequence_number, image, deadline_ns, model_complexity))
+    end_send_frames = perf_counter_ns()
+    _report_frame_send(
+        metrics=metrics,
+        message="putting individual frames in processing queues",
+        start_ns=start_send_frames,
+        end_ns=end_send_frames,
+    )
+    camera_ids = discover_camera_ids(multiframe_payload)
+    outputs = {}
+    result_times_ns = {}
+    while len(outputs) < len(camera_ids) and not deadline_passed(deadline_ns):
+        try:
+            result = result_queue.get(timeout=collection_timeout(deadline_ns))
+        except Empty:
+            continue
+        if result is None:
+            print("Recieved empty output from the tracker pool")
+            raise RuntimeError("Non empty frame payload led to empty result")
+        camera_id, result_sequence_number, output, _ = result
+        if result_sequence_number < sequence_number:
+            # late result for a multiframe that was triangulated without it
+            continue
+        if result_sequence_number != sequence_number:
+            raise RuntimeError(
+                f"Expected result for frame {sequence_number} from camera {camera_id}, got frame {result_sequence_number}"
+            )
+        outputs[camera_id] = output[0]
+        result_times_ns[camera_id] = perf_counter_ns()
+
+    if metrics is not None:
+        metrics.record_camera_results(send_time_ns=end_send_frames, result_times_ns=result_times_ns)
+    missed_camera_ids = set(camera_ids) - outputs.keys()
+    if missed_camera_ids:
+        _report_missed_cameras(metrics=metrics, sequence_number=sequence_number, missed_camera_ids=missed_camera_ids)
+        missing_keypoints = np.full((MediapipeModelInfo.num_tracked_points, 3), np.nan)
+        for camera_id in missed_camera_ids:
+            outputs[camera_id] = missing_keypoints
+    keypoints = mask_low_confidence(
+        keypoints=np.stack([outputs[camera_id] for camera_id in camera_ids]), min_confidence=min_confidence
+    )
+    return map_to_full_image(
+        keypoints=keypoints,
+        camera_ids=camera_ids,
+        roi_cropper=roi_cropper,
+        crop_transforms=crop_transforms,
+        missed_camera_ids=missed_camera_ids,
+    )
+
+
+def crop_for_trackers(
+    multiframe_payload: MultiFramePayload,
+    roi_cropper: Optional[RoiCropper],
+) -> Tuple[Dict[int, np.ndarray], Optional[Dict[int, CropTransform]]]:
+    """The image to send to the trackers for each camera, and their crop transforms (None without `roi_cropper`)"""
+    if roi_cropper is not None:
+        return roi_cropper.crop_multiframe(multiframe_payload)
+    images = {}
     for camera_id, frame_payload in multiframe_payload.frames.items():
         if frame_payload is None:
             raise RuntimeError("Frame Payload is None")
-        payload_queues[camera_id].put(frame_payload.image)
-    end_send_frames = perf_counter_ns()
-    print(f"putting individual frames in processing queues took {(end_send_frames - start_send_frames) / 1e6} ms")
-    outputs = {}
+        images[camera_id] = frame_payload.image
+    return images, None
+
+
+def map_to_full_image(
+    keypoints: np.ndarray,
+    camera_ids: List[int],
+    roi_cropper: Optional[RoiCropper],
+    crop_transforms: Optional[Dict[int, CropTransform]],
+    missed_camera_ids: Set[int],
+) -> np.ndarray:
+    """Map tracker keypoints back to full image coordinates, and crop the next multiframe around them"""
+    if roi_cropper is None:
+        return keypoints
+    keypoints = roi_cropper.to_full_image(keypoints=keypoints, camera_ids=camera_ids, transforms=crop_transforms)
+    roi_cropper.update(keypoints=keypoints, camera_ids=camera_ids, missed_camera_ids=missed_camera_ids)
+    return keypoints
+
+
+def deadline_after(start_ns: int, deadline_ms: Optional[float]) -> Optional[int]:
+    return None if deadline_ms is None else start_ns + int(deadline_ms * 1e6)
+
+
+def deadline_passed(deadline_ns: Optional[int]) -> bool:
+    return deadline_ns is not None and perf_counter_ns() >= deadline_ns
+
+
+def collection_timeout(deadline_ns: Optional[int], max_timeout: float = 0.1) -> float:
+    """How long to block on the result queue: `max_timeout`, or less if the deadline comes first"""
+    if deadline_ns is None:
+        return max_timeout
+    return min(max_timeout, max(0.0, (deadline_ns - perf_counter_ns()) / 1e9))
+
+
+def _report_missed_cameras(metrics: Optional[PipelineMetrics], sequence_number: int, missed_camera_ids: Set[int]) -> None:
+    message = f"cameras {sorted(missed_camera_ids)} missed the deadline for frame {sequence_number}"
+    if metrics is None:
+        print(message)
+        return
+    metrics.record_missed_cameras(sequence_number=sequence_number, missed_camera_ids=missed_camera_ids)
+    metrics.log(message)
+
+
+def _report_frame_send(metrics: Optional[PipelineMetrics], message: str, start_ns: int, end_ns: int) -> None:
+    if metrics is None:
+        print(f"{message} took {(end_ns - start_ns) / 1e6} ms")
+        return
+    metrics.record_ns("frame_send", start_ns, end_ns)
+    metrics.log(f"{message} took {(end_ns - start_ns) / 1e6} ms")
+
+
+def send_multiframe_payload_shared_memory(
+    multiframe_payload: MultiFramePayload,
+    frame_ring: SharedFrameRing,
+    job_queue: multiprocessing.Queue,
+    deadline_ns: Optional[int] = None,
+    images: Optional[Dict[int, np.ndarray]] = None,
+    model_complexity: int = DEFAULT_MODEL_COMPLEXITY,
+) -> int:
+    """
+    Write the multiframe (or its tracker input `images`, like ROI crops) into the next frame ring slot
+    and queue a tracking job per camera, returns the slot
+    """
+    sequence_number = multiframe_payload.multi_frame_number
+    slot = frame_ring.write(sequence_number=sequence_number, multiframe_payload=multiframe_payload, images=images)
+    for camera_id in multiframe_payload.frames:
+        job_queue.put((camera_id, slot, sequence_number, deadline_ns, model_complexity))
+    return slot
+
+
+def send_multiframe_payload(
+    multiframe_payload: MultiFramePayload,
+    frame_ring: Optional[SharedFrameRing],
+    job_queue: multiprocessing.Queue,
+    deadline_ns: Optional[int] = None,
+    images: Optional[Dict[int, np.ndarray]] = None,
+    model_complexity: int = DEFAULT_MODEL_COMPLEXITY,
+) -> Optional[int]:
+    """
+    Queue a tracking job per camera of the multiframe (or of its tracker input `images`), through the frame ring
+    if there is one, otherwise with the images pickled into the jobs. Returns the frame ring slot, None without a ring.
+    """
+    if frame_ring is not None:
+        return send_multiframe_payload_shared_memory(
+            multiframe_payload=multiframe_payload,
+            frame_ring=frame_ring,
+            job_queue=job_queue,
+            deadline_ns=deadline_ns,
+            images=images,
+            model_complexity=model_complexity,
+        )
+    if images is None:
+        images, _ = crop_for_trackers(multiframe_payload=multiframe_payload, roi_cropper=None)
+    sequence_number = multiframe_payload.multi_frame_number
+    for camera_id, image in images.items():
+        job_queue.put((camera_id, sequence_number, image, deadline_ns, model_complexity))
+    return None
+
+
+def collect_results(
+    result_queue: multiprocessing.Queue,
+    reorder_buffer: ReorderBuffer,
+    use_shared_memory: bool = True,
+    timeout: float = 0.01,
+) -> None:
+    """
+    Move every tracker result that is already available into the reorder buffer.
+    If none are available, wait up to `timeout` seconds for one, or until the oldest multiframe's deadline.
+    Without `use_shared_memory`, the results carry their keypoints, which are kept in the buffer.
+    """
+    try:
+        result = result_queue.get(timeout=collection_timeout(reorder_buffer.next_deadline_ns, max_timeout=timeout))
+    except Empty:
+        return
     while True:
-        for camera_id, output_queue in output_queues.items():
-            try:
-                output = output_queue.get(timeout=0.1)
-                if output is not None:
-                    outputs[camera_id] = output
-                else:
-                    print(f"Recieved empty output from queue for camera {camera_id}")
-                    raise RuntimeError("Non empty frame payload led to empty result")
-            except Empty:
-                pass
-        if set(outputs.keys()) == set(multiframe_payload.frames.keys()):
-            break
+        _add_result(reorder_buffer=reorder_buffer, result=result, use_shared_memory=use_shared_memory)
+        try:
+            result = result_queue.get_nowait()
+        except Empty:
+            return
+
+
+def _add_result(reorder_buffer: ReorderBuffer, result, use_shared_memory: bool) -> None:
+    if result is None:
+        print("Recieved empty output from the tracker pool")
+        raise RuntimeError("Non empty frame payload led to empty result")
+    if use_shared_memory:
+        camera_id, slot, sequence_number, tracking_ns = result
+        reorder_buffer.add_result(camera_id=camera_id, slot=slot, sequence_number=sequence_number, tracking_ns=tracking_ns)
+    else:
+        camera_id, sequence_number, output_array, tracking_ns = result
+        reorder_buffer.add_result(
+            camera_id=camera_id, slot=None, sequence_number=sequence_number, keypoints=output_array[0], tracking_ns=tracking_ns
+        )
+
+
+def read_in_flight_keypoints(
+    in_flight_frame: InFlightFrame,
+    keypoint_matrix: Optional[SharedKeypointMatrix],
+) -> Tuple[np.ndarray, List[int]]:
+    """
+    (cameras, markers, 3) keypoints of a released multiframe and their camera ids, from the keypoint matrix
+    if there is one, otherwise from the results kept in the reorder buffer. Cameras that missed it are NaN.
+    """
+    missed_camera_ids = in_flight_frame.missed_camera_ids
+    if keypoint_matrix is not None:
+        keypoints = keypoint_matrix.read(
+            in_flight_frame.slot, missed_camera_ids=missed_camera_ids, sequence_number=in_flight_frame.sequence_number
+        )
+        return keypoints, keypoint_matrix.camera_ids
+    camera_ids = sorted(in_flight_frame.camera_ids)
+    missing_keypoints = np.full((MediapipeModelInfo.num_tracked_points, 3), np.nan)
+    keypoints = np.stack([in_flight_frame.keypoints.get(camera_id, missing_keypoints) for camera_id in camera_ids])
+    return keypoints, camera_ids
+
+
+def process_one_multiframe_payload_shared_memory(
+    multiframe_payload: MultiFramePayload,
+    frame_ring: SharedFrameRing,
+    keypoint_matrix: SharedKeypointMatrix,
+    job_queue: multiprocessing.Queue,
+    result_queue: multiprocessing.Queue,
+    metrics: Optional[PipelineMetrics] = None,
+    deadline_ms: Optional[float] = None,
+    roi_cropper: Optional[RoiCropper] = None,
+    model_complexity: int = DEFAULT_MODEL_COMPLEXITY,
+    min_confidence: Optional[float] = None,
+) -> np.ndarray:
+    """
+    Shared memory version of `process_one_multiframe_payload`.
+
+    Returns a (cameras, markers, 2) view into the keypoint matrix, ordered like `keypoint_matrix.camera_ids`,
+    which is only valid until the slot is reused for a later multiframe.
+    If cameras missed the deadline, or with `roi_cropper` or `min_confidence`, a copy is returned instead.
+    """
+    start_send_frames = perf_counter_ns()
+    deadline_ns = deadline_after(start_send_frames, deadline_ms)
+    sequence_number = multiframe_payload.multi_frame_number
+    images, crop_transforms = None, None
+    if roi_cropper is not None:
+        images, crop_transforms = roi_cropper.crop_multiframe(multiframe_payload)
+    slot = send_multiframe_payload_shared_memory(
+        multiframe_payload=multiframe_payload,
+        frame_ring=frame_ring,
+        job_queue=job_queue,
+        deadline_ns=deadline_ns,
+        images=images,
+        model_complexity=model_complexity,
+    )
+    end_send_frames = perf_counter_ns()
+    _report_frame_send(
+        metrics=metrics,
+        message="writing frames to shared memory",
+        start_ns=start_send_frames,
+        end_ns=end_send_frames,
+    )
+    result_times_ns = {}
+    while len(result_times_ns) < len(multiframe_payload.frames) and not deadline_passed(deadline_ns):
+        try:
+            result = result_queue.get(timeout=collection_timeout(deadline_ns))
+        except Empty:
+            continue
+        if result is None:
+            print("Recieved empty output from the tracker pool")
+            raise RuntimeError("Non empty frame payload led to empty result")
+        camera_id, result_slot, result_sequence_number, _ = result
+        if result_sequence_number < sequence_number:
+            # late result for a multiframe that was triangulated without it
+            continue
+        if (result_slot, result_sequence_number) != (slot, sequence_number):
+            raise RuntimeError(
+                f"Expected result for frame {sequence_number} in slot {slot} from camera {camera_id}, got frame {result_sequence_number} in slot {result_slot}"
+            )
+        result_times_ns[camera_id] = perf_counter_ns()
 
-    return np.concatenate(list(outputs.values()), axis=0)[:, :, :2]
+    if metrics is not None:
+        metrics.record_camera_results(send_time_ns=end_send_frames, result_times_ns=result_times_ns)
+    missed_camera_ids = multiframe_payload.frames.keys() - result_times_ns.keys()
+    if missed_camera_ids:
+        _report_missed_cameras(metrics=metrics, sequence_number=sequence_number, missed_camera_ids=missed_camera_ids)
+    return map_to_full_image(
+        keypoints=mask_low_confidence(
+            keypoints=keypoint_matrix.read(slot, missed_camera_ids=missed_camera_ids, sequence_number=sequence_number), min_confidence=min_confidence
+        ),
+        camera_ids=keypoint_matrix.camera_ids,
+        roi_cropper=roi_cropper,
+        crop_transforms=crop_transforms,
+        missed_camera_ids=missed_camera_ids,
+    )
@@ -0,0 +1,93 @@
+import numpy as np
+import cv2
+from aniposelib.cameras import CameraGroup, FisheyeCamera
+
+
+class RealtimeTriangulator:
+    """
+    Triangulates 2d keypoints from every camera in a `CameraGroup`.
+
+    Built once per session: the camera matrices, distortion coefficients and projection matrices are pulled
+    out of the camera group up front, and every frame (or batch of frames) is solved with one batched
+    eigendecomposition instead of aniposelib's per-point loop.
+    Uses the same linear (DLT) solution as `CameraGroup.triangulate`, so the results match it to floating point precision.
+    """
+
+    def __init__(self, camera_group: CameraGroup, min_views: int = 2):
+        if min_views < 2:
+            raise ValueError(f"At least 2 views are needed to triangulate, got min_views={min_views}")
+        self.min_views = min_views
+        self.num_cameras = len(camera_group.cameras)
+        self.camera_names = camera_group.get_names()
+
+        self.camera_matrices = [
+            np.asarray(camera.get_camera_matrix(), dtype=np.float64) for camera in camera_group.cameras
+        ]
+        self.distortions = [
+            np.asarray(camera.get_distortions(), dtype=np.float64) for camera in camera_group.cameras
+        ]
+        self.is_fisheye = [isinstance(camera, FisheyeCamera) for camera in camera_group.cameras]
+        # (cameras, 3, 4) projection matrices in normalized image coordinates
+        self.projection_matrices = np.stack(
+            [np.asarray(camera.get_extrinsics_mat(), dtype=np.float64)[:3] for camera in camera_group.cameras]
+        )
+
+    def undistort(self, points: np.ndarray) -> np.ndarray:
+        """Undistort a (cameras, ..., 2) array of pixel coordinates into normalized image coordinates"""
+        undistorted_points = np.empty(points.shape, dtype=np.float64)
+        for camera_index in range(self.num_cameras):
+            camera_points = np.ascontiguousarray(points[camera_index], dtype=np.float64).reshape(-1, 1, 2)
+            if self.is_fisheye[camera_index]:
+                camera_points = cv2.fisheye.undistortPoints(
+                    camera_points, self.camera_matrices[camera_index], self.distortions[camera_index]
+                )
+            else:
+                camera_points = cv2.undistortPoints(
+                    camera_points, self.camera_matrices[camera_index], self.distortions[camera_index]
+                )
+            undistorted_points[camera_index] = camera_points.reshape(points.shape[1:])
+        return undistorted_points
+
+    def triangulate(self, points: np.ndarray, undistort: bool = True) -> np.ndarray:
+        """
+        Triangulate a (cameras, markers, 2) array into (markers, 3),
+        or a (cameras, frames, markers, 2) batch of frames into (frames, markers, 3).
+
+        Points that are NaN in a camera don't contribute to the solution,
+        and markers seen by fewer than `min_views` cameras are left as NaN without being undistorted or solved.
+        """
+        if points.shape[0] != self.num_cameras:
+            raise ValueError(
+                f"Invalid points shape, first dim should be equal to number of cameras ({self.num_cameras}), but shape is {points.shape}"
+            )
+        output_shape = points.shape[1:-1] + (3,)
+        points = points.reshape(self.num_cameras, -1, 2)
+        triangulated_points = np.full((points.shape[1], 3), np.nan)
+
+        visible = ~np.isnan(points).any(axis=2)  # (cameras, points)
+        solvable = np.count_nonzero(visible, axis=0) >= self.min_views
+        if not np.any(solvable):
+            return triangulated_points.reshape(output_shape)
+
+        solvable_points = points[:, solvable]  # (cameras, solvable points, 2)
+        solvable_visible = visible[:, solvable]
+        if undistort:
+            solvable_points = self.undistort(solvable_points)
+
+        # Build the DLT system for every point at once: each camera adds the rows x * P[2] - P[0] and y * P[2] - P[1].
+        # Rows of cameras that don't see the point are zeroed, which leaves the null space of the system unchanged.
+        projection_row_2 = self.projection_matrices[:, 2][:, None, :]  # (cameras, 1, 4)
+        x_rows = solvable_points[:, :, 0, None] * projection_row_2 - self.projection_matrices[:, 0][:, None, :]
+        y_rows = solvable_points[:, :, 1, None] * projection_row_2 - self.projection_matrices[:, 1][:, None, :]
+        x_rows[~solvable_visible] = 0
+        y_rows[~solvable_visible] = 0
+        system = np.concatenate([x_rows, y_rows], axis=0)  # (2 * cameras, solvable points, 4)
+
+        # The last right singular vector of the system is the eigenvector of its (4, 4) normal matrix
+        # with the smallest eigenvalue, which is about twice as fast to get as a batched SVD
+        normal_matrices = np.einsum("rni,rnj->nij", system, system)
+        _, eigenvectors = np.linalg.eigh(normal_matrices)
+        homogeneous_points = eigenvectors[:, :, 0]
+        triangulated_points[solvable] = homogeneous_points[:, :3] / homogeneous_points[:, 3:]
+
+        return triangulated_points.reshape(output_shape)
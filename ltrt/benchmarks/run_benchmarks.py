@@ -0,0 +1,301 @@
+import argparse
+import json
+from datetime import datetime
+from multiprocessing import Event
+from pathlib import Path
+from time import perf_counter, perf_counter_ns, sleep
+from typing import Dict, List, Optional, Tuple
+
+from ltrt.backend.pipeline_metrics import PipelineMetrics
+from ltrt.backend.run_realtime import run_realtime, shutdown_realtime
+from ltrt.backend.triangulation import RealtimeTriangulator
+from ltrt.mock_data.synthetic_calibration import (
+    create_synthetic_camera_group,
+    create_synthetic_keypoints,
+    save_synthetic_calibration,
+)
+from ltrt.mock_data.replay_multiframe_payload import ReplayRate, replay_camera_input
+from ltrt.mock_data.synthetic_multiframe_payload import synthetic_camera_input
+from ltrt.system.path_utilities import create_new_recording_folder_path
+
+# median ms per multiframe we expect to beat on a recording of a person, like the freemocap sample session,
+# from the comments on each pipeline and the README. Synthetic frames are noise in which mediapipe finds no person,
+# so it skips landmark tracking and runs much faster: synthetic runs are only compared against previous synthetic runs.
+BASELINE_MS_PER_FRAME = {
+    "lightweight": 70.0,
+    "heavyweight": 300.0,
+}
+
+
+def _result(name: str, config: Dict, metrics: Dict, wall_time_s: float) -> Dict:
+    stages = metrics["stages"]
+    ms_per_frame = stages["total"]["p50_ms"] if "total" in stages else None
+    return {
+        "name": name,
+        "config": config,
+        "frames": metrics["frames"],
+        "wall_time_s": wall_time_s,
+        # median time between finished frames, the first frame's startup time doesn't skew it
+        "ms_per_frame": ms_per_frame,
+        "stages": stages,
+    }
+
+
+def benchmark_triangulation(
+    num_cameras: int = 3,
+    num_frames: int = 300,
+    fps: Optional[float] = None,
+) -> Dict:
+    """Triangulate synthetic keypoints one frame at a time, without any other pipeline stage"""
+    camera_group = create_synthetic_camera_group(num_cameras=num_cameras)
+    keypoints = create_synthetic_keypoints(camera_group=camera_group, num_frames=num_frames)
+    triangulator = RealtimeTriangulator(camera_group=camera_group)
+    triangulator.triangulate(keypoints[:, 0])  # warm up
+
+    metrics = PipelineMetrics(quiet=True, report_interval_s=None)
+    start_wall = perf_counter()
+    next_frame_time = start_wall
+    start = perf_counter_ns()
+    for frame_number in range(num_frames):
+        start_triangulate = perf_counter_ns()
+        triangulator.triangulate(keypoints[:, frame_number])
+        end = perf_counter_ns()
+        metrics.record_ns("triangulation", start_triangulate, end)
+        metrics.record_ns("total", start, end)
+        metrics.frame_finished(end)
+        if fps is not None:
+            next_frame_time += 1 / fps
+            sleep(max(0.0, next_frame_time - perf_counter()))
+        start = perf_counter_ns()
+
+    return _result(
+        name=f"triangulation_{_rate_name(fps)}",
+        config={"num_cameras": num_cameras, "num_frames": num_frames, "fps": fps},
+        metrics=metrics.current_snapshot(),
+        wall_time_s=perf_counter() - start_wall,
+    )
+
+
+def benchmark_pipeline(
+    output_folder: str | Path,
+    use_heavyweight_pipeline: bool = False,
+    num_cameras: int = 3,
+    image_shape: Tuple[int, int, int] = (720, 1280, 3),
+    num_frames: int = 300,
+    fps: Optional[float] = None,
+    max_frames_in_flight: int = 1,
+    num_tracker_workers: Optional[int] = None,
+    keyframe_interval: int = 1,
+    target_tracking_ms: Optional[float] = None,
+    synchronized_video_folder_path: Optional[str | Path] = None,
+    calibration_toml_path: Optional[str | Path] = None,
+) -> Dict:
+    """
+    Run a realtime pipeline on synthetic multiframes and return the metrics it exported.
+
+    With `synchronized_video_folder_path` and its `calibration_toml_path`, the pipeline replays the first `num_frames`
+    multiframes of that recording instead (looping if it's shorter), so the trackers see a person. Once a run has decoded
+    the whole recording, it is cached to `replay_cache.npy` in `output_folder` and later runs replay the cache instead
+    of decoding. `num_cameras` and `image_shape` then come from the recording.
+
+    `run_realtime` only starts the camera input once the trackers are warmed up, so tracker startup isn't counted.
+    """
+    pipeline_name = "heavyweight" if use_heavyweight_pipeline else "lightweight"
+    name = f"{pipeline_name}_{_rate_name(fps)}"
+    recording_folder = Path(output_folder) / name
+    recording_folder.mkdir(parents=True, exist_ok=True)
+    if synchronized_video_folder_path is None:
+        height, width, _ = image_shape
+        calibration_toml_path = save_synthetic_calibration(
+            Path(output_folder) / f"synthetic_calibration_{num_cameras}_cameras_{width}x{height}.toml",
+            num_cameras=num_cameras,
+            image_size=(width, height),
+        )
+        camera_input = synthetic_camera_input
+        camera_input_args = (list(range(num_cameras)), image_shape, num_frames, fps)
+    else:
+        if calibration_toml_path is None:
+            raise ValueError("Benchmarking on a recording needs the recording's calibration toml")
+        camera_input = replay_camera_input
+        camera_input_args = (
+            synchronized_video_folder_path,
+            ReplayRate.MAX_SPEED if fps is None else ReplayRate.FIXED,
+            fps,
+            True,
+            num_frames,
+            Path(output_folder) / "replay_cache.npy",
+        )
+
+    start_wall = perf_counter()
+    stop_event = Event()
+    processes = run_realtime(
+        calibration_toml_path,
+        stop_event,
+        max_frames_in_flight=max_frames_in_flight,
+        quiet=True,
+        num_tracker_workers=num_tracker_workers,
+        keyframe_interval=keyframe_interval,
+        target_tracking_ms=target_tracking_ms,
+        camera_input=camera_input,
+        camera_input_args=camera_input_args,
+        use_heavyweight_pipeline=use_heavyweight_pipeline,
+        recording_folder=str(recording_folder),
+    )
+    shutdown_realtime(processes=processes)
+    wall_time_s = perf_counter() - start_wall
+
+    with open(recording_folder / "pipeline_metrics.json") as file:
+        metrics = json.load(file)
+    return _result(
+        name=name,
+        config={
+            "pipeline": pipeline_name,
+            "input": "synthetic" if synchronized_video_folder_path is None else str(synchronized_video_folder_path),
+            "num_cameras": num_cameras if synchronized_video_folder_path is None else None,
+            "image_shape": list(image_shape) if synchronized_video_folder_path is None else None,
+            "num_frames": num_frames,
+            "fps": fps,
+            "max_frames_in_flight": max_frames_in_flight,
+            "num_tracker_workers": num_tracker_workers,
+            "keyframe_interval": keyframe_interval,
+            "target_tracking_ms": target_tracking_ms,
+        },
+        metrics=metrics,
+        wall_time_s=wall_time_s,
+    )
+
+
+def _rate_name(fps: Optional[float]) -> str:
+    return "max_speed" if fps is None else f"{fps:g}_fps"
+
+
+def compare_results(results: List[Dict], previous_results: List[Dict], tolerance_percent: float) -> None:
+    """Add each result's change from the result of the same name in a previous run, flagging slowdowns over the tolerance"""
+    previous_ms_per_frame = {result["name"]: result["ms_per_frame"] for result in previous_results}
+    for result in results:
+        previous = previous_ms_per_frame.get(result["name"])
+        if previous is None or result["ms_per_frame"] is None:
+            continue
+        change_percent = (result["ms_per_frame"] - previous) / previous * 100
+        result["previous_ms_per_frame"] = previous
+        result["change_percent"] = change_percent
+        result["regression"] = result["regression"] or change_percent > tolerance_percent
+
+
+def run_benchmarks(
+    output_folder: Optional[str | Path] = None,
+    benchmarks: Tuple[str, ...] = ("triangulation", "lightweight", "heavyweight"),
+    num_cameras: int = 3,
+    image_shape: Tuple[int, int, int] = (720, 1280, 3),
+    num_frames: int = 300,
+    fps: float = 30.0,
+    max_frames_in_flight: int = 1,
+    num_tracker_workers: Optional[int] = None,
+    keyframe_interval: int = 1,
+    target_tracking_ms: Optional[float] = None,
+    compare_to: Optional[str | Path] = None,
+    tolerance_percent: float = 10.0,
+    synchronized_video_folder_path: Optional[str | Path] = None,
+    calibration_toml_path: Optional[str | Path] = None,
+) -> Dict:
+    """
+    Run every benchmark at maximum speed and at `fps`, and write the results to `benchmark_results.json`.
+    The pipelines run on synthetic multiframes, or on the recording in `synchronized_video_folder_path`, see `benchmark_pipeline`.
+
+    A pipeline result is a regression if it ran on a recording and its median ms per frame is over its
+    `BASELINE_MS_PER_FRAME`, or, with `compare_to` (a previous `benchmark_results.json`), if it is more than
+    `tolerance_percent` slower than the previous run.
+    """
+    if output_folder is None:
+        output_folder = create_new_recording_folder_path(f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    output_folder = Path(output_folder)
+    output_folder.mkdir(parents=True, exist_ok=True)
+
+    results = []
+    for benchmark in benchmarks:
+        for rate in (None, fps):
+            print(f"running {benchmark} benchmark at {_rate_name(rate)}")
+            if benchmark == "triangulation":
+                result = benchmark_triangulation(num_cameras=num_cameras, num_frames=num_frames, fps=rate)
+            elif benchmark in BASELINE_MS_PER_FRAME:
+                result = benchmark_pipeline(
+                    output_folder=output_folder,
+                    use_heavyweight_pipeline=benchmark == "heavyweight",
+                    num_cameras=num_cameras,
+                    image_shape=image_shape,
+                    num_frames=num_frames,
+                    fps=rate,
+                    max_frames_in_flight=max_frames_in_flight,
+                    num_tracker_workers=num_tracker_workers,
+                    keyframe_interval=keyframe_interval,
+                    target_tracking_ms=target_tracking_ms,
+                    synchronized_video_folder_path=synchronized_video_folder_path,
+                    calibration_toml_path=calibration_toml_path,
+                )
+            else:
+                raise ValueError(f"Unknown benchmark {benchmark}, expected triangulation, lightweight or heavyweight")
+
+            baseline = None if synchronized_video_folder_path is None else BASELINE_MS_PER_FRAME.get(benchmark)
+            result["baseline_ms_per_frame"] = baseline
+            result["regression"] = (
+                rate is None and baseline is not None and result["ms_per_frame"] is not None and result["ms_per_frame"] > baseline
+            )
+            print(f"{result['name']}: {result['ms_per_frame']} ms per frame")
+            results.append(result)
+
+    if compare_to is not None:
+        with open(compare_to) as file:
+            compare_results(results=results, previous_results=json.load(file)["results"], tolerance_percent=tolerance_percent)
+
+    benchmark_results = {
+        "created": datetime.now().isoformat(),
+        "regression": any(result["regression"] for result in results),
+        "results": results,
+    }
+    results_path = output_folder / "benchmark_results.json"
+    with open(results_path, "w") as file:
+        json.dump(benchmark_results, file, indent=4)
+    print(f"saved benchmark results to {results_path}")
+    return benchmark_results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the realtime pipelines on synthetic data or a recording")
+    parser.add_argument("--benchmarks", nargs="+", default=["triangulation", "lightweight", "heavyweight"])
+    parser.add_argument("--output-folder", default=None)
+    parser.add_argument("--cameras", type=int, default=3)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--max-frames-in-flight", type=int, default=1)
+    parser.add_argument("--tracker-workers", type=int, default=None, help="defaults to one per core, up to cameras x frames in flight")
+    parser.add_argument("--keyframe-interval", type=int, default=1, help="run the tracker model every n frames")
+    parser.add_argument(
+        "--target-tracking-ms", type=float, default=None, help="adapt the model complexity to this tracking time"
+    )
+    parser.add_argument("--compare-to", default=None, help="previous benchmark_results.json to compare against")
+    parser.add_argument("--tolerance-percent", type=float, default=10.0)
+    parser.add_argument(
+        "--videos", default=None, help="synchronized video folder to run the pipelines on instead of synthetic frames"
+    )
+    parser.add_argument("--calibration", default=None, help="calibration toml of the --videos recording")
+    args = parser.parse_args()
+
+    benchmark_results = run_benchmarks(
+        output_folder=args.output_folder,
+        benchmarks=tuple(args.benchmarks),
+        num_cameras=args.cameras,
+        image_shape=(args.height, args.width, 3),
+        num_frames=args.frames,
+        fps=args.fps,
+        max_frames_in_flight=args.max_frames_in_flight,
+        num_tracker_workers=args.tracker_workers,
+        keyframe_interval=args.keyframe_interval,
+        target_tracking_ms=args.target_tracking_ms,
+        compare_to=args.compare_to,
+        tolerance_percent=args.tolerance_percent,
+        synchronized_video_folder_path=args.videos,
+        calibration_toml_path=args.calibration,
+    )
+    raise SystemExit(1 if benchmark_results["regression"] else 0)
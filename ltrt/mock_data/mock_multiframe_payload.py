@@ -1,4 +1,3 @@
-import multiprocessing
 from pathlib import Path
 import time
 from typing import Dict, Optional
@@ -6,9 +5,11 @@ import cv2
 
 from skellycam.core.frames.payloads.multi_frame_payload import MultiFramePayload
 from skellycam.core.frames.payloads.frame_payload import FramePayload
-from skellycam.core.frames.payloads.metadata.frame_metadata_enum import create_empty_frame_metadata
+from skellycam.core.frames.payloads.metadata.frame_metadata_enum import FRAME_METADATA_MODEL, create_empty_frame_metadata
 from skellytracker.utilities.get_video_paths import get_video_paths
 
+from ltrt.backend.ingest_queue import PayloadIngestQueue
+
 class MockMultiFramePayload:
     """
     Mocks a MultiFramePayload based on sample videos for testing purposes
@@ -28,7 +29,8 @@ class MockMultiFramePayload:
 
         self.current_payload = self.create_initial_payload()
         
-    def load_video_dict(self, synchronized_video_folder_path: str | Path) -> Dict[int, cv2.VideoCapture]:
+    @staticmethod
+    def load_video_dict(synchronized_video_folder_path: str | Path) -> Dict[int, cv2.VideoCapture]:
         video_paths = get_video_paths(path_to_video_folder=synchronized_video_folder_path)
 
         return {
@@ -42,6 +44,7 @@ class MockMultiFramePayload:
     def create_initial_payload(self):
         initial_payload =  MultiFramePayload.create_initial(camera_ids=list(self.video_dict.keys()))
         for camera_id, video_capture in self.video_dict.items():
+            pre_grab_timestamp_ns = time.perf_counter_ns()
             ret, frame = video_capture.read()
             if not ret:
                 print(f"Failed to read frame {self.current_payload.multi_frame_number} for camera {camera_id}")
@@ -50,15 +53,23 @@ class MockMultiFramePayload:
                 self.current_payload = None  # this ensures None is stuffed into Queue to signal processing is done, could be a better way to do this
                 return None
             metadata = create_empty_frame_metadata(camera_id=camera_id, frame_number=0)
+            self.add_grab_timestamps(metadata=metadata, pre_grab_timestamp_ns=pre_grab_timestamp_ns)
             frame = FramePayload.create(image=frame, metadata=metadata)
 
             initial_payload.add_frame(frame)
         return initial_payload
 
+    @staticmethod
+    def add_grab_timestamps(metadata, pre_grab_timestamp_ns: int) -> None:
+        """Stamp the frame like a real camera would, so capture to 3d latency can be measured downstream"""
+        metadata[FRAME_METADATA_MODEL.PRE_GRAB_TIMESTAMP_NS.value] = pre_grab_timestamp_ns
+        metadata[FRAME_METADATA_MODEL.POST_GRAB_TIMESTAMP_NS.value] = time.perf_counter_ns()
+
     def next_frame_payload(self) -> Optional[MultiFramePayload]:
         payload = MultiFramePayload.from_previous(previous=self.current_payload)
 
         for camera_id, video_capture in self.video_dict.items():
+            pre_grab_timestamp_ns = time.perf_counter_ns()
             ret, frame = video_capture.read()
             if not ret: # temporary limit for testing
                 print(f"Failed to read frame {self.current_payload.multi_frame_number} for camera {camera_id}")
@@ -67,6 +78,7 @@ class MockMultiFramePayload:
                 self.current_payload = None  # this ensures None is stuffed into Queue to signal processing is done, could be a better way to do this
                 return None
             metadata = create_empty_frame_metadata(camera_id=camera_id, frame_number=payload.multi_frame_number)
+            self.add_grab_timestamps(metadata=metadata, pre_grab_timestamp_ns=pre_grab_timestamp_ns)
             frame = FramePayload.create(image=frame, metadata=metadata)
 
             payload.add_frame(frame)
@@ -80,7 +92,7 @@ class MockMultiFramePayload:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close_video_dict()
 
-def mock_camera_input(camera_payload_queue: multiprocessing.Queue) -> None:
+def mock_camera_input(camera_payload_queue: PayloadIngestQueue) -> None:
     with MockMultiFramePayload() as mock_payload:
         while mock_payload.current_payload is not None:
             camera_payload_queue.put(mock_payload.current_payload)
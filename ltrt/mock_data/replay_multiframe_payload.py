@@ -0,0 +1,294 @@
+from enum import Enum
+from pathlib import Path
+from queue import Full, Queue
+import threading
+import time
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+from skellycam.core.frames.payloads.multi_frame_payload import MultiFramePayload
+from skellycam.core.frames.payloads.frame_payload import FramePayload
+from skellycam.core.frames.payloads.metadata.frame_metadata_enum import create_empty_frame_metadata
+
+from ltrt.backend.ingest_queue import PayloadIngestQueue
+from ltrt.mock_data.mock_multiframe_payload import MockMultiFramePayload
+from ltrt.system.streaming_npy_writer import StreamingNpyWriter
+
+
+class ReplayRate(str, Enum):
+    # the videos' own frame rate, on a fixed schedule
+    NATIVE = "native"
+    # as fast as the videos decode and the queue takes them
+    MAX_SPEED = "max_speed"
+    # `fps` multiframes per second, on a fixed schedule
+    FIXED = "fixed"
+
+
+class ReplayMultiFramePayload:
+    """
+    Replays synchronized videos as `MultiFramePayload`s, like `MockMultiFramePayload`, but without decoding in the caller's loop.
+
+    Each camera is decoded by its own thread into a queue of up to `read_ahead_frames` images (OpenCV releases the
+    GIL while decoding), so the cameras decode in parallel and decode jitter is absorbed before the payloads are made.
+    With `cache_path` (a `.npy` file), the first full pass through the videos is also written to it as a
+    (frames, cameras, height, width, 3) array, and later replays memory map it instead of decoding at all.
+    The cache is written to a `.partial.npy` file first, so a replay that stops early never leaves an incomplete cache.
+    With `loop`, the videos restart from the first frame when the shortest one ends, and multiframe numbers keep counting up.
+    `max_frames` stops the replay after that many multiframes.
+
+    Use like `MockMultiFramePayload`, with a context manager to stop the decode threads.
+    """
+
+    def __init__(
+        self,
+        synchronized_video_folder_path: str | Path | None = None,
+        read_ahead_frames: int = 8,
+        cache_path: str | Path | None = None,
+        loop: bool = False,
+        max_frames: Optional[int] = None,
+    ):
+        if synchronized_video_folder_path is None:
+            synchronized_video_folder_path = Path.home() / "freemocap_data/recording_sessions/freemocap_sample_data/synchronized_videos"
+        self.loop = loop
+        self.max_frames = max_frames
+        self.frames_replayed = 0
+
+        self.video_dict = MockMultiFramePayload.load_video_dict(synchronized_video_folder_path)
+        self.camera_ids = sorted(self.video_dict.keys())
+        if not self.camera_ids:
+            raise ValueError(f"No videos found in {synchronized_video_folder_path}")
+        # 0 if the container doesn't say
+        self.fps = self.video_dict[self.camera_ids[0]].get(cv2.CAP_PROP_FPS) or None
+
+        self.cache_path = None if cache_path is None else Path(cache_path)
+        self._cached_frames: Optional[np.ndarray] = None
+        self._cache_index = 0
+        self._cache_writer: Optional[StreamingNpyWriter] = None
+        self._stop_decoding = threading.Event()
+        self._frame_queues: Dict[int, Queue] = {}
+        self._decode_threads = []
+        if self.cache_path is not None and self.cache_path.exists():
+            self._load_cache()
+        else:
+            if self.cache_path is not None:
+                self._check_cacheable()
+                self._cache_writer = StreamingNpyWriter(self._partial_cache_path, dtype=np.uint8, chunk_frames=8)
+            self._start_decoding(read_ahead_frames=read_ahead_frames)
+
+        self.current_payload = self._add_frames(MultiFramePayload.create_initial(camera_ids=self.camera_ids))
+
+    @property
+    def _partial_cache_path(self) -> Path:
+        return self.cache_path.with_suffix(".partial.npy")
+
+    def _check_cacheable(self) -> None:
+        frame_sizes = {
+            (video_capture.get(cv2.CAP_PROP_FRAME_WIDTH), video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            for video_capture in self.video_dict.values()
+        }
+        if len(frame_sizes) > 1:
+            raise ValueError(f"Can only cache videos with the same frame size, got {sorted(frame_sizes)}")
+
+    def _load_cache(self) -> None:
+        self._cached_frames = np.load(self.cache_path, mmap_mode="r")
+        if self._cached_frames.ndim != 5 or self._cached_frames.shape[1] != len(self.camera_ids):
+            raise ValueError(
+                f"Cache {self.cache_path} has shape {self._cached_frames.shape}, expected (frames, {len(self.camera_ids)} cameras, height, width, 3)"
+            )
+        print(f"replaying {self._cached_frames.shape[0]} cached multiframes from {self.cache_path}")
+        self.close_video_dict()
+
+    def _start_decoding(self, read_ahead_frames: int) -> None:
+        for camera_id in self.camera_ids:
+            self._frame_queues[camera_id] = Queue(maxsize=read_ahead_frames)
+            decode_thread = threading.Thread(
+                target=decode_camera,
+                args=(self.video_dict[camera_id], self._frame_queues[camera_id], self._stop_decoding, self.loop),
+                name=f"decode_camera_{camera_id}",
+                daemon=True,
+            )
+            decode_thread.start()
+            self._decode_threads.append(decode_thread)
+
+    def _stop_decode_threads(self) -> None:
+        self._stop_decoding.set()
+        for decode_thread in self._decode_threads:
+            decode_thread.join()
+        self._decode_threads = []
+        self.close_video_dict()
+
+    def close_video_dict(self) -> None:
+        for video_capture in self.video_dict.values():
+            video_capture.release()
+
+    def _next_images(self) -> Optional[Dict[int, np.ndarray]]:
+        """The next image of every camera, or None once the replay is over"""
+        if self.max_frames is not None and self.frames_replayed >= self.max_frames:
+            return None
+        if self._cached_frames is not None:
+            if self._cache_index == len(self._cached_frames):
+                if not self.loop or len(self._cached_frames) == 0:
+                    return None
+                self._cache_index = 0
+            images = dict(zip(self.camera_ids, self._cached_frames[self._cache_index]))
+            self._cache_index += 1
+        else:
+            images = self._next_decoded_images()
+            if images is None:
+                # the end of a pass through the videos
+                self._finish_cache()
+                if not self.loop:
+                    # the longer videos' remaining frames are never replayed, so stop decoding them
+                    self._stop_decode_threads()
+                    return None
+                if self._cached_frames is not None:
+                    return self._next_images()
+                images = self._next_decoded_images()
+                if images is None:
+                    return None
+            if self._cache_writer is not None:
+                self._cache_writer.append(np.stack([images[camera_id] for camera_id in self.camera_ids]))
+        self.frames_replayed += 1
+        return images
+
+    def _next_decoded_images(self) -> Optional[Dict[int, np.ndarray]]:
+        images = {camera_id: self._frame_queues[camera_id].get() for camera_id in self.camera_ids}
+        if all(image is not None for image in images.values()):
+            return images
+        if not self.loop:
+            return None
+        # a video ended, skip the other cameras' remaining frames so every camera restarts from the same frame
+        for camera_id, image in images.items():
+            while image is not None:
+                image = self._frame_queues[camera_id].get()
+        return None
+
+    def _finish_cache(self) -> None:
+        """Once every frame has been decoded, move the cache into place and replay any loops from it"""
+        if self._cache_writer is None:
+            return
+        self._cache_writer.close()
+        self._cache_writer = None
+        self._partial_cache_path.replace(self.cache_path)
+        print(f"cached {self.frames_replayed} decoded multiframes to {self.cache_path}")
+        if self.loop:
+            self._stop_decode_threads()
+            self._cached_frames = np.load(self.cache_path, mmap_mode="r")
+
+    def _add_frames(self, payload: MultiFramePayload) -> Optional[MultiFramePayload]:
+        images = self._next_images()
+        if images is None:
+            print(f"Finished replaying {self.frames_replayed} multiframes")
+            return None
+        for camera_id in self.camera_ids:
+            pre_grab_timestamp_ns = time.perf_counter_ns()
+            metadata = create_empty_frame_metadata(camera_id=camera_id, frame_number=payload.multi_frame_number)
+            MockMultiFramePayload.add_grab_timestamps(metadata=metadata, pre_grab_timestamp_ns=pre_grab_timestamp_ns)
+            payload.add_frame(FramePayload.create(image=images[camera_id], metadata=metadata))
+        return payload
+
+    def next_frame_payload(self) -> Optional[MultiFramePayload]:
+        if self.current_payload is None:
+            return None
+        self.current_payload = self._add_frames(MultiFramePayload.from_previous(previous=self.current_payload))
+        return self.current_payload
+
+    def close(self) -> None:
+        self._stop_decode_threads()
+        if self._cache_writer is not None:
+            # stopped before the end of the videos, so the cache would be incomplete
+            self._cache_writer.close()
+            self._cache_writer = None
+            self._partial_cache_path.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def decode_camera(video_capture: cv2.VideoCapture, frame_queue: Queue, stop_event: threading.Event, loop: bool) -> None:
+    """
+    Decode thread of one camera: put its frames into `frame_queue`, then None at the end of the video.
+    With `loop`, it rewinds and keeps decoding after the None.
+    """
+    while not stop_event.is_set():
+        ret, image = video_capture.read()
+        if not ret:
+            _put_unless_stopped(frame_queue=frame_queue, item=None, stop_event=stop_event)
+            if not loop or not video_capture.set(cv2.CAP_PROP_POS_FRAMES, 0):
+                return
+            continue
+        _put_unless_stopped(frame_queue=frame_queue, item=image, stop_event=stop_event)
+
+
+def _put_unless_stopped(frame_queue: Queue, item, stop_event: threading.Event) -> None:
+    while not stop_event.is_set():
+        try:
+            frame_queue.put(item, timeout=0.1)
+            return
+        except Full:
+            continue
+
+
+def replay_frame_interval_s(rate: ReplayRate, fps: Optional[float], native_fps: Optional[float]) -> Optional[float]:
+    """Seconds between multiframes at `rate`, None for max speed"""
+    rate = ReplayRate(rate)
+    if rate == ReplayRate.MAX_SPEED:
+        return None
+    if rate == ReplayRate.FIXED:
+        if fps is None or fps <= 0:
+            raise ValueError(f"fixed replay rate needs fps > 0, got {fps}")
+        return 1 / fps
+    if native_fps is None:
+        raise ValueError("The videos don't report a frame rate, replay them at a fixed rate instead")
+    return 1 / native_fps
+
+
+def replay_camera_input(
+    camera_payload_queue: PayloadIngestQueue,
+    synchronized_video_folder_path: str | Path | None = None,
+    rate: ReplayRate = ReplayRate.NATIVE,
+    fps: Optional[float] = None,
+    loop: bool = False,
+    max_frames: Optional[int] = None,
+    cache_path: str | Path | None = None,
+    read_ahead_frames: int = 8,
+) -> None:
+    """
+    Camera input process for `run_realtime` that replays synchronized videos with a `ReplayMultiFramePayload`.
+
+    At the native or a fixed `rate`, multiframe n is sent at n frame intervals after the first, so the time spent
+    making payloads and putting them into the queue doesn't add up as drift. Multiframes that are sent after
+    their scheduled time (because decoding or the queue fell behind) are counted as late.
+    """
+    with ReplayMultiFramePayload(
+        synchronized_video_folder_path=synchronized_video_folder_path,
+        read_ahead_frames=read_ahead_frames,
+        cache_path=cache_path,
+        loop=loop,
+        max_frames=max_frames,
+    ) as replay:
+        frame_interval_s = replay_frame_interval_s(rate=rate, fps=fps, native_fps=replay.fps)
+        start = time.perf_counter()
+        frames_sent = 0
+        late_frames = 0
+        while replay.current_payload is not None:
+            camera_payload_queue.put(replay.current_payload)
+            frames_sent += 1
+            if frame_interval_s is not None:
+                wait_s = start + frames_sent * frame_interval_s - time.perf_counter()
+                if wait_s > 0:
+                    time.sleep(wait_s)
+                else:
+                    late_frames += 1
+            # the next multiframe is stamped after the wait, like a frame grabbed on schedule
+            replay.next_frame_payload()
+
+    camera_payload_queue.put(None)
+
+    elapsed_s = time.perf_counter() - start
+    print(f"replayed {frames_sent} multiframe payloads in {elapsed_s:.2f} s ({frames_sent / elapsed_s:.1f} per second), {late_frames} late")
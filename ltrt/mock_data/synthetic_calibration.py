@@ -0,0 +1,82 @@
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+from aniposelib.cameras import Camera, CameraGroup
+
+
+def create_synthetic_camera_group(
+    num_cameras: int = 3,
+    image_size: Tuple[int, int] = (1280, 720),
+    distance_mm: float = 3000.0,
+) -> CameraGroup:
+    """
+    Cameras spaced evenly on a circle around the origin, all looking at it from `distance_mm` away.
+
+    `image_size` is (width, height) like aniposelib's camera size. Cameras are named "cam_<index>",
+    with a small radial distortion so the undistortion step still does work.
+    """
+    width, height = image_size
+    focal_length = 0.8 * width
+    camera_matrix = np.array(
+        [
+            [focal_length, 0, width / 2],
+            [0, focal_length, height / 2],
+            [0, 0, 1],
+        ]
+    )
+    cameras = []
+    for camera_index in range(num_cameras):
+        angle = 2 * np.pi * camera_index / num_cameras
+        cameras.append(
+            Camera(
+                matrix=camera_matrix,
+                dist=np.array([0.01, 0, 0, 0, 0]),
+                size=[width, height],
+                # rotate the world around the vertical axis, then push it in front of the camera
+                rvec=np.array([0, angle, 0]),
+                tvec=np.array([0, 0, distance_mm]),
+                name=f"cam_{camera_index}",
+            )
+        )
+    return CameraGroup(cameras)
+
+
+def save_synthetic_calibration(
+    calibration_toml_path: str | Path,
+    num_cameras: int = 3,
+    image_size: Tuple[int, int] = (1280, 720),
+) -> Path:
+    """Write a synthetic calibration that `run_realtime` can load"""
+    calibration_toml_path = Path(calibration_toml_path)
+    calibration_toml_path.parent.mkdir(parents=True, exist_ok=True)
+    create_synthetic_camera_group(num_cameras=num_cameras, image_size=image_size).dump(str(calibration_toml_path))
+    return calibration_toml_path
+
+
+def create_synthetic_keypoints(
+    camera_group: CameraGroup,
+    num_markers: int = 543,
+    num_frames: int = 300,
+    missing_fraction: float = 0.05,
+    pixel_noise: float = 0.5,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    (cameras, frames, markers, 2) pixel coordinates of markers moving around the origin, as the trackers would output them.
+
+    Markers are projected through `camera_group` with `pixel_noise` pixels of gaussian noise,
+    and `missing_fraction` of the observations are NaN, like landmarks a tracker didn't find.
+    """
+    random_generator = np.random.default_rng(seed)
+    rest_positions = random_generator.uniform(-500, 500, size=(num_markers, 3))
+    phases = random_generator.uniform(0, 2 * np.pi, size=(num_markers, 3))
+    frame_times = np.arange(num_frames)[:, np.newaxis, np.newaxis] / 30
+    marker_positions = rest_positions + 50 * np.sin(2 * np.pi * frame_times + phases)  # (frames, markers, 3)
+
+    keypoints = camera_group.project(marker_positions.reshape(-1, 3)).reshape(
+        len(camera_group.cameras), num_frames, num_markers, 2
+    )
+    keypoints += random_generator.normal(scale=pixel_noise, size=keypoints.shape)
+    keypoints[random_generator.random(keypoints.shape[:-1]) < missing_fraction] = np.nan
+    return keypoints
@@ -0,0 +1,92 @@
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from skellycam.core.frames.payloads.multi_frame_payload import MultiFramePayload
+from skellycam.core.frames.payloads.frame_payload import FramePayload
+from skellycam.core.frames.payloads.metadata.frame_metadata_enum import create_empty_frame_metadata
+
+from ltrt.backend.ingest_queue import PayloadIngestQueue
+from ltrt.mock_data.mock_multiframe_payload import MockMultiFramePayload
+
+
+class SyntheticMultiFramePayload:
+    """
+    Generates `MultiFramePayload`s of random images, for benchmarking without sample videos or decode time.
+
+    A small bank of `num_unique_images` random images is made per camera up front and cycled through,
+    so generating a payload costs about as much as a camera handing over a frame.
+    Random images have no person in them, so trackers run their detection step but find no landmarks.
+
+    Use like `MockMultiFramePayload`:
+    generator = SyntheticMultiFramePayload(camera_ids=[0, 1, 2], image_shape=(720, 1280, 3), num_frames=100)
+    while generator.current_payload is not None:
+        queue.put(generator.current_payload)
+        generator.next_frame_payload()
+    """
+
+    def __init__(
+        self,
+        camera_ids: List[int],
+        image_shape: Tuple[int, int, int] = (720, 1280, 3),
+        num_frames: int = 300,
+        num_unique_images: int = 4,
+        seed: int = 0,
+    ):
+        self.camera_ids = list(camera_ids)
+        self.num_frames = num_frames
+        random_generator = np.random.default_rng(seed)
+        self.images = {
+            camera_id: [random_generator.integers(0, 256, size=image_shape, dtype=np.uint8) for _ in range(num_unique_images)]
+            for camera_id in self.camera_ids
+        }
+        self.current_payload: Optional[MultiFramePayload] = None
+        if num_frames > 0:
+            self.current_payload = self._add_frames(MultiFramePayload.create_initial(camera_ids=self.camera_ids))
+
+    def _add_frames(self, payload: MultiFramePayload) -> MultiFramePayload:
+        for camera_id in self.camera_ids:
+            camera_images = self.images[camera_id]
+            pre_grab_timestamp_ns = time.perf_counter_ns()
+            image = camera_images[payload.multi_frame_number % len(camera_images)]
+            metadata = create_empty_frame_metadata(camera_id=camera_id, frame_number=payload.multi_frame_number)
+            MockMultiFramePayload.add_grab_timestamps(metadata=metadata, pre_grab_timestamp_ns=pre_grab_timestamp_ns)
+            payload.add_frame(FramePayload.create(image=image, metadata=metadata))
+        return payload
+
+    def next_frame_payload(self) -> Optional[MultiFramePayload]:
+        if self.current_payload is None or self.current_payload.multi_frame_number + 1 >= self.num_frames:
+            self.current_payload = None
+            return None
+        self.current_payload = self._add_frames(MultiFramePayload.from_previous(previous=self.current_payload))
+        return self.current_payload
+
+
+def synthetic_camera_input(
+    camera_payload_queue: PayloadIngestQueue,
+    camera_ids: List[int],
+    image_shape: Tuple[int, int, int] = (720, 1280, 3),
+    num_frames: int = 300,
+    fps: Optional[float] = None,
+) -> None:
+    """
+    Camera input process for `run_realtime` that sends synthetic multiframes.
+
+    With `fps=None` multiframes are sent as fast as the queue takes them, otherwise one every 1 / `fps` seconds,
+    paced against a fixed schedule so time spent putting into the queue doesn't add up as drift.
+    """
+    generator = SyntheticMultiFramePayload(camera_ids=camera_ids, image_shape=image_shape, num_frames=num_frames)
+
+    next_frame_time = time.perf_counter()
+    while generator.current_payload is not None:
+        camera_payload_queue.put(generator.current_payload)
+        if fps is not None:
+            next_frame_time += 1 / fps
+            time.sleep(max(0.0, next_frame_time - time.perf_counter()))
+        # the next multiframe is stamped after the wait, like a frame grabbed on schedule
+        generator.next_frame_payload()
+
+    camera_payload_queue.put(None)
+
+    print(f"sent {num_frames} synthetic multiframe payloads")
@@ -0,0 +1,155 @@
+import logging
+import threading
+from pathlib import Path
+from queue import Queue
+from typing import Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+NPY_MAGIC = b"\x93NUMPY"
+
+
+class StreamingNpyWriter:
+    """
+    Appends frames to a `.npy` file from a background thread, so memory use stays bounded for the whole session.
+
+    Frames are copied into chunks of `chunk_frames` and written into a memory mapped array that is preallocated
+    on disk and doubled in size when it fills up. The `.npy` header is written with a fixed amount of padding, so
+    after every chunk it can be rewritten in place with the number of frames written so far. If the process dies
+    mid-session, the file is still a valid array of every frame up to the last written chunk.
+    `close()` writes the remaining frames and trims the preallocated space off the end of the file.
+    """
+
+    def __init__(
+        self,
+        file_path: str | Path,
+        dtype: np.dtype | str = np.float64,
+        chunk_frames: int = 30,
+        initial_capacity_frames: int = 1024,
+    ):
+        self.file_path = Path(file_path)
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        self.dtype = np.dtype(dtype)
+        self.chunk_frames = chunk_frames
+        self.capacity_frames = initial_capacity_frames
+
+        self.frame_shape: Optional[Tuple[int, ...]] = None
+        self.frames_written = 0
+        self._header_length = 0
+        self._memmap: Optional[np.memmap] = None
+        self._chunk: Optional[np.ndarray] = None
+        self._chunk_count = 0
+
+        self._frame_queue: Queue = Queue()
+        self._writer_error: Optional[BaseException] = None
+        self._writer_thread = threading.Thread(target=self._run_writer, name="StreamingNpyWriter", daemon=True)
+        self._writer_thread.start()
+
+    def append(self, frame: np.ndarray) -> None:
+        """Queue a frame to be written, returns immediately"""
+        if self._writer_error is not None:
+            raise RuntimeError(f"Writing to {self.file_path} failed") from self._writer_error
+        self._frame_queue.put(frame)
+
+    def close(self) -> None:
+        """Write every queued frame and finalize the file"""
+        self._frame_queue.put(None)
+        self._writer_thread.join()
+        if self._writer_error is not None:
+            raise RuntimeError(f"Writing to {self.file_path} failed") from self._writer_error
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return (self.frames_written, *(self.frame_shape or ()))
+
+    def _run_writer(self) -> None:
+        try:
+            while True:
+                frame = self._frame_queue.get()
+                if frame is None:
+                    break
+                self._add_to_chunk(frame)
+            self._flush_chunk()
+            self._finalize()
+        except BaseException as error:
+            logger.exception(f"Streaming writer for {self.file_path} failed")
+            self._writer_error = error
+
+    def _add_to_chunk(self, frame: np.ndarray) -> None:
+        if self.frame_shape is None:
+            self._create_file(frame_shape=frame.shape)
+        elif frame.shape != self.frame_shape:
+            raise ValueError(f"Frame shape {frame.shape} does not match the first frame's shape {self.frame_shape}")
+        self._chunk[self._chunk_count] = frame
+        self._chunk_count += 1
+        if self._chunk_count == self.chunk_frames:
+            self._flush_chunk()
+
+    def _create_file(self, frame_shape: Tuple[int, ...]) -> None:
+        self.frame_shape = tuple(frame_shape)
+        self._chunk = np.empty((self.chunk_frames, *self.frame_shape), dtype=self.dtype)
+        # size the header for the largest frame count it could ever hold, so rewriting it never moves the data
+        self._header_length = len(self._header_bytes(frame_count=np.iinfo(np.int64).max))
+        with open(self.file_path, "wb") as file:
+            file.write(self._header_bytes(frame_count=0))
+        self._map_capacity()
+        logger.info(f"Streaming frames of shape {self.frame_shape} to {self.file_path}")
+
+    def _header_bytes(self, frame_count: int) -> bytes:
+        header = repr(
+            {
+                "descr": np.lib.format.dtype_to_descr(self.dtype),
+                "fortran_order": False,
+                "shape": (frame_count, *self.frame_shape),
+            }
+        )
+        # npy version 1.0: magic, version, little endian uint16 header length, header padded with spaces to a multiple of 64 bytes
+        prefix_length = len(NPY_MAGIC) + 2 + 2
+        total_length = self._header_length or -(-(prefix_length + len(header) + 1) // 64) * 64
+        header = header.ljust(total_length - prefix_length - 1) + "\n"
+        return NPY_MAGIC + bytes([1, 0]) + len(header).to_bytes(2, "little") + header.encode("latin1")
+
+    def _map_capacity(self) -> None:
+        if self._memmap is not None:
+            self._memmap.flush()
+            self._memmap = None
+        frame_bytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        with open(self.file_path, "r+b") as file:
+            file.truncate(self._header_length + self.capacity_frames * frame_bytes)
+        self._memmap = np.memmap(
+            self.file_path,
+            dtype=self.dtype,
+            mode="r+",
+            offset=self._header_length,
+            shape=(self.capacity_frames, *self.frame_shape),
+        )
+
+    def _flush_chunk(self) -> None:
+        if self._chunk_count == 0:
+            return
+        while self.frames_written + self._chunk_count > self.capacity_frames:
+            self.capacity_frames *= 2
+            self._map_capacity()
+        self._memmap[self.frames_written : self.frames_written + self._chunk_count] = self._chunk[: self._chunk_count]
+        self._memmap.flush()
+        self.frames_written += self._chunk_count
+        self._chunk_count = 0
+        # the header only counts frames that are already on disk
+        self._write_header()
+
+    def _write_header(self) -> None:
+        with open(self.file_path, "r+b") as file:
+            file.write(self._header_bytes(frame_count=self.frames_written))
+
+    def _finalize(self) -> None:
+        if self.frame_shape is None:
+            logger.info(f"No frames were written to {self.file_path}")
+            return
+        self._memmap.flush()
+        self._memmap = None
+        frame_bytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        with open(self.file_path, "r+b") as file:
+            file.truncate(self._header_length + self.frames_written * frame_bytes)
+        self._write_header()